@@ -0,0 +1,48 @@
+"""auto
+
+Revision ID: a81618e67333
+Revises: 456d4ab2998a
+Create Date: 2026-10-18 09:12:04.518203+00:00
+
+"""
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a81618e67333'
+down_revision = '456d4ab2998a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sa.schema.CreateSequence(sa.Sequence('transaction_seq')))
+    op.add_column('transaction', sa.Column('seq', sa.BigInteger(), nullable=True))
+    # existing ledger is numbered in the creation order
+    op.execute("""
+        UPDATE transaction SET seq = numbered.seq
+        FROM (
+            SELECT id, nextval('transaction_seq') AS seq
+            FROM (SELECT id FROM transaction ORDER BY date_created, id) ordered
+        ) numbered
+        WHERE transaction.id = numbered.id
+    """)
+    op.alter_column('transaction', 'seq',
+                    nullable=False,
+                    server_default=sa.text("nextval('transaction_seq')"))
+    op.create_table('balance_checkpoint',
+    sa.Column('account_id', postgresql.UUID(), nullable=False),
+    sa.Column('seq', sa.BigInteger(), nullable=False),
+    sa.Column('amount', sa.Numeric(precision=12, scale=2), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['account_id'], ['user_account.id'], ),
+    sa.PrimaryKeyConstraint('account_id', 'seq')
+    )
+
+
+def downgrade():
+    op.drop_table('balance_checkpoint')
+    op.drop_column('transaction', 'seq')
+    op.execute(sa.schema.DropSequence(sa.Sequence('transaction_seq')))
@@ -0,0 +1,37 @@
+"""auto
+
+Revision ID: 03893819591e
+Revises: a81618e67333
+Create Date: 2026-10-18 10:03:27.114305+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '03893819591e'
+down_revision = 'a81618e67333'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_transaction_seq'), 'transaction', ['seq'], unique=True)
+    op.create_index('ix_transaction_account_id_committed', 'transaction', ['account_id', 'seq', 'amount'],
+                    unique=False, postgresql_where=sa.text("status = 'COMMITTED'"))
+    op.create_index('ix_transaction_account_id_date_created', 'transaction', ['account_id', 'date_created', 'id'],
+                    unique=False)
+    op.create_index('ix_transaction_pending', 'transaction', ['seq'],
+                    unique=False, postgresql_where=sa.text("status = 'NEW'"))
+    op.create_index(op.f('ix_user_wallet_account_id'), 'user_wallet', ['account_id'], unique=True)
+    op.create_index(op.f('ix_user_bank_account_account_id'), 'user_bank_account', ['account_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_user_bank_account_account_id'), table_name='user_bank_account')
+    op.drop_index(op.f('ix_user_wallet_account_id'), table_name='user_wallet')
+    op.drop_index('ix_transaction_pending', table_name='transaction')
+    op.drop_index('ix_transaction_account_id_date_created', table_name='transaction')
+    op.drop_index('ix_transaction_account_id_committed', table_name='transaction')
+    op.drop_index(op.f('ix_transaction_seq'), table_name='transaction')
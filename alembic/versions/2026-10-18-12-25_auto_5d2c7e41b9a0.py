@@ -0,0 +1,138 @@
+"""auto
+
+Revision ID: 5d2c7e41b9a0
+Revises: 98350413b628
+Create Date: 2026-10-18 12:25:41.306118+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5d2c7e41b9a0'
+down_revision = '98350413b628'
+branch_labels = None
+depends_on = None
+
+_INDEXES = (
+    'ix_transaction_seq',
+    'ix_transaction_account_id_committed',
+    'ix_transaction_account_id_date_created',
+    'ix_transaction_pending',
+)
+
+
+def upgrade():
+    # existing ledger is copied into the monthly partitions below, so the old months
+    # are detached and archived like the later ones, unique keys of the partitioned
+    # table must include the partition key
+    op.rename_table('transaction', 'transaction_legacy')
+    op.drop_constraint('transaction_id_key', 'transaction_legacy')
+    op.drop_constraint('transaction_pkey', 'transaction_legacy')
+    for name in _INDEXES:
+        op.drop_index(name, table_name='transaction_legacy')
+
+    op.create_table('transaction',
+    sa.Column('id', sa.dialects.postgresql.UUID(), nullable=False),
+    sa.Column('seq', sa.BigInteger(), server_default=sa.text("nextval('transaction_seq')"), nullable=False),
+    sa.Column('account_id', sa.dialects.postgresql.UUID(), nullable=False),
+    sa.Column('amount', sa.Numeric(precision=12, scale=2), nullable=False),
+    sa.Column('kind', sa.dialects.postgresql.ENUM(name='transactiontype', create_type=False), nullable=False),
+    sa.Column('status', sa.dialects.postgresql.ENUM(name='transactionstatus', create_type=False), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['account_id'], ['user_account.id'], name='transaction_account_id_fkey'),
+    sa.PrimaryKeyConstraint('id', 'date_created', name='transaction_pkey'),
+    postgresql_partition_by='RANGE (date_created)',
+    )
+    op.create_index(op.f('ix_transaction_seq'), 'transaction', ['seq'], unique=False)
+    op.create_index('ix_transaction_account_id_committed', 'transaction', ['account_id', 'seq', 'amount'],
+                    unique=False, postgresql_where=sa.text("status = 'COMMITTED'"))
+    op.create_index('ix_transaction_account_id_date_created', 'transaction', ['account_id', 'date_created', 'id'],
+                    unique=False)
+    op.create_index('ix_transaction_pending', 'transaction', ['seq'],
+                    unique=False, postgresql_where=sa.text("status = 'NEW'"))
+    # partitions of the months without transactions are created by the application,
+    # indexes are built on attach after the rows are loaded
+    op.execute("""
+        DO $$
+        DECLARE
+            month timestamp;
+            name text;
+        BEGIN
+            FOR month IN SELECT DISTINCT date_trunc('month', date_created) FROM transaction_legacy LOOP
+                name := 'transaction_' || to_char(month, '"y"YYYY"m"MM');
+                EXECUTE format('CREATE TABLE %I (LIKE transaction INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', name);
+                EXECUTE format(
+                    'INSERT INTO %I (id, seq, account_id, amount, kind, status, date_created) '
+                    'SELECT id, seq, account_id, amount, kind, status, date_created FROM transaction_legacy '
+                    'WHERE date_created >= %L AND date_created < %L',
+                    name, month, month + interval '1 month'
+                );
+                EXECUTE format(
+                    'ALTER TABLE transaction ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    name, month, month + interval '1 month'
+                );
+            END LOOP;
+        END
+        $$
+    """)
+    op.drop_table('transaction_legacy')
+    op.execute('CREATE TABLE transaction_default PARTITION OF transaction DEFAULT')
+
+    op.add_column('balance_checkpoint', sa.Column('date_from', sa.DateTime(), nullable=True))
+    op.execute("""
+        UPDATE balance_checkpoint SET date_from = coalesce(
+            (SELECT date_created FROM transaction WHERE seq = balance_checkpoint.seq) - interval '1 hour',
+            '-infinity'
+        )
+    """)
+    op.alter_column('balance_checkpoint', 'date_from', nullable=False)
+
+    op.create_table('ledger_partition',
+    sa.Column('name', sa.String(length=63), nullable=False),
+    sa.Column('date_from', sa.Date(), nullable=False),
+    sa.Column('date_to', sa.Date(), nullable=False),
+    sa.Column('seq_max', sa.BigInteger(), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('ledger_partition')
+    op.drop_column('balance_checkpoint', 'date_from')
+
+    # ledger is merged back into a plain table, detached partitions are left as is
+    op.execute('ALTER TABLE transaction RENAME TO transaction_partitioned')
+    op.execute('ALTER TABLE transaction_partitioned RENAME CONSTRAINT transaction_pkey TO transaction_partitioned_pkey')
+    op.execute('ALTER TABLE transaction_partitioned '
+               'RENAME CONSTRAINT transaction_account_id_fkey TO transaction_partitioned_account_id_fkey')
+    for name in _INDEXES:
+        op.execute(f'ALTER INDEX {name} RENAME TO {name}_partitioned')
+    op.execute("""
+        CREATE TABLE transaction (
+            id uuid NOT NULL,
+            account_id uuid NOT NULL,
+            amount numeric(12, 2) NOT NULL,
+            kind transactiontype NOT NULL,
+            status transactionstatus NOT NULL,
+            date_created timestamp NOT NULL,
+            seq bigint DEFAULT nextval('transaction_seq') NOT NULL
+        )
+    """)
+    op.execute("""
+        INSERT INTO transaction (id, account_id, amount, kind, status, date_created, seq)
+        SELECT id, account_id, amount, kind, status, date_created, seq FROM transaction_partitioned
+    """)
+    op.execute('DROP TABLE transaction_partitioned')
+    op.create_primary_key('transaction_pkey', 'transaction', ['id'])
+    op.create_unique_constraint('transaction_id_key', 'transaction', ['id'])
+    op.create_foreign_key('transaction_account_id_fkey', 'transaction', 'user_account', ['account_id'], ['id'])
+    op.create_index(op.f('ix_transaction_seq'), 'transaction', ['seq'], unique=True)
+    op.create_index('ix_transaction_account_id_committed', 'transaction', ['account_id', 'seq', 'amount'],
+                    unique=False, postgresql_where=sa.text("status = 'COMMITTED'"))
+    op.create_index('ix_transaction_account_id_date_created', 'transaction', ['account_id', 'date_created', 'id'],
+                    unique=False)
+    op.create_index('ix_transaction_pending', 'transaction', ['seq'],
+                    unique=False, postgresql_where=sa.text("status = 'NEW'"))
@@ -0,0 +1,32 @@
+"""auto
+
+Revision ID: a3e9f1c6d8b2
+Revises: 5d2c7e41b9a0
+Create Date: 2026-10-18 13:05:12.482913+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a3e9f1c6d8b2'
+down_revision = '5d2c7e41b9a0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user_wallet',
+                  sa.Column('held', sa.Numeric(precision=12, scale=2), server_default=sa.text('0'), nullable=False))
+    # holds are pending until captured or voided, so they bound the balance checkpoints too
+    op.drop_index('ix_transaction_pending', table_name='transaction')
+    op.create_index('ix_transaction_pending', 'transaction', ['seq'],
+                    unique=False, postgresql_where=sa.text("status IN ('NEW', 'HOLD')"))
+
+
+def downgrade():
+    op.drop_index('ix_transaction_pending', table_name='transaction')
+    op.create_index('ix_transaction_pending', 'transaction', ['seq'],
+                    unique=False, postgresql_where=sa.text("status = 'NEW'"))
+    op.drop_column('user_wallet', 'held')
@@ -0,0 +1,64 @@
+"""auto
+
+Revision ID: 0f6b3d9e2a41
+Revises: e54b8d2c1a76
+Create Date: 2026-10-18 14:50:37.105226+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0f6b3d9e2a41'
+down_revision = 'e54b8d2c1a76'
+branch_labels = None
+depends_on = None
+
+UTC_NOW = "(now() at time zone 'utc')"
+
+TIMESTAMPS = (
+    ('user_account', ('date_created', 'date_updated')),
+    ('user_wallet', ('date_created', 'date_updated')),
+    ('user_bank_account', ('date_created', 'date_updated')),
+    ('transaction', ('date_created',)),
+    ('balance_checkpoint', ('date_created',)),
+    ('idempotency_key', ('date_created',)),
+    ('transfer_operation', ('date_created',)),
+    ('ledger_partition', ('date_created',)),
+)
+
+# (table, column of the ledger account)
+ACCOUNTS = (
+    ('user_account', 'id'),
+    ('user_wallet', 'account_id'),
+    ('user_bank_account', 'account_id'),
+)
+
+
+def upgrade():
+    for table, columns in TIMESTAMPS:
+        for column in columns:
+            op.alter_column(table, column, server_default=sa.text(UTC_NOW))
+    # creation dates used to be evaluated once per process, rows sharing one are moved
+    # to the first transaction of their account, the earliest date known to be right.
+    # Ledger rows keep their dates, they were written in the local time of the
+    # application and its time zone is not known here.
+    for table, account_id in ACCOUNTS:
+        op.execute(f"""
+            UPDATE {table} SET date_created = greatest(date_created, (
+                SELECT min(t.date_created) FROM transaction t WHERE t.account_id = {table}.{account_id}
+            ))
+            WHERE id IN (
+                SELECT id FROM (SELECT id, count(*) OVER (PARTITION BY date_created) AS same FROM {table}) dates
+                WHERE same > 1
+            )
+        """)
+        op.execute(f'UPDATE {table} SET date_updated = date_created WHERE date_updated < date_created')
+
+
+def downgrade():
+    # repaired dates are kept
+    for table, columns in TIMESTAMPS:
+        for column in columns:
+            op.alter_column(table, column, server_default=None)
@@ -0,0 +1,296 @@
+"""
+Wallet API benchmark.
+
+Drives ``main.app`` in process against a scratch Postgres database and
+reports latency percentiles, throughput and database round trips of every
+operation, round trips are read from the ``Server-Timing`` header.
+
+Usage: ``python benchmark.py --concurrency 32 --output bench.json``.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import random
+import re
+import subprocess
+import time
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+)
+from uuid import uuid4
+
+from httpx import AsyncClient
+from sqlalchemy.engine.url import URL
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy_utils import (
+    create_database,
+    drop_database,
+)
+
+from main import (
+    app,
+    init_app,
+    shutdown_app,
+)
+from wallet.conf import (
+    DB_DSN_KW,
+    settings,
+)
+from wallet.models import (
+    ASSETS,
+    Asset,
+    db,
+)
+
+SCENARIOS = ('create', 'deposit', 'send_uniform', 'send_zipf', 'balance', 'history')
+
+# statements count reported by the timing middleware
+_DB_TIMING = re.compile(r'\bdb;dur=([0-9.]+);desc="(\d+) statements"')
+
+
+def percentile(values: List[float], rank: float) -> float:
+    """
+    Nearest rank percentile.
+
+    :param values: sorted values
+    :param rank: percentile from 0 to 100
+    :return: value
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(rank / 100 * len(values)) - 1))]
+
+
+class Scenario:
+    """Latencies and round trips of one benchmarked operation."""
+
+    def __init__(self, name: str) -> None:  # noqa: D107
+        self.name = name
+        self.latencies: List[float] = []
+        self.round_trips: List[int] = []
+        self.db_times: List[float] = []
+        self.errors = 0
+        self.elapsed = 0.0
+
+    async def measure(self, request: Callable[[], Awaitable]) -> object:
+        """
+        Make the request measuring its latency and database round trips.
+
+        :param request: request coroutine function
+        :return: response
+        """
+        start = time.perf_counter()
+        response = await request()
+        self.latencies.append(time.perf_counter() - start)
+        timing = _DB_TIMING.search(response.headers.get('Server-Timing', ''))
+        if timing is not None:
+            self.db_times.append(float(timing[1]) / 1000)
+            self.round_trips.append(int(timing[2]))
+        if response.status_code >= 400:
+            self.errors += 1
+        return response
+
+    def report(self) -> dict:
+        """
+        Summarize the measurements.
+
+        :return: report
+        """
+        latencies = sorted(self.latencies)
+        return {
+            'requests': len(latencies),
+            'errors': self.errors,
+            'tps': len(latencies) / self.elapsed if self.elapsed else 0.0,
+            'latency_ms': {
+                'p50': percentile(latencies, 50) * 1000,
+                'p95': percentile(latencies, 95) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+                'max': (latencies[-1] if latencies else 0.0) * 1000,
+            },
+            'round_trips': sum(self.round_trips) / len(self.round_trips) if self.round_trips else 0.0,
+            'db_ms': sum(self.db_times) / len(self.db_times) * 1000 if self.db_times else 0.0,
+        }
+
+
+async def _run(scenario: Scenario, requests: int, concurrency: int, request: Callable[[int], Awaitable]) -> None:
+    queue = iter(range(requests))
+
+    async def worker() -> None:
+        for number in queue:
+            await scenario.measure(lambda: request(number))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    scenario.elapsed = time.perf_counter() - start
+
+
+def zipf_weights(size: int, exponent: float) -> List[float]:
+    """
+    Zipf distribution weights, the first item is the hottest one.
+
+    :param size: number of items
+    :param exponent: distribution exponent
+    :return: weights
+    """
+    return [1 / rank ** exponent for rank in range(1, size + 1)]
+
+
+async def run(client: AsyncClient, wallets: int = 100, requests: int = 1000, concurrency: int = 16,
+              zipf: float = 1.1, scenarios: tuple = SCENARIOS, seed: Optional[int] = None,
+              asset: str = settings.ASSET_DEFAULT) -> Dict[str, dict]:
+    """
+    Run the benchmark scenarios one after another.
+
+    Wallets created by the ``create`` scenario are funded by the ``deposit``
+    one and used by the rest, setup requests are not measured if those
+    scenarios are skipped.
+
+    :param client: application client
+    :param wallets: number of wallets
+    :param requests: number of requests made by every scenario
+    :param concurrency: number of concurrent clients
+    :param zipf: exponent of the hot wallet skewed transfers distribution
+    :param scenarios: scenarios to run
+    :param seed: random seed
+    :param asset: asset of the wallets
+    :return: report by scenario
+    """
+    rand = random.Random(seed)
+    # wallets get the largest deposits and send the smallest amounts of the asset
+    limits = next(row for row in ASSETS if row['code'] == asset)
+    results = {name: Scenario(name) for name in SCENARIOS}
+    ids: List[str] = []
+
+    async def create(number: int) -> object:
+        response = await client.post('/wallet', json={'user_id': str(uuid4()), 'asset': asset})
+        if response.status_code == 201:
+            ids.append(response.json()['id'])
+        return response
+
+    async def deposit(number: int) -> object:
+        return await client.post(f'/wallet/{ids[number % len(ids)]}/deposit',
+                                 json={'bank_account_id': str(uuid4()), 'amount': str(limits['max_amount'])})
+
+    def send(weights: Optional[List[float]]) -> Callable[[int], Awaitable]:
+        async def _send(number: int) -> object:
+            source, target = rand.choices(ids, weights, k=2) if weights else rand.sample(ids, 2)
+            if source == target:
+                target = ids[(ids.index(source) + 1) % len(ids)]
+            return await client.post(f'/wallet/{source}/send',
+                                     json={'target_wallet_id': target, 'amount': str(limits['min_amount'])})
+        return _send
+
+    async def balance(number: int) -> object:
+        return await client.get(f'/wallet/{rand.choice(ids)}')
+
+    cursors: Dict[str, str] = {}
+
+    async def history(number: int) -> object:
+        # wallets are paged through in turns, every page is a separate request
+        wallet_id = ids[number % len(ids)]
+        params = {'limit': 10}
+        if wallet_id in cursors:
+            params['after'] = cursors.pop(wallet_id)
+        response = await client.get(f'/wallet/{wallet_id}/history', params=params)
+        if 'X-Next-Cursor' in response.headers:
+            cursors[wallet_id] = response.headers['X-Next-Cursor']
+        return response
+
+    operations = {
+        'create': (create, wallets),
+        'deposit': (deposit, wallets),
+        'send_uniform': (send(None), requests),
+        'send_zipf': (send(zipf_weights(wallets, zipf)), requests),
+        'balance': (balance, requests),
+        'history': (history, requests),
+    }
+    for name in ('create', 'deposit'):
+        if name not in scenarios:
+            await _run(Scenario(name), wallets, concurrency, operations[name][0])
+    for name in SCENARIOS:
+        if name in scenarios:
+            request, count = operations[name]
+            await _run(results[name], count, concurrency, request)
+    return {name: results[name].report() for name in SCENARIOS if name in scenarios}
+
+
+def _revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(('git', 'rev-parse', 'HEAD'), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args: argparse.Namespace) -> dict:
+    """
+    Run the benchmark against a scratch database.
+
+    :param args: command line arguments
+    :return: report
+    """
+    dsn_kw = {**DB_DSN_KW, 'database': args.database}
+    dsn_alembic = str(URL(drivername='postgresql', **dsn_kw))
+    try:
+        create_database(dsn_alembic)
+    except ProgrammingError:
+        drop_database(dsn_alembic)
+        create_database(dsn_alembic)
+    try:
+        dsn = URL(drivername='asyncpg', **dsn_kw)
+        # pool connections prepare the hot path statements, so the schema goes first
+        async with db.with_bind(dsn):
+            await db.gino.create_all()
+            await db.status(db.text('CREATE TABLE transaction_default PARTITION OF transaction DEFAULT'))
+            await Asset.insert().values(list(ASSETS)).gino.status()
+        await init_app(dsn, None)
+        async with AsyncClient(app=app, base_url='http://benchmark') as client:
+            scenarios = await run(client, wallets=args.wallets, requests=args.requests,
+                                  concurrency=args.concurrency, zipf=args.zipf,
+                                  scenarios=tuple(args.scenario or SCENARIOS), seed=args.seed, asset=args.asset)
+        await shutdown_app()
+        await db.pop_bind().close()
+    finally:
+        drop_database(dsn_alembic)
+    return {
+        'revision': _revision(),
+        'date': datetime.datetime.utcnow().isoformat(),
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'scenarios': scenarios,
+    }
+
+
+def _print(report: dict) -> None:
+    print(f'{"scenario":<14}{"requests":>10}{"errors":>8}{"tps":>10}'  # noqa: T001
+          f'{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"round trips":>13}{"db ms":>10}')
+    for name, result in report['scenarios'].items():
+        latency = result['latency_ms']
+        print(f'{name:<14}{result["requests"]:>10}{result["errors"]:>8}{result["tps"]:>10.1f}'  # noqa: T001
+              f'{latency["p50"]:>10.2f}{latency["p95"]:>10.2f}{latency["p99"]:>10.2f}{result["round_trips"]:>13.2f}'
+              f'{result["db_ms"]:>10.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python benchmark.py')
+    parser.add_argument('--database', default=f'bench_{DB_DSN_KW["database"]}',
+                        help='scratch database, it is dropped after the run')
+    parser.add_argument('--wallets', type=int, default=100, help='number of wallets')
+    parser.add_argument('--requests', type=int, default=1000, help='requests made by every transfer and read scenario')
+    parser.add_argument('--concurrency', type=int, default=16, help='number of concurrent clients')
+    parser.add_argument('--zipf', type=float, default=1.1, help='exponent of the hot wallet skewed transfers')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='scenario to run, all by default')
+    parser.add_argument('--seed', type=int, help='random seed')
+    parser.add_argument('--asset', default=settings.ASSET_DEFAULT, help='asset of the wallets')
+    parser.add_argument('--output', help='JSON report file')
+    args = parser.parse_args()
+    report = asyncio.get_event_loop().run_until_complete(main(args))
+    _print(report)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
@@ -2,22 +2,49 @@ import uvicorn
 from fastapi import FastAPI
 
 from wallet.conf import settings
+from wallet.middleware import (
+    ConnectionMiddleware,
+    TimingMiddleware,
+)
 from wallet.models import db
+from wallet.pool import InstrumentedPool
+from wallet.replica import replica
+from wallet.tasks import (
+    start_tasks,
+    stop_tasks,
+)
 from wallet.views import router
 
 
-async def init_app(db_dsn=settings.DB_DSN):
+async def init_app(db_dsn=settings.DB_DSN, replica_dsn=settings.DB_REPLICA_DSN):
     await db.set_bind(db_dsn,
                       echo=settings.DB_ECHO,
                       min_size=settings.DB_POOL_MIN_SIZE,
                       max_size=settings.DB_POOL_MAX_SIZE,
-                      ssl=settings.DB_SSL)
+                      ssl=settings.DB_SSL,
+                      pool_class=InstrumentedPool)
+    if replica_dsn is not None:
+        await replica.set_bind(replica_dsn,
+                               echo=settings.DB_ECHO,
+                               min_size=settings.DB_POOL_MIN_SIZE,
+                               max_size=settings.DB_POOL_MAX_SIZE,
+                               ssl=settings.DB_SSL)
+    start_tasks()
+
+
+async def shutdown_app():
+    await stop_tasks()
+    if replica.is_bound():
+        await replica.pop_bind().close()
 
 
 app = FastAPI(title='jati',
               version='0.1.0',
-              on_startup=[init_app])
+              on_startup=[init_app],
+              on_shutdown=[shutdown_app])
 app.include_router(router)
+app.add_middleware(ConnectionMiddleware)
+app.add_middleware(TimingMiddleware)
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -1,8 +1,19 @@
 """Tests."""
 
+import datetime
+import os
+import subprocess
+import sys
+from pathlib import Path
+from uuid import uuid4
+
 import pytest
 from gino import Gino
 from httpx import AsyncClient
+from sqlalchemy import (
+    create_engine,
+    text,
+)
 from sqlalchemy.engine.url import URL
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy_utils import (
@@ -13,9 +24,15 @@ from sqlalchemy_utils import (
 from main import (
     app,
     init_app,
+    shutdown_app,
 )
 from wallet.conf import DB_DSN_KW as DB_DSN_KW_
 from wallet.conf import settings
+from wallet.models import (
+    ASSETS,
+    Asset,
+    Wallet,
+)
 from wallet.models import db as _db
 
 DB_DSN_KW = DB_DSN_KW_.copy()
@@ -31,30 +48,91 @@ DB_DSN = URL(
     **DB_DSN_KW,
 )
 
+# Revision of the releases before the ledger partitioning
+LEGACY_REVISION = '98350413b628'
 
-@pytest.fixture
-@pytest.mark.asyncio
-async def gino() -> Gino:
-    """
-    Database fixture.
 
-    :return:
-    """
+def _create_database() -> None:
     try:
         create_database(DB_DSN_ALEMBIC)
     except ProgrammingError:
         drop_database(DB_DSN_ALEMBIC)
         create_database(DB_DSN_ALEMBIC)
+
+
+async def _bind() -> None:
     await _db.set_bind(DB_DSN,
                        echo=settings.DB_ECHO,
                        min_size=settings.DB_POOL_MIN_SIZE,
                        max_size=settings.DB_POOL_MAX_SIZE,
                        ssl=settings.DB_SSL)
+
+
+def _migrate(revision: str) -> None:
+    # alembic configures the logging, so it runs in a separate process
+    subprocess.run(
+        [sys.executable, '-c', 'from alembic.config import main; main()', 'upgrade', revision],
+        cwd=Path(__file__).parent.parent,
+        env={**os.environ, f'{settings.ENVVAR_PREFIX_FOR_DYNACONF}_DB_DATABASE': DB_DSN_KW['database']},
+        check=True,
+        capture_output=True,
+    )
+
+
+@pytest.fixture
+@pytest.mark.asyncio
+async def gino() -> Gino:
+    """
+    Database fixture.
+
+    :return:
+    """
+    _create_database()
+    await _bind()
     await _db.gino.create_all()
+    # ledger partitions are created and assets are seeded by the migrations
+    await _db.status(_db.text('CREATE TABLE transaction_default PARTITION OF transaction DEFAULT'))
+    await Asset.insert().values(list(ASSETS)).gino.status()
     yield _db
     drop_database(DB_DSN_ALEMBIC)
 
 
+@pytest.fixture
+@pytest.mark.asyncio
+async def legacy_ledger() -> Wallet:
+    """
+    Database migrated from the release before the ledger partitioning.
+
+    Wallet got deposits of 10, 20 and 30 five, four and three months before
+    the migration and a deposit of 40 right before it.
+
+    :return: wallet
+    """
+    _create_database()
+    _migrate(LEGACY_REVISION)
+    engine = create_engine(DB_DSN_ALEMBIC)
+    now = datetime.datetime.utcnow()
+    account_id, wallet_id = uuid4(), uuid4()
+    with engine.begin() as connection:
+        connection.execute(text("""
+            INSERT INTO user_account (id, user_id, date_created, date_updated) VALUES (:id, :user_id, :date, :date)
+        """), id=account_id, user_id=uuid4(), date=now - datetime.timedelta(days=200))
+        connection.execute(text("""
+            INSERT INTO user_wallet (id, account_id, balance, date_created, date_updated)
+            VALUES (:id, :account_id, 100, :date, :date)
+        """), id=wallet_id, account_id=account_id, date=now - datetime.timedelta(days=200))
+        for amount, days in ((10, 155), (20, 124), (30, 93), (40, 0)):
+            connection.execute(text("""
+                INSERT INTO transaction (id, account_id, amount, kind, status, date_created)
+                VALUES (:id, :account_id, :amount, 'DEPOSIT', 'COMMITTED', :date)
+            """), id=uuid4(), account_id=account_id, amount=amount, date=now - datetime.timedelta(days=days))
+    engine.dispose()
+    _migrate('head')
+    await _bind()
+    yield await Wallet.get(wallet_id)
+    drop_database(DB_DSN_ALEMBIC)
+
+
 @pytest.fixture
 @pytest.mark.asyncio
 async def client(gino: Gino) -> AsyncClient:  # noqa: D401
@@ -68,6 +146,7 @@ async def client(gino: Gino) -> AsyncClient:  # noqa: D401
 
     async with AsyncClient(app=app, base_url='http://test') as client:
         yield client
+    await shutdown_app()
 
 
 pytest_plugins = (
@@ -1,6 +1,7 @@
 """Fixtures."""
 from typing import (
     Coroutine,
+    Optional,
     Tuple,
 )
 from uuid import uuid4
@@ -28,8 +29,8 @@ async def post(client: AsyncClient) -> Coroutine:
     :param client:
     :return:
     """
-    async def _post(url: str, json: dict) -> Tuple[dict, int]:
-        request = await client.post(url, json=json)
+    async def _post(url: str, json: dict, headers: Optional[dict] = None) -> Tuple[dict, int]:
+        request = await client.post(url, json=json, headers=headers)
         return request.json(), request.status_code
     return _post
 
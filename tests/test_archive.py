@@ -0,0 +1,180 @@
+"""Cold ledger archive tests."""
+
+import datetime
+from pathlib import Path
+from typing import Coroutine
+
+import pytest
+from gino import Gino
+from httpx import AsyncClient
+from pytest_mock import MockerFixture
+
+from tests.test_partition import (
+    MONTH,
+    _count,
+    _create_past_partition,
+    _deposit,
+)
+from wallet.archive import archive_path
+from wallet.conf import settings
+from wallet.enum import (
+    TransactionStatus,
+    TransactionType,
+)
+from wallet.helpers import history_page
+from wallet.models import (
+    BalanceCheckpoint,
+    Transaction,
+    Wallet,
+    db,
+)
+from wallet.schema.input import HistoryFilterType
+from wallet.tasks import maintain_partitions
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def archive_dir(mocker: MockerFixture, tmp_path: Path) -> Path:
+    """
+    Ledger archive directory fixture.
+
+    :param mocker:
+    :param tmp_path:
+    :return:
+    """
+    mocker.patch.object(settings, 'LEDGER_ARCHIVE_PATH', str(tmp_path))
+    mocker.patch.object(settings, 'LEDGER_PARTITION_RETENTION', 1)
+    mocker.patch.object(settings, 'LEDGER_ARCHIVE_CHUNK_SIZE', 2)
+    return tmp_path
+
+
+async def _backdate(wallet: Wallet, date_created: datetime.datetime) -> None:
+    await Wallet.update.values(date_created=date_created).where(Wallet.id == wallet.id).gino.status()
+
+
+@pytest.mark.asyncio
+async def test_archive_partition(archive_dir: Path, gino: Gino, wallet: Wallet) -> None:  # noqa: D103
+    now = datetime.datetime.utcnow()
+    past = now - MONTH * 3
+    name = await _create_past_partition(past)
+    for amount in (10, 20, 30):
+        await _deposit(wallet, amount, past)
+    await _deposit(wallet, 40, now)
+
+    # partition is folded into a checkpoint on detach
+    await maintain_partitions()
+    assert await db.scalar(db.text('SELECT to_regclass(:name)'), name=name) is None
+    assert archive_path(name).exists()
+    assert await _count('transaction') == 1
+    assert await wallet.get_transaction_amount() == 100
+    assert await wallet.get_transaction_amount(full=True) == 40
+    assert await BalanceCheckpoint.verify() == []
+
+
+@pytest.mark.asyncio
+async def test_archive_migrated(archive_dir: Path, legacy_ledger: Wallet) -> None:  # noqa: D103
+    now = datetime.datetime.utcnow()
+    names = [Transaction.partition_name(now - datetime.timedelta(days=days)) for days in (155, 124, 93)]
+
+    # ledger of the older release is archived month by month
+    await maintain_partitions()
+    for name in names:
+        assert await db.scalar(db.text('SELECT to_regclass(:name)'), name=name) is None
+        assert archive_path(name).exists()
+    assert await _count('transaction') == 1
+    assert await legacy_ledger.get_transaction_amount() == 100
+    assert await BalanceCheckpoint.verify() == []
+
+    transactions, _ = await history_page(db, legacy_ledger.id, HistoryFilterType(), limit=10)
+    assert [transaction['amount'] for transaction in transactions] == [40, 30, 20, 10]
+
+
+@pytest.mark.asyncio
+async def test_archive_pending(archive_dir: Path, gino: Gino, wallet: Wallet) -> None:  # noqa: D103
+    past = datetime.datetime.utcnow() - MONTH * 3
+    name = await _create_past_partition(past)
+    await _deposit(wallet, 10, past)
+    await Transaction.create(
+        account_id=wallet.account_id,
+        amount=20,
+        kind=TransactionType.DEPOSIT,
+        status=TransactionStatus.NEW,
+        date_created=past,
+    )
+
+    await maintain_partitions()
+    assert await _count(name) == 2
+    assert not archive_path(name).exists()
+
+
+@pytest.mark.asyncio
+async def test_history_archive(archive_dir: Path, client: AsyncClient, get: Coroutine,  # noqa: D103
+                               gino: Gino, wallet: Wallet) -> None:
+    now = datetime.datetime.utcnow()
+    past = now - MONTH * 3
+    await _create_past_partition(past)
+    await _backdate(wallet, past)
+    for amount in (1, 2, 3):
+        await _deposit(wallet, amount, past + datetime.timedelta(seconds=amount))
+    for amount in (4, 5):
+        await _deposit(wallet, amount, now + datetime.timedelta(seconds=amount))
+    await maintain_partitions()
+
+    resp, status = await get(f'/wallet/{wallet.id}/history')
+    assert status == 200
+    assert [transaction['amount'] for transaction in resp] == [5, 4, 3, 2, 1]
+
+    pages, params = [], {'limit': 2}
+    while True:
+        resp = await client.get(f'/wallet/{wallet.id}/history', params=params)
+        pages.append([transaction['amount'] for transaction in resp.json()])
+        if 'X-Next-Cursor' not in resp.headers:
+            break
+        params['after'] = resp.headers['X-Next-Cursor']
+    assert pages == [[5, 4], [3, 2], [1]]
+
+    date_to = past + datetime.timedelta(seconds=3)
+    resp = await client.get(f'/wallet/{wallet.id}/history', params={'date_to': date_to.isoformat()})
+    assert [transaction['amount'] for transaction in resp.json()] == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_history_archive_bounds(archive_dir: Path, mocker: MockerFixture, get: Coroutine,  # noqa: D103
+                                      wallet: Wallet, rich_wallet: Wallet) -> None:
+    past = datetime.datetime.utcnow() - MONTH * 3
+    await _create_past_partition(past)
+    await _backdate(rich_wallet, past)
+    await _deposit(rich_wallet, 1, past)
+    await maintain_partitions()
+    read_history = mocker.patch('wallet.helpers.read_history', return_value=[])
+
+    # archives older than the wallet are not opened
+    _, status = await get(f'/wallet/{wallet.id}/history')
+    assert status == 200
+    read_history.assert_not_called()
+
+    await get(f'/wallet/{rich_wallet.id}/history')
+    read_history.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_archive_entry(archive_dir: Path, post: Coroutine, get: Coroutine,  # noqa: D103
+                             wallet: Wallet, rich_wallet: Wallet) -> None:
+    past = datetime.datetime.utcnow() - MONTH * 3
+    name = await _create_past_partition(past)
+    await post(f'/wallet/{rich_wallet.id}/send', json={'target_wallet_id': str(wallet.id), 'amount': 10})
+    await db.status(db.text('UPDATE transaction SET date_created = :past WHERE entry_id IS NOT NULL'), past=past)
+    await db.status(db.text('UPDATE journal_entry SET date_created = :past'), past=past)
+    await _backdate(wallet, past)
+    await maintain_partitions()
+    assert archive_path(name).exists()
+
+    (transfer,), _ = await get(f'/wallet/{wallet.id}/history')
+    assert transfer['counterparty_account_id'] == str(rich_wallet.account_id)
+    entry, status = await get(f'/entry/{transfer["entry_id"]}')
+    assert status == 200
+    assert [(leg['account_id'], leg['amount']) for leg in entry['legs']] == [
+        (str(rich_wallet.account_id), -10),
+        (str(wallet.account_id), 10),
+    ]
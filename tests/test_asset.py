@@ -0,0 +1,163 @@
+"""Multi-asset wallets tests."""
+
+import itertools
+from decimal import Decimal
+from typing import Coroutine
+from uuid import (
+    UUID,
+    uuid4,
+)
+
+import pytest
+from gino import Gino
+from pytest_mock import MockerFixture
+
+from wallet.commands import main
+from wallet.exceptions import (
+    AmountLimitException,
+    AmountPrecisionException,
+    AssetWrongException,
+)
+from wallet.helpers import (
+    create_deposit_batch,
+    create_send_batch,
+)
+from wallet.models import (
+    Asset,
+    Transaction,
+    Wallet,
+    db,
+    from_units,
+    to_units,
+)
+
+
+@pytest.fixture
+@pytest.mark.asyncio
+async def btc_wallet(post: Coroutine) -> Wallet:
+    """
+    Empty BTC wallet.
+
+    :param post:
+    :return:
+    """
+    wallet, _ = await post('/wallet', json={'user_id': str(uuid4()), 'asset': 'BTC'})
+    return await Wallet.get(wallet['id'])
+
+
+@pytest.mark.asyncio
+async def test_create_wallets(post: Coroutine) -> None:  # noqa: D103
+    user_id = str(uuid4())
+    usd, status = await post('/wallet', json={'user_id': user_id})
+    assert (status, usd['asset']) == (201, 'USD')
+    btc, status = await post('/wallet', json={'user_id': user_id, 'asset': 'BTC'})
+    assert (status, btc['asset']) == (201, 'BTC')
+    assert btc['account_id'] != usd['account_id']
+
+    _, status = await post('/wallet', json={'user_id': user_id, 'asset': 'BTC'})
+    assert status == 409
+    _, status = await post('/wallet', json={'user_id': user_id, 'asset': 'XYZ'})
+    assert status == 404
+
+
+@pytest.mark.asyncio
+async def test_asset_mismatch(post: Coroutine, rich_wallet: Wallet, btc_wallet: Wallet) -> None:  # noqa: D103
+    data = {'target_wallet_id': str(btc_wallet.id), 'amount': 10}
+    response, status = await post(f'/wallet/{rich_wallet.id}/send', json=data)
+    assert (status, response['detail']) == (409, AssetWrongException.__doc__)
+    response, status = await post(f'/wallet/{rich_wallet.id}/hold', json=data)
+    assert (status, response['detail']) == (409, AssetWrongException.__doc__)
+
+    assert await Transaction.query.where(Transaction.account_id == btc_wallet.account_id).gino.all() == []
+    assert (await Wallet.get(rich_wallet.id)).to_dict()['held'] == 0
+    assert (await Wallet.get(rich_wallet.id)).balance == rich_wallet.balance
+
+
+@pytest.mark.asyncio
+async def test_amount_precision(post: Coroutine, get: Coroutine,  # noqa: D103
+                                wallet: Wallet, rich_wallet: Wallet, btc_wallet: Wallet) -> None:
+    _, status = await post(f'/wallet/{btc_wallet.id}/deposit',
+                           json={'bank_account_id': str(uuid4()), 'amount': '0.12345678'})
+    assert status == 201
+    assert (await Wallet.get(btc_wallet.id)).balance == Decimal('0.12345678')
+    details, _ = await get(f'/wallet/{btc_wallet.id}')
+    assert Decimal(str(details['balance'])) == Decimal('0.12345678')
+
+    for action in ('send', 'hold'):
+        response, status = await post(f'/wallet/{rich_wallet.id}/{action}',
+                                      json={'target_wallet_id': str(wallet.id), 'amount': '0.055'})
+        assert (status, response['detail']) == (422, AmountPrecisionException.__doc__)
+    _, status = await post(f'/wallet/{wallet.id}/deposit', json={'bank_account_id': str(uuid4()), 'amount': '0.055'})
+    assert status == 422
+    assert await Transaction.query.where(Transaction.account_id == wallet.account_id).gino.all() == []
+
+
+@pytest.mark.asyncio
+async def test_amount_limits(post: Coroutine, wallet: Wallet, rich_wallet: Wallet,  # noqa: D103
+                             btc_wallet: Wallet) -> None:
+    _, status = await post(f'/wallet/{btc_wallet.id}/deposit', json={'bank_account_id': str(uuid4()), 'amount': 1})
+    assert status == 201
+    other, _ = await post('/wallet', json={'user_id': str(uuid4()), 'asset': 'BTC'})
+    # amounts below the global minimum fit the BTC limits
+    for action in ('send', 'hold'):
+        _, status = await post(f'/wallet/{btc_wallet.id}/{action}',
+                               json={'target_wallet_id': other['id'], 'amount': '0.001'})
+        assert status == 201
+    _, status = await post(f'/wallet/{btc_wallet.id}/send', json={'target_wallet_id': other['id'], 'amount': 101})
+    assert status == 422
+
+    for action, amount in itertools.product(('send', 'hold'), ('0.01', 10001)):
+        response, status = await post(f'/wallet/{rich_wallet.id}/{action}',
+                                      json={'target_wallet_id': str(wallet.id), 'amount': amount})
+        assert (status, response['detail']) == (422, AmountLimitException.__doc__)
+    response, status = await post(f'/wallet/{wallet.id}/deposit',
+                                  json={'bank_account_id': str(uuid4()), 'amount': '0.01'})
+    assert (status, response['detail']) == (422, AmountLimitException.__doc__)
+    assert await Transaction.query.where(Transaction.account_id == wallet.account_id).gino.all() == []
+
+    results = await create_send_batch([
+        (rich_wallet.id, wallet.id, Decimal(10001)),
+        (btc_wallet.id, UUID(other['id']), Decimal('0.00001')),
+    ])
+    assert [type(result) for result in results] == [AmountLimitException, type(None)]
+
+
+@pytest.mark.asyncio
+async def test_batch_assets(post: Coroutine, wallet: Wallet, rich_wallet: Wallet,  # noqa: D103
+                            btc_wallet: Wallet) -> None:
+    results = await create_send_batch([
+        (rich_wallet.id, btc_wallet.id, Decimal(1)),
+        (rich_wallet.id, wallet.id, Decimal('0.055')),
+        (rich_wallet.id, wallet.id, Decimal('0.05')),
+    ])
+    assert [type(result) for result in results] == [AssetWrongException, AmountPrecisionException, type(None)]
+    results = await create_deposit_batch([
+        ('ref-1', wallet.id, uuid4(), Decimal('0.055')),
+        ('ref-2', btc_wallet.id, uuid4(), Decimal('0.00001055')),
+        ('ref-3', btc_wallet.id, uuid4(), Decimal('0.00000055')),
+    ])
+    assert [type(result) for result in results] == [AmountPrecisionException, type(None), AmountLimitException]
+    assert (await Wallet.get(wallet.id)).balance == Decimal('0.05')
+    assert (await Wallet.get(btc_wallet.id)).balance == Decimal('0.00001055')
+
+
+@pytest.mark.asyncio
+async def test_amount_units(gino: Gino, rich_wallet: Wallet) -> None:  # noqa: D103
+    raw = await db.scalar(db.text('SELECT balance FROM user_wallet WHERE id = :id'), id=rich_wallet.id)
+    assert raw == to_units(100000) == 10000000000000
+    assert from_units(raw) == rich_wallet.balance == 100000
+    assert from_units(None) is None
+    assert await rich_wallet.get_transaction_amount() == await rich_wallet.get_transaction_amount(full=True) == 100000
+
+
+def test_asset_command(mocker: MockerFixture) -> None:  # noqa: D103
+    mocker.patch('wallet.commands.db.with_bind', return_value=mocker.MagicMock())
+    mocker.patch.object(Asset, 'get', return_value=None)
+    create = mocker.patch.object(Asset, 'create')
+    assert main(['asset', 'GBP', '2']) == 0
+    create.assert_called_once_with(code='GBP', precision=2, min_amount=Decimal('0.05'), max_amount=Decimal(10000))
+    assert main(['asset', 'XRP', '9']) == 1
+    assert main(['asset', 'XRP', '6', '--min-amount', '10', '--max-amount', '1']) == 1
+    mocker.patch.object(Asset, 'get', return_value=Asset(code='GBP', precision=2))
+    assert main(['asset', 'GBP', '2']) == 1
+    assert create.call_count == 1
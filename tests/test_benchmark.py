@@ -0,0 +1,30 @@
+"""Benchmark suite smoke tests."""
+
+import pytest
+from httpx import AsyncClient
+
+from benchmark import (
+    SCENARIOS,
+    percentile,
+    run,
+)
+
+
+def test_percentile() -> None:  # noqa: D103
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([1.0], 95) == 1
+    assert percentile([], 50) == 0
+
+
+@pytest.mark.asyncio
+async def test_benchmark(client: AsyncClient) -> None:  # noqa: D103
+    report = await run(client, wallets=3, requests=6, concurrency=2, seed=1)
+    assert list(report) == list(SCENARIOS)
+    for name, result in report.items():
+        assert result['errors'] == 0, name
+        assert result['tps'] > 0
+    assert report['send_uniform']['requests'] == 6
+    assert report['send_zipf']['round_trips'] >= 1
+    assert report['deposit']['round_trips'] >= 1
@@ -0,0 +1,135 @@
+"""Balance checkpoints tests."""
+
+import asyncio
+
+import pytest
+from gino import Gino
+from pytest_mock import MockerFixture
+
+from wallet.commands import main
+from wallet.enum import (
+    TransactionStatus,
+    TransactionType,
+)
+from wallet.models import (
+    Account,
+    BalanceCheckpoint,
+    CheckpointWatermark,
+    Transaction,
+    Wallet,
+    db,
+)
+
+
+async def _deposit(wallet: Wallet, amount: int, status: TransactionStatus = TransactionStatus.COMMITTED) -> None:
+    await Transaction.create(
+        account_id=wallet.account_id,
+        amount=amount,
+        kind=TransactionType.DEPOSIT,
+        status=status,
+    )
+
+
+@pytest.mark.asyncio
+async def test_checkpoint(gino: Gino, wallet: Wallet) -> None:  # noqa: D103
+    for _ in range(3):
+        await _deposit(wallet, 10)
+    assert await BalanceCheckpoint.take(min_rows=1, skew=0) == 1
+    assert await BalanceCheckpoint.take(min_rows=1, skew=0) == 0
+
+    await _deposit(wallet, 5)
+    assert await wallet.get_transaction_amount() == 35
+    assert await wallet.get_transaction_amount(full=True) == 35
+
+    assert await BalanceCheckpoint.take(min_rows=1, skew=0) == 1
+    checkpoints = await BalanceCheckpoint.query.order_by(BalanceCheckpoint.seq).gino.all()
+    assert [checkpoint.amount for checkpoint in checkpoints] == [30, 35]
+    assert await wallet.get_transaction_amount() == 35
+    assert await BalanceCheckpoint.verify() == []
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_min_rows(gino: Gino, wallet: Wallet) -> None:  # noqa: D103
+    await _deposit(wallet, 10)
+    assert await BalanceCheckpoint.take(min_rows=2, skew=0) == 0
+    await _deposit(wallet, 10)
+    assert await BalanceCheckpoint.take(min_rows=2, skew=0) == 1
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_watermark(gino: Gino, wallet: Wallet) -> None:  # noqa: D103
+    account = await Account.create(user_id=wallet.account.user_id)
+    other = await Wallet.create(account_id=account.id, asset='EUR')
+    await _deposit(wallet, 10)
+    assert await BalanceCheckpoint.take(min_rows=2, skew=0) == 0
+    seq = await Transaction.select('seq').gino.scalar()
+    assert (await CheckpointWatermark.get(1)).seq == seq
+
+    # quiet account is checked again once it has later transactions
+    await _deposit(other, 10)
+    await _deposit(other, 10)
+    assert await BalanceCheckpoint.take(min_rows=2, skew=0) == 1
+    await _deposit(wallet, 5)
+    assert await BalanceCheckpoint.take(min_rows=2, skew=0) == 1
+    checkpoint = await BalanceCheckpoint.query.where(BalanceCheckpoint.account_id == wallet.account_id).gino.one()
+    assert checkpoint.amount == 15
+    assert await BalanceCheckpoint.verify() == []
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_pending(gino: Gino, wallet: Wallet) -> None:  # noqa: D103
+    await _deposit(wallet, 10, TransactionStatus.NEW)
+    await _deposit(wallet, 20)
+    assert await BalanceCheckpoint.take(min_rows=1, skew=0) == 0
+
+    await Transaction.update.values(status=TransactionStatus.COMMITTED).gino.status()
+    assert await BalanceCheckpoint.take(min_rows=1, skew=0) == 1
+    assert await wallet.get_transaction_amount() == 30
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_running(gino: Gino, wallet: Wallet) -> None:  # noqa: D103
+    inserted, commit = asyncio.Event(), asyncio.Event()
+
+    async def running() -> None:
+        # the leg takes its sequence number long before the commit
+        async with db.acquire() as connection, connection.transaction():
+            await connection.status(Transaction.insert().values(
+                account_id=wallet.account_id,
+                amount=500,
+                kind=TransactionType.DEPOSIT,
+                status=TransactionStatus.COMMITTED,
+            ))
+            inserted.set()
+            await commit.wait()
+
+    task = asyncio.ensure_future(running())
+    await inserted.wait()
+    for _ in range(3):
+        await _deposit(wallet, 10)
+    assert await BalanceCheckpoint.take(min_rows=1, skew=0) == 0
+    commit.set()
+    await task
+
+    assert await BalanceCheckpoint.take(min_rows=1, skew=0) == 1
+    assert await wallet.get_transaction_amount() == await wallet.get_transaction_amount(full=True) == 530
+    assert await BalanceCheckpoint.verify() == []
+
+
+@pytest.mark.asyncio
+async def test_reconcile(gino: Gino, wallet: Wallet) -> None:  # noqa: D103
+    await _deposit(wallet, 10)
+    await BalanceCheckpoint.take(min_rows=1, skew=0)
+    await BalanceCheckpoint.update.values(amount=11).gino.status()
+
+    mismatches = await BalanceCheckpoint.verify()
+    assert [(account_id, amount, ledger) for account_id, _, amount, ledger in mismatches] == [
+        (wallet.account_id, 11, 10),
+    ]
+
+
+def test_reconcile_command(mocker: MockerFixture) -> None:  # noqa: D103
+    verify = mocker.patch.object(BalanceCheckpoint, 'verify', return_value=[])
+    mocker.patch('wallet.commands.db.with_bind', return_value=mocker.MagicMock())
+    assert main(['reconcile']) == 0
+    verify.assert_called_once()
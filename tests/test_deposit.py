@@ -1,11 +1,24 @@
 """Deposit endpoints test."""
 
+import json
+from argparse import Namespace
+from datetime import (
+    datetime,
+    timedelta,
+)
+from decimal import Decimal
+from pathlib import Path
 from typing import Coroutine
 from uuid import uuid4
 
 import pytest
+from gino import Gino
 
+from wallet.commands import ingest
+from wallet.exceptions import WalletDoesNotExists
+from wallet.helpers import create_deposit_batch
 from wallet.models import (
+    IdempotencyKey,
     Transaction,
     UserBankAccount,
     Wallet,
@@ -50,3 +63,88 @@ async def test_create_deposit_edge_cases(post: Coroutine, wallet: Wallet,
     wallet = await Wallet.query.where(Wallet.id == wallet.id).gino.one()
     assert status == expected_code
     assert wallet.balance == 0
+
+
+@pytest.mark.asyncio
+async def test_deposit_batch_many_wallets(gino: Gino, wallet: Wallet) -> None:  # noqa: D103
+    # more wallets, references and bank accounts than the query arguments limit
+    deposits = [(str(uuid4()), uuid4(), uuid4(), Decimal(1)) for _ in range(40000)]
+    deposits.append((str(uuid4()), wallet.id, uuid4(), Decimal(1)))
+    results = await create_deposit_batch(deposits)
+    assert {type(result) for result in results[:-1]} == {WalletDoesNotExists}
+    assert results[-1] is None
+    assert (await Wallet.get(wallet.id)).balance == 1
+
+
+@pytest.mark.asyncio
+async def test_ingest_deposits(gino: Gino, tmp_path: Path, wallet: Wallet) -> None:  # noqa: D103
+    bank_account_id = uuid4()
+    statement = tmp_path / 'statement.csv'
+    statement.write_text('\n'.join((
+        'reference,wallet_id,bank_account_id,amount',
+        f'ref-1,{wallet.id},{bank_account_id},100.00',
+        f'ref-2,{wallet.id},{bank_account_id},50.00',
+        f'ref-3,{wallet.id},{bank_account_id},0.01',
+        f'ref-4,{uuid4()},{bank_account_id},10.00',
+        f'ref-1,{wallet.id},{bank_account_id},100.00',
+    )))
+    args = Namespace(file=statement, format=None, chunk_size=2)
+
+    assert await ingest(args) == 1
+    wallet = await Wallet.query.where(Wallet.id == wallet.id).gino.one()
+    bank_account = await UserBankAccount.query.where(UserBankAccount.id == bank_account_id).gino.one()
+    assert wallet.balance == 150
+    assert wallet.balance == await wallet.get_transaction_amount(full=True)
+    assert len(await Transaction.query.where(Transaction.account_id == bank_account.account_id).gino.all()) == 2
+
+    # loading the same file again is a no-op
+    await ingest(args)
+    wallet = await Wallet.query.where(Wallet.id == wallet.id).gino.one()
+    assert wallet.balance == 150
+    assert len(await Transaction.query.gino.all()) == 4
+
+
+@pytest.mark.asyncio
+async def test_ingest_deposits_ndjson(gino: Gino, tmp_path: Path, wallet: Wallet) -> None:  # noqa: D103
+    statement = tmp_path / 'statement.ndjson'
+    statement.write_text('\n'.join(
+        json.dumps({
+            'reference': f'ref-{number}',
+            'wallet_id': str(wallet.id),
+            'bank_account_id': str(uuid4()),
+            'amount': '10.00',
+        }) for number in range(10)
+    ))
+
+    assert await ingest(Namespace(file=statement, format=None, chunk_size=3)) == 0
+    wallet = await Wallet.query.where(Wallet.id == wallet.id).gino.one()
+    assert wallet.balance == 100
+
+
+@pytest.mark.asyncio
+async def test_create_deposit_idempotency_key(post: Coroutine, wallet: Wallet) -> None:  # noqa: D103
+    data = {
+        'bank_account_id': str(uuid4()),
+        'amount': 1000,
+    }
+    headers = {'Idempotency-Key': str(uuid4())}
+    for _ in range(2):
+        _, status = await post(f'/wallet/{wallet.id}/deposit', json=data, headers=headers)
+        assert status == 201
+
+    wallet = await Wallet.query.where(Wallet.id == wallet.id).gino.one()
+    assert wallet.balance == 1000
+
+
+@pytest.mark.asyncio
+async def test_sweep_idempotency_keys(gino: Gino) -> None:  # noqa: D103
+    now = datetime.utcnow()
+    for age in (0, 10, 20):
+        await IdempotencyKey.create(
+            key=str(uuid4()),
+            fingerprint='',
+            status_code=201,
+            date_created=now - timedelta(seconds=age),
+        )
+    assert await IdempotencyKey.sweep(ttl=5, batch_size=1) == 2
+    assert len(await IdempotencyKey.query.gino.all()) == 1
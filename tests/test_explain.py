@@ -0,0 +1,48 @@
+"""Query plans tests."""
+
+import re
+from typing import Coroutine
+from uuid import uuid4
+
+import pytest
+from gino.dialects.asyncpg import DBAPICursor
+from pytest_mock import MockerFixture
+
+from wallet.models import (
+    BalanceCheckpoint,
+    Wallet,
+    db,
+)
+from wallet.statements import Statement
+
+# the ledger sequence relation has a single row
+SEQ_SCAN = re.compile(r'Seq Scan on (transaction(?!_seq\b)\w*|user_wallet)\b')
+
+
+@pytest.mark.asyncio
+async def test_no_seq_scan(post: Coroutine, get: Coroutine, mocker: MockerFixture,
+                           wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    spy = mocker.spy(DBAPICursor, 'async_execute')
+    prepared = mocker.spy(Statement, 'all')
+
+    await post('/wallet', json={'user_id': str(uuid4())})
+    await post('/wallet', json={'user_id': str(wallet.account.user_id)})
+    await post(f'/wallet/{wallet.id}/deposit', json={'bank_account_id': str(uuid4()), 'amount': 10})
+    await post(f'/wallet/{rich_wallet.id}/send', json={'target_wallet_id': str(wallet.id), 'amount': 10})
+    await post(f'/wallet/{wallet.id}/send', json={'target_wallet_id': str(rich_wallet.id), 'amount': 1000})
+    await get(f'/wallet/{wallet.id}')
+    await get(f'/wallet/{wallet.id}/history')
+    await wallet.get_transaction_amount()
+    await BalanceCheckpoint.take(min_rows=1, skew=0)
+
+    queries = {call.args[1]: call.args[3] for call in spy.call_args_list}
+    queries.update({
+        call.args[0].query: call.args[0].arguments(**call.kwargs) for call in prepared.call_args_list
+    })
+    assert queries
+    async with db.acquire() as connection:
+        await connection.status('SET enable_seqscan = off')
+        for query, args in queries.items():
+            plan = await connection.raw_connection.fetch(f'EXPLAIN {query}', *args)
+            plan = '\n'.join(row[0] for row in plan)
+            assert not SEQ_SCAN.search(plan), f'{query}\n{plan}'
@@ -0,0 +1,149 @@
+"""Two-phase hold endpoints test."""
+
+import datetime
+from typing import Coroutine
+from uuid import uuid4
+
+import pytest
+
+from wallet.enum import (
+    TransactionStatus,
+    TransactionType,
+)
+from wallet.helpers import expire_holds
+from wallet.models import (
+    BalanceCheckpoint,
+    Transaction,
+    Wallet,
+)
+
+
+async def _statuses(wallet: Wallet) -> list:
+    return [
+        transaction.status
+        for transaction in await Transaction.query.where(
+            Transaction.account_id == wallet.account_id,
+        ).where(
+            Transaction.kind != TransactionType.DEPOSIT,
+        ).order_by(Transaction.seq).gino.all()
+    ]
+
+
+@pytest.mark.asyncio
+async def test_hold_capture(post: Coroutine, get: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    await post(f'/wallet/{wallet.id}/deposit', json={'bank_account_id': str(uuid4()), 'amount': 1500})
+    hold, status = await post(f'/wallet/{wallet.id}/hold',
+                              json={'target_wallet_id': str(rich_wallet.id), 'amount': 1000})
+    assert status == 201
+    assert (hold['wallet_id'], hold['target_wallet_id'], hold['amount']) == (str(wallet.id), str(rich_wallet.id), 1000)
+
+    details, _ = await get(f'/wallet/{wallet.id}')
+    assert (details['balance'], details['held'], details['available']) == (1500, 1000, 500)
+    assert await _statuses(wallet) == [TransactionStatus.HOLD]
+    assert await _statuses(rich_wallet) == [TransactionStatus.HOLD]
+
+    # held funds cannot be spent
+    _, status = await post(f'/wallet/{wallet.id}/send', json={'target_wallet_id': str(rich_wallet.id), 'amount': 600})
+    assert status == 409
+
+    _, status = await post(f'/wallet/{wallet.id}/hold/{hold["id"]}/capture', json={})
+    assert status == 200
+    wallet = await Wallet.get(wallet.id)
+    target = await Wallet.get(rich_wallet.id)
+    assert (wallet.balance, wallet.held) == (500, 0)
+    assert (target.balance, target.held) == (rich_wallet.balance + 1000, 0)
+    assert await _statuses(wallet) == [TransactionStatus.COMMITTED, TransactionStatus.REJECTED]
+    assert await _statuses(target) == [TransactionStatus.COMMITTED, TransactionStatus.REJECTED]
+    assert await wallet.get_transaction_amount() == wallet.balance
+    assert await target.get_transaction_amount() == target.balance
+
+    _, status = await post(f'/wallet/{wallet.id}/hold/{hold["id"]}/void', json={})
+    assert status == 404
+
+
+@pytest.mark.asyncio
+async def test_hold_void(post: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    hold, _ = await post(f'/wallet/{rich_wallet.id}/hold', json={'target_wallet_id': str(wallet.id), 'amount': 1000})
+
+    # hold is released by its source wallet only
+    _, status = await post(f'/wallet/{wallet.id}/hold/{hold["id"]}/void', json={})
+    assert status == 404
+
+    _, status = await post(f'/wallet/{rich_wallet.id}/hold/{hold["id"]}/void', json={})
+    assert status == 200
+    assert (await Wallet.get(rich_wallet.id)).to_dict()['held'] == 0
+    assert (await Wallet.get(rich_wallet.id)).balance == rich_wallet.balance
+    assert (await Wallet.get(wallet.id)).balance == 0
+    assert await _statuses(rich_wallet) == [TransactionStatus.CANCELLED]
+    assert await _statuses(wallet) == [TransactionStatus.CANCELLED]
+
+    _, status = await post(f'/wallet/{rich_wallet.id}/hold/{hold["id"]}/capture', json={})
+    assert status == 404
+
+
+@pytest.mark.asyncio
+async def test_hold_rejected(post: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    _, status = await post(f'/wallet/{wallet.id}/hold', json={'target_wallet_id': str(rich_wallet.id), 'amount': 10})
+    assert status == 409
+    _, status = await post(f'/wallet/{rich_wallet.id}/hold', json={'target_wallet_id': str(uuid4()), 'amount': 10})
+    assert status == 404
+    _, status = await post(f'/wallet/{uuid4()}/hold', json={'target_wallet_id': str(wallet.id), 'amount': 10})
+    assert status == 404
+    _, status = await post(f'/wallet/{rich_wallet.id}/hold',
+                           json={'target_wallet_id': str(rich_wallet.id), 'amount': 10})
+    assert status == 409
+    assert await Transaction.query.where(Transaction.status == TransactionStatus.HOLD).gino.all() == []
+    assert (await Wallet.get(rich_wallet.id)).held == 0
+
+
+@pytest.mark.asyncio
+async def test_hold_idempotency_key(post: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    data = {'target_wallet_id': str(wallet.id), 'amount': 1000}
+    headers = {'Idempotency-Key': str(uuid4())}
+    first, status = await post(f'/wallet/{rich_wallet.id}/hold', json=data, headers=headers)
+    assert status == 201
+    second, status = await post(f'/wallet/{rich_wallet.id}/hold', json=data, headers=headers)
+    assert status == 201
+    assert first['id'] == second['id']
+    assert (await Wallet.get(rich_wallet.id)).held == 1000
+
+
+@pytest.mark.asyncio
+async def test_expire_holds(post: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    for _ in range(3):
+        await post(f'/wallet/{rich_wallet.id}/hold', json={'target_wallet_id': str(wallet.id), 'amount': 100})
+    fresh, _ = await post(f'/wallet/{rich_wallet.id}/hold', json={'target_wallet_id': str(wallet.id), 'amount': 10})
+    await Transaction.update.values(
+        date_created=datetime.datetime.utcnow() - datetime.timedelta(hours=2),
+    ).where(
+        Transaction.id != fresh['id'],
+    ).where(
+        Transaction.status == TransactionStatus.HOLD,
+    ).gino.status()
+
+    assert await expire_holds(ttl=3600, batch_size=2) == 3
+    assert await expire_holds(ttl=3600, batch_size=2) == 0
+    rich_wallet = await Wallet.get(rich_wallet.id)
+    assert rich_wallet.held == 10
+    assert sorted(status.name for status in await _statuses(rich_wallet)) == ['CANCELLED'] * 3 + ['HOLD']
+
+
+@pytest.mark.asyncio
+async def test_hold_checkpoint(post: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    hold, _ = await post(f'/wallet/{rich_wallet.id}/hold', json={'target_wallet_id': str(wallet.id), 'amount': 10})
+    await post(f'/wallet/{wallet.id}/deposit', json={'bank_account_id': str(uuid4()), 'amount': 20})
+    await post(f'/wallet/{rich_wallet.id}/deposit', json={'bank_account_id': str(uuid4()), 'amount': 20})
+
+    # pending hold blocks the checkpoints of its own accounts only
+    await BalanceCheckpoint.take(min_rows=1, skew=0)
+    checkpoints = {checkpoint.account_id: checkpoint.amount for checkpoint in await BalanceCheckpoint.query.gino.all()}
+    assert checkpoints[rich_wallet.account_id] == rich_wallet.balance
+    assert wallet.account_id not in checkpoints
+    assert len(checkpoints) == 3
+
+    await post(f'/wallet/{rich_wallet.id}/hold/{hold["id"]}/capture', json={})
+    assert await BalanceCheckpoint.take(min_rows=1, skew=0) == 2
+    assert await BalanceCheckpoint.verify() == []
+    for wallet_ in (wallet, rich_wallet):
+        wallet_ = await Wallet.get(wallet_.id)
+        assert await wallet_.get_transaction_amount() == wallet_.balance
@@ -0,0 +1,105 @@
+"""Journal entries tests."""
+
+from typing import Coroutine
+from uuid import uuid4
+
+import pytest
+from httpx import AsyncClient
+
+from wallet.enum import (
+    TransactionStatus,
+    TransactionType,
+)
+from wallet.helpers import create_deposit_batch
+from wallet.models import (
+    JournalEntry,
+    Transaction,
+    UserBankAccount,
+    Wallet,
+)
+
+
+@pytest.mark.asyncio
+async def test_send_entry(post: Coroutine, get: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    await post(f'/wallet/{rich_wallet.id}/send', json={'target_wallet_id': str(wallet.id), 'amount': 1000})
+    await post(f'/wallet/{wallet.id}/send', json={'target_wallet_id': str(rich_wallet.id), 'amount': 5000})
+
+    history, _ = await get(f'/wallet/{wallet.id}/history')
+    assert [(tx['amount'], tx['counterparty_account_id']) for tx in history] == [
+        (-5000, str(rich_wallet.account_id)),
+        (1000, str(rich_wallet.account_id)),
+    ]
+
+    entry, status = await get(f'/entry/{history[-1]["entry_id"]}')
+    assert status == 200
+    assert (entry['kind'], entry['status']) == (TransactionType.SEND.value, TransactionStatus.COMMITTED.value)
+    assert [(leg['account_id'], leg['amount']) for leg in entry['legs']] == [
+        (str(rich_wallet.account_id), -1000),
+        (str(wallet.account_id), 1000),
+    ]
+    rejected, _ = await get(f'/entry/{history[0]["entry_id"]}')
+    assert rejected['status'] == TransactionStatus.REJECTED.value
+    assert {leg['status'] for leg in rejected['legs']} == {TransactionStatus.REJECTED.value}
+
+
+@pytest.mark.asyncio
+async def test_deposit_entry(post: Coroutine, get: Coroutine, wallet: Wallet) -> None:  # noqa: D103
+    bank_account_id = uuid4()
+    await post(f'/wallet/{wallet.id}/deposit', json={'bank_account_id': str(bank_account_id), 'amount': 100})
+    bank_account = await UserBankAccount.get(bank_account_id)
+
+    (deposit,), _ = await get(f'/wallet/{wallet.id}/history')
+    assert deposit['counterparty_account_id'] == str(bank_account.account_id)
+    entry, _ = await get(f'/entry/{deposit["entry_id"]}')
+    assert entry['kind'] == TransactionType.DEPOSIT.value
+    assert len(entry['legs']) == 2
+
+
+@pytest.mark.asyncio
+async def test_hold_entry(post: Coroutine, get: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    hold, _ = await post(f'/wallet/{rich_wallet.id}/hold', json={'target_wallet_id': str(wallet.id), 'amount': 10})
+    entry, _ = await get(f'/entry/{hold["id"]}')
+    assert entry['status'] == TransactionStatus.HOLD.value
+    assert entry['legs'][0]['id'] == hold['id']
+
+    await post(f'/wallet/{rich_wallet.id}/hold/{hold["id"]}/capture', json={})
+    entry, _ = await get(f'/entry/{hold["id"]}')
+    assert entry['status'] == TransactionStatus.COMMITTED.value
+
+
+@pytest.mark.asyncio
+async def test_batch_entries(post: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    await post('/wallet/batch/send', json={'transfers': [
+        {'wallet_id': str(rich_wallet.id), 'target_wallet_id': str(wallet.id), 'amount': 10},
+        {'wallet_id': str(wallet.id), 'target_wallet_id': str(rich_wallet.id), 'amount': 100},
+    ]})
+    await create_deposit_batch([('ref-1', wallet.id, uuid4(), 5)])
+
+    entries = await JournalEntry.query.order_by(JournalEntry.id).gino.all()
+    assert [(entry.kind, entry.status) for entry in entries] == [
+        (TransactionType.SEND, TransactionStatus.COMMITTED),
+        (TransactionType.SEND, TransactionStatus.REJECTED),
+        (TransactionType.DEPOSIT, TransactionStatus.COMMITTED),
+    ]
+    for entry in entries:
+        legs = await entry.get_legs()
+        assert len(legs) == 2 and sum(leg.amount for leg in legs) == 0
+        assert {leg.status for leg in legs} == {entry.status}
+    # legs recorded apart from the transfers have no entry
+    assert await Transaction.query.where(Transaction.entry_id.is_(None)).gino.all() != []
+
+
+@pytest.mark.asyncio
+async def test_entry_does_not_exist(get: Coroutine) -> None:  # noqa: D103
+    _, status = await get(f'/entry/{uuid4()}')
+    assert status == 404
+
+
+@pytest.mark.asyncio
+async def test_export_counterparty(client: AsyncClient, post: Coroutine,  # noqa: D103
+                                   wallet: Wallet, rich_wallet: Wallet) -> None:
+    await post(f'/wallet/{rich_wallet.id}/send', json={'target_wallet_id': str(wallet.id), 'amount': 10})
+    response = await client.get(f'/wallet/{wallet.id}/history/export', params={'format': 'csv'})
+    header, row = response.text.splitlines()
+    assert header.endswith('entry_id,counterparty_account_id')
+    assert row.endswith(str(rich_wallet.account_id))
@@ -0,0 +1,75 @@
+"""Metrics tests."""
+
+import logging
+import re
+from typing import Coroutine
+from uuid import uuid4
+
+import pytest
+from _pytest.logging import LogCaptureFixture
+from httpx import AsyncClient
+from pytest_mock import MockerFixture
+
+from wallet.conf import settings
+from wallet.middleware import REQUEST_STATEMENTS
+from wallet.models import Wallet
+from wallet.pool import (
+    POOL_IN_USE,
+    InstrumentedPool,
+    normalize_sql,
+)
+
+
+@pytest.mark.asyncio
+async def test_connection_per_request(post: Coroutine, mocker: MockerFixture, wallet: Wallet) -> None:  # noqa: D103
+    acquire = mocker.spy(InstrumentedPool, 'acquire')
+    in_use = POOL_IN_USE.values[()]
+    data = {
+        'bank_account_id': str(uuid4()),
+        'amount': 1000,
+    }
+    _, status = await post(f'/wallet/{wallet.id}/deposit', json=data)
+    assert status == 201
+    assert acquire.call_count == 1
+    assert POOL_IN_USE.values[()] == in_use
+
+
+@pytest.mark.asyncio
+async def test_metrics(client: AsyncClient, wallet: Wallet) -> None:  # noqa: D103
+    await client.get(f'/wallet/{wallet.id}')
+    resp = await client.get('/metrics')
+    assert resp.status_code == 200
+    assert 'db_pool_acquire_seconds_count' in resp.text
+    assert 'db_pool_connections_in_use' in resp.text
+
+
+@pytest.mark.asyncio
+async def test_server_timing(client: AsyncClient, wallet: Wallet) -> None:  # noqa: D103
+    key = (('endpoint', 'endpoint_deposit'), ('method', 'POST'), ('status', '201'))
+    requests = sum(REQUEST_STATEMENTS.series.get(key, [0])[:-1])
+    resp = await client.post(f'/wallet/{wallet.id}/deposit', json={'bank_account_id': str(uuid4()), 'amount': 10})
+    assert resp.status_code == 201
+    timing = re.match(r'db;dur=[0-9.]+;desc="(\d+) statements", pool;dur=[0-9.]+, app;dur=[0-9.]+$',
+                      resp.headers['Server-Timing'])
+    assert timing is not None
+    assert int(timing[1]) > 1
+
+    assert sum(REQUEST_STATEMENTS.series[key][:-1]) == requests + 1
+
+    resp = await client.get('/metrics')
+    assert 'http_request_seconds_count{endpoint="endpoint_deposit",method="POST",status="201"}' in resp.text
+    assert 'db_statements_total' in resp.text
+
+
+@pytest.mark.asyncio
+async def test_slow_query_log(caplog: LogCaptureFixture, client: AsyncClient, mocker: MockerFixture,  # noqa: D103
+                              wallet: Wallet) -> None:
+    mocker.patch.object(settings, 'DB_SLOW_QUERY_SECONDS', 1e-9)
+    with caplog.at_level(logging.WARNING, logger='wallet.pool'):
+        await client.get(f'/wallet/{wallet.id}/history', params={'limit': 5})
+    assert any('Slow query' in message and 'LIMIT $' in message for message in caplog.messages), caplog.messages
+
+
+def test_normalize_sql() -> None:  # noqa: D103
+    query = "SELECT *\n  FROM transaction_y2026m01 WHERE id IN (1, 2, 3) AND kind = 'DEPOSIT' AND seq > $1"
+    assert normalize_sql(query) == 'SELECT * FROM transaction_y2026m01 WHERE id IN (...) AND kind = ? AND seq > $1'
@@ -0,0 +1,132 @@
+"""Ledger partitioning tests."""
+
+import datetime
+
+import pytest
+from gino import Gino
+from pytest_mock import MockerFixture
+
+from wallet.enum import (
+    TransactionStatus,
+    TransactionType,
+)
+from wallet.models import (
+    BalanceCheckpoint,
+    LedgerPartition,
+    Transaction,
+    Wallet,
+    db,
+)
+from wallet.statements import Statement
+
+MONTH = datetime.timedelta(days=31)
+
+
+async def _deposit(wallet: Wallet, amount: int, date_created: datetime.datetime) -> None:
+    await Transaction.create(
+        account_id=wallet.account_id,
+        amount=amount,
+        kind=TransactionType.DEPOSIT,
+        status=TransactionStatus.COMMITTED,
+        date_created=date_created,
+    )
+
+
+async def _count(table: str) -> int:
+    return await db.scalar(db.text(f'SELECT count(*) FROM {table}'))
+
+
+async def _create_past_partition(date: datetime.datetime) -> str:
+    date_from = date.date().replace(day=1)
+    date_to = (date_from + MONTH).replace(day=1)
+    name = Transaction.partition_name(date_from)
+    await db.status(db.text(
+        f"CREATE TABLE {name} PARTITION OF transaction FOR VALUES FROM ('{date_from}') TO ('{date_to}')",
+    ))
+    return name
+
+
+@pytest.mark.asyncio
+async def test_create_partitions(gino: Gino, wallet: Wallet) -> None:  # noqa: D103
+    now = datetime.datetime.utcnow()
+    await _deposit(wallet, 10, now)
+    assert await _count('transaction_default') == 1
+
+    created = await Transaction.create_partitions(months_ahead=2)
+    assert created == [
+        Transaction.partition_name(now),
+        Transaction.partition_name(now + MONTH),
+        Transaction.partition_name(now + MONTH * 2),
+    ]
+    assert await _count('transaction_default') == 0
+    assert await _count(created[0]) == 1
+    assert await Transaction.create_partitions(months_ahead=2) == []
+
+    await _deposit(wallet, 10, now)
+    assert await _count(created[0]) == 2
+
+
+@pytest.mark.asyncio
+async def test_create_partitions_overlap(gino: Gino) -> None:  # noqa: D103
+    now = datetime.datetime.utcnow()
+    next_month = (now.date().replace(day=1) + MONTH).replace(day=1)
+    # partition attached by hand covers everything up to the next month
+    await db.status(db.text(
+        f"CREATE TABLE transaction_legacy PARTITION OF transaction FOR VALUES FROM (MINVALUE) TO ('{next_month}')",
+    ))
+    assert await Transaction.create_partitions(months_ahead=1) == [Transaction.partition_name(next_month)]
+
+
+@pytest.mark.asyncio
+async def test_detach_partitions(gino: Gino, wallet: Wallet) -> None:  # noqa: D103
+    past = datetime.datetime.utcnow() - MONTH * 3
+    name = await _create_past_partition(past)
+    await _deposit(wallet, 10, past)
+    await _deposit(wallet, 20, past)
+
+    assert await Transaction.detach_partitions(retention=3, skew=0) == []
+    assert await BalanceCheckpoint.query.gino.all() == []
+
+    # partition is folded into a checkpoint before it is detached
+    assert await Transaction.detach_partitions(retention=1, skew=0) == [name]
+    checkpoint = await BalanceCheckpoint.query.gino.one()
+    assert (checkpoint.seq, checkpoint.amount) == (await db.scalar(db.text(f'SELECT max(seq) FROM {name}')), 30)
+
+    partition = await LedgerPartition.get(name)
+    assert partition.seq_max == await db.scalar(db.text(f'SELECT max(seq) FROM {name}'))
+    assert await _count(name) == 2
+    assert await wallet.get_transaction_amount() == 30
+    assert await BalanceCheckpoint.verify() == []
+
+
+@pytest.mark.asyncio
+async def test_detach_migrated_partitions(legacy_ledger: Wallet) -> None:  # noqa: D103
+    now = datetime.datetime.utcnow()
+    # the ledger of the older releases is split by month
+    names = [Transaction.partition_name(now - datetime.timedelta(days=days)) for days in (155, 124, 93)]
+    assert [await _count(name) for name in names] == [1, 1, 1]
+    assert await Transaction.detach_partitions(retention=1, skew=0) == names
+    assert await legacy_ledger.get_transaction_amount() == 100
+    assert await legacy_ledger.get_transaction_amount(full=True) == 40
+    assert await BalanceCheckpoint.verify() == []
+
+
+@pytest.mark.asyncio
+async def test_tail_partition_pruning(gino: Gino, mocker: MockerFixture, wallet: Wallet) -> None:  # noqa: D103
+    now = datetime.datetime.utcnow()
+    past = now - MONTH * 3
+    name = await _create_past_partition(past)
+    await Transaction.create_partitions(months_ahead=0)
+    await _deposit(wallet, 10, past)
+    await _deposit(wallet, 20, now)
+    await BalanceCheckpoint.take(min_rows=1, skew=0)
+    await _deposit(wallet, 30, now)
+
+    spy = mocker.spy(Statement, 'all')
+    assert await wallet.get_transaction_amount() == 60
+    statement, params = spy.call_args.args[0], spy.call_args.kwargs
+    query, args = statement.query, statement.arguments(**params)
+    async with db.acquire() as connection:
+        plan = await connection.raw_connection.fetch(f'EXPLAIN (ANALYZE, COSTS OFF) {query}', *args)
+    plan = '\n'.join(row[0] for row in plan)
+    assert any(name in line and 'never executed' in line for line in plan.splitlines()), plan
@@ -0,0 +1,155 @@
+"""Transfer queue tests."""
+
+import asyncio
+import datetime
+from typing import (
+    Any,
+    Coroutine,
+    List,
+)
+from uuid import uuid4
+
+import pytest
+from gino import Gino
+from httpx import AsyncClient
+from pytest_mock import MockerFixture
+
+from wallet import tasks
+from wallet.conf import settings
+from wallet.enum import (
+    OperationStatus,
+    TransactionType,
+)
+from wallet.helpers import process_transfers
+from wallet.models import (
+    TransferOperation,
+    Wallet,
+    db,
+)
+
+
+@pytest.fixture
+def queue(client: AsyncClient, mocker: MockerFixture) -> None:
+    """
+    Queue the transfers instead of applying them.
+
+    Queue is enabled after the application startup, so the queued
+    transfers are applied by the tests only.
+
+    :param client:
+    :param mocker:
+    :return:
+    """
+    mocker.patch.object(settings, 'TRANSFER_QUEUE', True)
+
+
+@pytest.mark.asyncio
+async def test_send_queued(queue: None, post: Coroutine, get: Coroutine,  # noqa: D103
+                           wallet: Wallet, rich_wallet: Wallet) -> None:
+    operation, status = await post(f'/wallet/{rich_wallet.id}/send',
+                                   json={'target_wallet_id': str(wallet.id), 'amount': 1000})
+    assert status == 202
+    assert (operation['kind'], operation['status']) == ('Send', 'Queued')
+    assert (await Wallet.get(wallet.id)).balance == 0
+
+    assert await process_transfers(batch_size=10) == 1
+    assert await process_transfers(batch_size=10) == 0
+    operation, status = await get(f'/operation/{operation["id"]}')
+    assert status == 200
+    assert (operation['status'], operation['status_code'], operation['detail']) == ('Committed', 201, None)
+    assert (await Wallet.get(wallet.id)).balance == 1000
+    assert (await Wallet.get(rich_wallet.id)).balance == rich_wallet.balance - 1000
+
+
+@pytest.mark.asyncio
+async def test_queue_batch(queue: None, post: Coroutine, get: Coroutine,  # noqa: D103
+                           wallet: Wallet, rich_wallet: Wallet) -> None:
+    send, _ = await post(f'/wallet/{wallet.id}/send', json={'target_wallet_id': str(rich_wallet.id), 'amount': 10})
+    deposit, status = await post(f'/wallet/{wallet.id}/deposit',
+                                 json={'bank_account_id': str(uuid4()), 'amount': 100})
+    assert (status, deposit['kind']) == (202, 'Deposit')
+    rejected, _ = await post(f'/wallet/{wallet.id}/send', json={'target_wallet_id': str(uuid4()), 'amount': 10})
+    poor, _ = await post(f'/wallet/{wallet.id}/send', json={'target_wallet_id': str(rich_wallet.id), 'amount': 100})
+
+    # deposits of the batch are applied before the sends
+    assert await process_transfers(batch_size=10) == 4
+    outcomes = [
+        (operation['status'], operation['status_code'])
+        for operation in [(await get(f'/operation/{item["id"]}'))[0] for item in (send, deposit, rejected, poor)]
+    ]
+    assert outcomes == [('Committed', 201), ('Committed', 201), ('Rejected', 404), ('Rejected', 409)]
+    assert (await Wallet.get(wallet.id)).balance == 90
+
+
+@pytest.mark.asyncio
+async def test_queue_batch_locks(queue: None, mocker: MockerFixture, post: Coroutine,  # noqa: D103
+                                 wallet: Wallet, rich_wallet: Wallet) -> None:
+    await post(f'/wallet/{wallet.id}/deposit', json={'bank_account_id': str(uuid4()), 'amount': 100})
+    await post(f'/wallet/{rich_wallet.id}/send', json={'target_wallet_id': str(uuid4()), 'amount': 10})
+    unlocked = []
+
+    async def create_deposit_batch(*args: Any) -> List[None]:
+        # wallets of the sends are locked before the deposits are applied
+        async with db.acquire() as connection:
+            unlocked.extend(await connection.all(
+                db.select([Wallet.id]).where(
+                    Wallet.id.in_([wallet.id, rich_wallet.id]),
+                ).with_for_update(skip_locked=True),
+            ))
+        return [None]
+
+    mocker.patch('wallet.helpers.create_deposit_batch', side_effect=create_deposit_batch)
+    assert await process_transfers(batch_size=10) == 2
+    assert unlocked == []
+
+
+@pytest.mark.asyncio
+async def test_queue_idempotency_key(queue: None, post: Coroutine, wallet: Wallet) -> None:  # noqa: D103
+    data = {'bank_account_id': str(uuid4()), 'amount': 100}
+    headers = {'Idempotency-Key': str(uuid4())}
+    first, _ = await post(f'/wallet/{wallet.id}/deposit', json=data, headers=headers)
+    await process_transfers(batch_size=10)
+    second, status = await post(f'/wallet/{wallet.id}/deposit', json=data, headers=headers)
+    assert status == 202
+    assert (second['id'], second['status']) == (first['id'], 'Committed')
+    assert await process_transfers(batch_size=10) == 0
+    assert (await Wallet.get(wallet.id)).balance == 100
+
+
+@pytest.mark.asyncio
+async def test_operation_does_not_exist(get: Coroutine) -> None:  # noqa: D103
+    _, status = await get(f'/operation/{uuid4()}')
+    assert status == 404
+
+
+@pytest.mark.asyncio
+async def test_queue_workers(queue: None, client: AsyncClient, mocker: MockerFixture,  # noqa: D103
+                             wallet: Wallet, rich_wallet: Wallet) -> None:
+    await tasks.stop_tasks()
+    mocker.patch.object(settings, 'TRANSFER_QUEUE_POLL_PERIOD', 0.01)
+    tasks.start_tasks()
+    responses = await asyncio.gather(*(
+        client.post(f'/wallet/{rich_wallet.id}/send', json={'target_wallet_id': str(wallet.id), 'amount': 10})
+        for _ in range(20)
+    ))
+    assert {response.status_code for response in responses} == {202}
+    for _ in range(100):
+        if not await TransferOperation.query.where(TransferOperation.status == OperationStatus.QUEUED).gino.all():
+            break
+        await asyncio.sleep(0.05)
+    await tasks.stop_tasks()
+    assert (await Wallet.get(wallet.id)).balance == 200
+
+
+@pytest.mark.asyncio
+async def test_sweep_transfer_operations(gino: Gino, wallet: Wallet) -> None:  # noqa: D103
+    now = datetime.datetime.utcnow()
+    for date_processed in (None, now, now - datetime.timedelta(days=2)):
+        await TransferOperation.create(
+            kind=TransactionType.SEND,
+            wallet_id=wallet.id,
+            amount=1,
+            date_processed=date_processed,
+        )
+    assert await TransferOperation.sweep(ttl=86400, batch_size=1) == 1
+    assert len(await TransferOperation.query.gino.all()) == 2
@@ -0,0 +1,111 @@
+"""Read replica routing tests."""
+
+from typing import Coroutine
+from uuid import uuid4
+
+import pytest
+from gino import Gino
+from httpx import AsyncClient
+from pytest_mock import MockerFixture
+from sqlalchemy.engine.url import URL
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy_utils import (
+    create_database,
+    drop_database,
+)
+
+from tests.conftest import DB_DSN_KW
+from wallet.conf import settings
+from wallet.models import (
+    Account,
+    Asset,
+    Wallet,
+    db,
+)
+from wallet.replica import (
+    READ_ROUTES,
+    WRITE_TOKEN_HEADER,
+)
+from wallet.replica import replica as _replica
+
+# second database on the same server is a stand-in replica
+REPLICA_DSN_KW = {**DB_DSN_KW, 'database': f'{DB_DSN_KW["database"]}_replica'}
+
+REPLICA_DSN_ALEMBIC = str(URL(
+    drivername='postgresql',
+    **REPLICA_DSN_KW,
+))
+
+REPLICA_DSN = URL(
+    drivername='asyncpg',
+    **REPLICA_DSN_KW,
+)
+
+
+@pytest.fixture
+@pytest.mark.asyncio
+async def replica(client: AsyncClient) -> Gino:
+    """
+    Stand-in replica database fixture.
+
+    :param client:
+    :return:
+    """
+    try:
+        create_database(REPLICA_DSN_ALEMBIC)
+    except ProgrammingError:
+        drop_database(REPLICA_DSN_ALEMBIC)
+        create_database(REPLICA_DSN_ALEMBIC)
+    await _replica.set_bind(REPLICA_DSN)
+    await db.gino.create_all(bind=_replica.bind)
+    await _replica.status(Asset.insert().values([asset.to_dict() for asset in await Asset.query.gino.all()]))
+    yield _replica
+    await _replica.pop_bind().close()
+    drop_database(REPLICA_DSN_ALEMBIC)
+
+
+async def _replicate(replica: Gino, wallet: Wallet, balance: int) -> None:
+    account = wallet.account
+    await replica.status(Account.insert().values(**account.to_dict()))
+    await replica.status(Wallet.insert().values(**{**wallet.to_dict(), 'balance': balance}))
+
+
+@pytest.mark.asyncio
+async def test_wallet_details_replica(get: Coroutine, replica: Gino, wallet: Wallet) -> None:  # noqa: D103
+    await _replicate(replica, wallet, 100)
+    routed = READ_ROUTES.values[(('database', 'replica'),)]
+    resp, status = await get(f'/wallet/{wallet.id}')
+    assert status == 200
+    assert resp['balance'] == 100
+    assert READ_ROUTES.values[(('database', 'replica'),)] == routed + 1
+
+
+@pytest.mark.asyncio
+async def test_history_replica(get: Coroutine, replica: Gino, rich_wallet: Wallet) -> None:  # noqa: D103
+    await _replicate(replica, rich_wallet, 0)
+    resp, status = await get(f'/wallet/{rich_wallet.id}/history')
+    assert status == 200
+    assert resp == []
+
+
+@pytest.mark.asyncio
+async def test_read_your_writes(client: AsyncClient, mocker: MockerFixture,  # noqa: D103
+                                replica: Gino, wallet: Wallet) -> None:
+    mocker.patch.object(settings, 'DB_REPLICA_READ_YOUR_WRITES', True)
+    await _replicate(replica, wallet, 100)
+    resp = await client.post(f'/wallet/{wallet.id}/deposit', json={'bank_account_id': str(uuid4()), 'amount': 10})
+    assert resp.status_code == 201
+    token = resp.headers[WRITE_TOKEN_HEADER]
+
+    # stand-in replica runs on the primary server so it is always caught up
+    resp = await client.get(f'/wallet/{wallet.id}', headers={WRITE_TOKEN_HEADER: token})
+    assert resp.json()['balance'] == 100
+
+    resp = await client.get(f'/wallet/{wallet.id}', headers={WRITE_TOKEN_HEADER: 'FFFFFFFF/0'})
+    assert resp.json()['balance'] == 10
+
+    resp = await client.get(f'/wallet/{wallet.id}/history', headers={WRITE_TOKEN_HEADER: 'FFFFFFFF/0'})
+    assert len(resp.json()) == 1
+
+    resp = await client.get(f'/wallet/{wallet.id}', headers={WRITE_TOKEN_HEADER: 'latest'})
+    assert resp.status_code == 422
@@ -1,16 +1,42 @@
 """Money transfer endpoints test."""
 
+import asyncio
 import operator
-from typing import Coroutine
+import random
+from decimal import Decimal
+from typing import (
+    Any,
+    Coroutine,
+)
 from uuid import uuid4
 
 import pytest
+from asyncpg.exceptions import DeadlockDetectedError
+from gino import Gino
+from gino.dialects.asyncpg import DBAPICursor
+from httpx import AsyncClient
+from pytest_mock import MockerFixture
 
-from wallet.enum import TransactionStatus
+from wallet import idempotency
+from wallet.cache import wallet_cache
+from wallet.conf import settings
+from wallet.enum import (
+    TransactionStatus,
+    TransactionType,
+)
+from wallet.exceptions import (
+    NotEnoughFundsException,
+    WalletDoesNotExists,
+)
+from wallet.helpers import create_send_batch
 from wallet.models import (
+    Account,
+    IdempotencyKey,
     Transaction,
     Wallet,
+    db,
 )
+from wallet.statements import Statement
 
 
 @pytest.mark.asyncio
@@ -125,3 +151,261 @@ async def test_send_edge_cases(post: Coroutine, wallet: Wallet, rich_wallet: Wal
     assert status == expected_code
     assert wallet.balance == 0
     assert rich_wallet.balance == start_balance
+
+
+@pytest.mark.asyncio
+async def test_send_balance_delta(post: Coroutine, wallet: Wallet) -> None:  # noqa: D103
+    # balance without ledger history proves that the full SUM is not used
+    source = await Wallet.create(account_id=(await Account.create(user_id=uuid4())).id, balance=500)
+    data = {
+        'target_wallet_id': str(wallet.id),
+        'amount': 100,
+    }
+    _, status = await post(f'/wallet/{source.id}/send', json=data)
+
+    source = await Wallet.query.where(Wallet.id == source.id).gino.one()
+    wallet = await Wallet.query.where(Wallet.id == wallet.id).gino.one()
+    assert status == 201
+    assert source.balance == 400
+    assert wallet.balance == 100
+
+
+@pytest.mark.asyncio
+async def test_send_balance_recalculate(post: Coroutine, mocker: MockerFixture,
+                                        wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    mocker.patch.object(settings, 'BALANCE_RECALCULATE', True)
+    await rich_wallet.update(balance=500000).apply()
+    data = {
+        'target_wallet_id': str(wallet.id),
+        'amount': 1000,
+    }
+    _, status = await post(f'/wallet/{rich_wallet.id}/send', json=data)
+
+    rich_wallet = await Wallet.query.where(Wallet.id == rich_wallet.id).gino.one()
+    assert status == 201
+    assert rich_wallet.balance == 100000 - 1000
+
+
+@pytest.mark.asyncio
+async def test_send_source_does_not_exist(post: Coroutine, wallet: Wallet) -> None:  # noqa: D103
+    data = {
+        'target_wallet_id': str(wallet.id),
+        'amount': 1000,
+    }
+    _, status = await post(f'/wallet/{uuid4()}/send', json=data)
+
+    wallet = await Wallet.query.where(Wallet.id == wallet.id).gino.one()
+    assert status == 404
+    assert wallet.balance == 0
+    assert await Transaction.query.gino.all() == []
+
+
+@pytest.mark.asyncio
+async def test_send_single_statement(post: Coroutine, mocker: MockerFixture,
+                                     wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    spy = mocker.spy(DBAPICursor, 'async_execute')
+    prepared = mocker.spy(Statement, 'all')
+    data = {
+        'target_wallet_id': str(wallet.id),
+        'amount': 1000,
+    }
+    _, status = await post(f'/wallet/{rich_wallet.id}/send', json=data)
+    assert status == 201
+    assert spy.call_count == 0
+    assert prepared.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_send_concurrent(client: AsyncClient) -> None:  # noqa: D103
+    wallets = []
+    for _ in range(4):
+        account = await Account.create(user_id=uuid4())
+        wallets.append(await Wallet.create(account_id=account.id, balance=0))
+        await Transaction.create(
+            account_id=account.id,
+            amount=1000,
+            kind=TransactionType.DEPOSIT,
+            status=TransactionStatus.COMMITTED,
+        )
+        await wallets[-1].commit()
+
+    async def send(source: Wallet, target: Wallet, amount: int) -> int:
+        response = await client.post(f'/wallet/{source.id}/send',
+                                     json={'target_wallet_id': str(target.id), 'amount': amount})
+        return response.status_code
+
+    rnd = random.Random(0)
+    sends = []
+    for _ in range(2000):
+        source, target = rnd.sample(wallets, 2)
+        sends.append(send(source, target, rnd.randint(1, 300)))
+    statuses = await asyncio.gather(*sends)
+
+    assert set(statuses) <= {201, 409}
+    balances = [wallet.balance for wallet in await Wallet.query.gino.all()]
+    assert sum(balances) == 4000
+    assert all(balance >= 0 for balance in balances)
+    for wallet in wallets:
+        assert (await Wallet.get(wallet.id)).balance == await wallet.get_transaction_amount(full=True)
+
+
+@pytest.mark.asyncio
+async def test_send_retry(post: Coroutine, mocker: MockerFixture,
+                          wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    scalar = Statement.scalar
+    side_effect = [DeadlockDetectedError('deadlock detected'), None]
+
+    async def _scalar(*args, **kwargs) -> Any:  # noqa: ANN002, ANN003
+        error = side_effect.pop(0)
+        if error:
+            raise error
+        return await scalar(*args, **kwargs)
+
+    mocker.patch.object(Statement, 'scalar', _scalar)
+    data = {
+        'target_wallet_id': str(wallet.id),
+        'amount': 1000,
+    }
+    _, status = await post(f'/wallet/{rich_wallet.id}/send', json=data)
+
+    wallet = await Wallet.query.where(Wallet.id == wallet.id).gino.one()
+    assert status == 201
+    assert wallet.balance == 1000
+    assert side_effect == []
+
+
+@pytest.mark.asyncio
+async def test_send_batch(post: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    start_balance = rich_wallet.balance
+    transfers = [
+        (rich_wallet.id, wallet.id, 1000),
+        (wallet.id, rich_wallet.id, 400),
+        (wallet.id, rich_wallet.id, 1000),
+        (wallet.id, wallet.id, 1),
+        (wallet.id, uuid4(), 1),
+    ]
+    data = {
+        'transfers': [
+            {'wallet_id': str(source), 'target_wallet_id': str(target), 'amount': amount}
+            for source, target, amount in transfers
+        ],
+    }
+    resp, status = await post('/wallet/batch/send', json=data)
+
+    wallet = await Wallet.query.where(Wallet.id == wallet.id).gino.one()
+    rich_wallet = await Wallet.query.where(Wallet.id == rich_wallet.id).gino.one()
+    assert status == 200
+    assert [result['status_code'] for result in resp] == [201, 201, 409, 409, 404]
+    assert wallet.balance == 600
+    assert rich_wallet.balance == start_balance - 600
+    assert wallet.balance == await wallet.get_transaction_amount(full=True)
+    assert len(await Transaction.query.where(
+        Transaction.status == TransactionStatus.REJECTED,
+    ).gino.all()) == 2
+
+
+@pytest.mark.asyncio
+async def test_send_batch_bulk(post: Coroutine, mocker: MockerFixture,
+                               wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    spy = mocker.spy(DBAPICursor, 'async_execute')
+    data = {
+        'transfers': [
+            {'wallet_id': str(rich_wallet.id), 'target_wallet_id': str(wallet.id), 'amount': 10}
+            for _ in range(2000)
+        ],
+    }
+    resp, status = await post('/wallet/batch/send', json=data)
+    # lock wallets and apply deltas, the ledger is loaded with COPY
+    assert spy.call_count == 2
+
+    wallet = await Wallet.query.where(Wallet.id == wallet.id).gino.one()
+    assert status == 200
+    assert {result['status_code'] for result in resp} == {201}
+    assert wallet.balance == 20000
+    assert len(await Transaction.query.where(Transaction.account_id == wallet.account_id).gino.all()) == 2000
+
+
+@pytest.mark.asyncio
+async def test_send_batch_many_wallets(gino: Gino, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    # more wallets than the query arguments limit
+    transfers = [(rich_wallet.id, uuid4(), Decimal(1)) for _ in range(40000)]
+    transfers.append((rich_wallet.id, wallet.id, Decimal(1)))
+    results = await create_send_batch(transfers)
+    assert {type(result) for result in results[:-1]} == {WalletDoesNotExists}
+    assert results[-1] is None
+    assert (await Wallet.get(wallet.id)).balance == 1
+
+
+@pytest.mark.asyncio
+async def test_send_batch_validation(post: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    data = {
+        'transfers': [
+            {'wallet_id': str(rich_wallet.id), 'target_wallet_id': str(wallet.id), 'amount': 10},
+            {'wallet_id': str(rich_wallet.id), 'target_wallet_id': str(wallet.id), 'amount': 0},
+        ],
+    }
+    _, status = await post('/wallet/batch/send', json=data)
+
+    wallet = await Wallet.query.where(Wallet.id == wallet.id).gino.one()
+    assert status == 422
+    assert wallet.balance == 0
+
+
+@pytest.mark.asyncio
+async def test_send_idempotency_key(post: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    start_balance = rich_wallet.balance
+    data = {
+        'target_wallet_id': str(wallet.id),
+        'amount': 1000,
+    }
+    headers = {'Idempotency-Key': str(uuid4())}
+    _, status = await post(f'/wallet/{rich_wallet.id}/send', json=data, headers=headers)
+    _, repeated_status = await post(f'/wallet/{rich_wallet.id}/send', json=data, headers=headers)
+    idempotency._outcomes.clear()
+    _, stored_status = await post(f'/wallet/{rich_wallet.id}/send', json=data, headers=headers)
+
+    rich_wallet = await Wallet.query.where(Wallet.id == rich_wallet.id).gino.one()
+    assert status == repeated_status == stored_status == 201
+    assert rich_wallet.balance == start_balance - 1000
+
+    data['amount'] = 10
+    _, status = await post(f'/wallet/{rich_wallet.id}/send', json=data, headers=headers)
+    assert status == 422
+
+
+@pytest.mark.asyncio
+async def test_send_idempotency_key_invalidation(post: Coroutine, mocker: MockerFixture,  # noqa: D103
+                                                 wallet: Wallet, rich_wallet: Wallet) -> None:
+    balances = []
+
+    async def delete(*keys: str) -> None:
+        # cached wallet is dropped once the readers see the new balance
+        async with db.acquire() as connection:
+            balances.append(await connection.scalar(db.select([Wallet.balance]).where(Wallet.id == wallet.id)))
+
+    mocker.patch.object(wallet_cache, 'delete', side_effect=delete)
+    _, status = await post(f'/wallet/{rich_wallet.id}/send', json={'target_wallet_id': str(wallet.id), 'amount': 1000},
+                           headers={'Idempotency-Key': str(uuid4())})
+    assert status == 201
+    assert balances == [1000]
+
+
+@pytest.mark.asyncio
+async def test_send_idempotency_key_rejected(post: Coroutine,
+                                             wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    data = {
+        'target_wallet_id': str(rich_wallet.id),
+        'amount': 1000,
+    }
+    headers = {'Idempotency-Key': str(uuid4())}
+    _, status = await post(f'/wallet/{wallet.id}/send', json=data, headers=headers)
+    assert (await IdempotencyKey.get(headers['Idempotency-Key'])).status_code == 409
+    await wallet.update(balance=5000).apply()
+    idempotency._outcomes.clear()
+    resp, repeated_status = await post(f'/wallet/{wallet.id}/send', json=data, headers=headers)
+
+    wallet = await Wallet.query.where(Wallet.id == wallet.id).gino.one()
+    assert status == repeated_status == 409
+    assert resp['detail'] == NotEnoughFundsException.__doc__
+    assert wallet.balance == 5000
+    assert len(await Transaction.query.where(Transaction.status == TransactionStatus.REJECTED).gino.all()) == 2
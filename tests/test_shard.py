@@ -0,0 +1,100 @@
+"""Hot wallet credit shards tests."""
+
+import asyncio
+from typing import Coroutine
+from uuid import uuid4
+
+import pytest
+from gino import Gino
+from pytest_mock import MockerFixture
+
+from wallet.commands import main
+from wallet.models import (
+    Wallet,
+    WalletShard,
+    db,
+)
+
+
+async def _shards(wallet: Wallet) -> list:
+    return [
+        shard.balance
+        for shard in await WalletShard.query.where(
+            WalletShard.wallet_id == wallet.id,
+        ).order_by(WalletShard.shard).gino.all()
+    ]
+
+
+@pytest.mark.asyncio
+async def test_credits(post: Coroutine, get: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    await wallet.set_shards(4)
+    for _ in range(20):
+        _, status = await post(f'/wallet/{rich_wallet.id}/send',
+                               json={'target_wallet_id': str(wallet.id), 'amount': 10})
+        assert status == 201
+
+    wallet = await Wallet.get(wallet.id)
+    assert wallet.balance == 0
+    assert sum(await _shards(wallet)) == 200
+    assert len([balance for balance in await _shards(wallet) if balance]) > 1
+    details, _ = await get(f'/wallet/{wallet.id}')
+    assert (details['balance'], details['available']) == (200, 200)
+    assert await wallet.get_balance() == await wallet.get_transaction_amount() == 200
+
+
+@pytest.mark.asyncio
+async def test_shard_debits(post: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    await wallet.set_shards(2)
+    await post(f'/wallet/{rich_wallet.id}/send', json={'target_wallet_id': str(wallet.id), 'amount': 100})
+    await post(f'/wallet/{wallet.id}/deposit', json={'bank_account_id': str(uuid4()), 'amount': 50})
+
+    # credits of all kinds land in the shards, debits are taken from the
+    # wallet row covered by them
+    _, status = await post(f'/wallet/{wallet.id}/send', json={'target_wallet_id': str(rich_wallet.id), 'amount': 120})
+    assert status == 201
+    _, status = await post(f'/wallet/{wallet.id}/send', json={'target_wallet_id': str(rich_wallet.id), 'amount': 31})
+    assert status == 409
+    _, status = await post(f'/wallet/{wallet.id}/hold', json={'target_wallet_id': str(rich_wallet.id), 'amount': 30})
+    assert status == 201
+    _, status = await post(f'/wallet/{wallet.id}/send', json={'target_wallet_id': str(rich_wallet.id), 'amount': 1})
+    assert status == 409
+
+    wallet = await Wallet.get(wallet.id)
+    assert (wallet.balance, await wallet.get_balance()) == (-120, 30)
+
+    # reconciliation keeps the shards as is
+    await wallet.update(balance=0).apply()
+    await wallet.reconcile()
+    assert (wallet.balance, await wallet.get_balance()) == (-120, 30)
+
+
+@pytest.mark.asyncio
+async def test_shard_credit_not_locked(post: Coroutine, wallet: Wallet, rich_wallet: Wallet) -> None:  # noqa: D103
+    await wallet.set_shards(2)
+    async with db.acquire() as connection:
+        async with connection.transaction():
+            await connection.status(Wallet.query.where(Wallet.id == wallet.id).with_for_update())
+            _, status = await asyncio.wait_for(
+                post(f'/wallet/{rich_wallet.id}/send', json={'target_wallet_id': str(wallet.id), 'amount': 10}),
+                timeout=5,
+            )
+    assert status == 201
+    assert await (await Wallet.get(wallet.id)).get_balance() == 10
+
+
+@pytest.mark.asyncio
+async def test_shards_grow_only(gino: Gino, wallet: Wallet) -> None:  # noqa: D103
+    await wallet.set_shards(2)
+    await wallet.set_shards(3)
+    assert await _shards(wallet) == [0, 0, 0]
+    with pytest.raises(ValueError):
+        await wallet.set_shards(1)
+
+
+def test_shard_command(mocker: MockerFixture) -> None:  # noqa: D103
+    wallet = Wallet(id=uuid4(), shards=0)
+    mocker.patch.object(Wallet, 'get', return_value=wallet)
+    set_shards = mocker.patch.object(Wallet, 'set_shards')
+    mocker.patch('wallet.commands.db.with_bind', return_value=mocker.MagicMock())
+    assert main(['shard', str(wallet.id), '8']) == 0
+    set_shards.assert_called_once_with(8)
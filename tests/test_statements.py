@@ -0,0 +1,75 @@
+"""Prepared statements registry tests."""
+
+import pytest
+from gino import Gino
+from httpx import AsyncClient
+from pytest_mock import MockerFixture
+
+from wallet.enum import (
+    TransactionStatus,
+    TransactionType,
+)
+from wallet.models import (
+    Transaction,
+    Wallet,
+    db,
+    statements,
+)
+from wallet.statements import (
+    Statement,
+    StatementRegistry,
+)
+
+
+def test_statement_arguments() -> None:  # noqa: D103
+    registry = StatementRegistry(db)
+    statement = registry.register('test', 'SELECT :b, CAST(:a AS int) + :b')
+    assert statement.query == 'SELECT $1, CAST($2 AS int) + $3'
+    assert statement.arguments(a=1, b=2) == [2, 1, 2]
+    with pytest.raises(ValueError):
+        registry.register('test', 'SELECT 1')
+
+
+@pytest.mark.asyncio
+async def test_statements_prepared(client: AsyncClient, wallet: Wallet) -> None:  # noqa: D103
+    # pool connections are warmed up by init_app
+    async with db.acquire() as connection:
+        prepared = {row[0] for row in await connection.all(db.text('SELECT statement FROM pg_prepared_statements'))}
+    assert {statement.query for statement in statements.statements.values()} <= prepared
+
+    resp = await client.get(f'/wallet/{wallet.id}')
+    assert resp.status_code == 200
+    assert await wallet.get_transaction_amount() == 0
+
+
+@pytest.mark.asyncio
+async def test_bulk_create(gino: Gino, mocker: MockerFixture, wallet: Wallet) -> None:  # noqa: D103
+    executemany = mocker.spy(Statement, 'executemany')
+    await Transaction.bulk_create(
+        {'account_id': wallet.account_id, 'amount': 10, 'kind': TransactionType.DEPOSIT},
+        {'account_id': wallet.account_id, 'amount': 20, 'kind': TransactionType.DEPOSIT,
+         'status': TransactionStatus.COMMITTED},
+        {'account_id': wallet.account_id, 'amount': 30, 'kind': TransactionType.SEND,
+         'status': TransactionStatus.HOLD},
+    )
+    assert executemany.call_count == 1
+
+    transactions = await Transaction.query.where(
+        Transaction.account_id == wallet.account_id,
+    ).order_by(Transaction.amount).gino.all()
+    assert [(transaction.kind, transaction.status) for transaction in transactions] == [
+        (TransactionType.DEPOSIT, TransactionStatus.NEW),
+        (TransactionType.DEPOSIT, TransactionStatus.COMMITTED),
+        (TransactionType.SEND, TransactionStatus.HOLD),
+    ]
+    assert await wallet.get_transaction_amount() == 20
+
+
+@pytest.mark.asyncio
+async def test_enum_labels(gino: Gino) -> None:  # noqa: D103
+    for enum in (TransactionStatus, TransactionType):
+        labels = await db.scalar(db.text(
+            'SELECT array_agg(enumlabel ORDER BY enumsortorder) FROM pg_enum '
+            'WHERE enumtypid = CAST(CAST(:name AS text) AS regtype)',
+        ), name=enum.__name__.lower())
+        assert labels == [member.name for member in enum]
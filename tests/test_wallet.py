@@ -1,15 +1,30 @@
 """Wallet endpoints tests."""
 
+import datetime
+import time
+import uuid
 from typing import Coroutine
 from uuid import uuid4
 
 import pytest
-
-from wallet.enum import TransactionType
+from gino.dialects.asyncpg import DBAPICursor
+from httpx import AsyncClient
+from pytest_mock import MockerFixture
+
+from wallet.cache import (
+    CACHE_REQUESTS,
+    Cache,
+    MemoryCache,
+)
+from wallet.enum import (
+    TransactionStatus,
+    TransactionType,
+)
 from wallet.models import (
     Account,
     Transaction,
     Wallet,
+    uuid7,
 )
 
 
@@ -53,6 +68,47 @@ async def test_wallet_details(get: Coroutine, wallet: Wallet) -> None:  # noqa:
     assert resp['id'] == str(wallet.id)
 
 
+@pytest.mark.asyncio
+async def test_wallet_details_cached(get: Coroutine, post: Coroutine, mocker: MockerFixture,  # noqa: D103
+                                     wallet: Wallet, rich_wallet: Wallet) -> None:
+    hits = CACHE_REQUESTS.values[(('cache', 'wallet'), ('result', 'hit'))]
+    first, _ = await get(f'/wallet/{rich_wallet.id}')
+    execute = mocker.spy(DBAPICursor, 'async_execute')
+    second, status = await get(f'/wallet/{rich_wallet.id}')
+    assert status == 200
+    assert second == first
+    assert execute.call_count == 0
+    assert CACHE_REQUESTS.values[(('cache', 'wallet'), ('result', 'hit'))] == hits + 1
+
+    _, status = await post(f'/wallet/{rich_wallet.id}/send', json={'target_wallet_id': str(wallet.id), 'amount': 100})
+    assert status == 201
+    resp, _ = await get(f'/wallet/{rich_wallet.id}')
+    assert resp['balance'] == first['balance'] - 100
+
+
+@pytest.mark.asyncio
+async def test_memory_cache_expiration() -> None:  # noqa: D103
+    cache = MemoryCache('test', ttl=0, max_size=1)
+    await cache.set('key', 'value')
+    assert await cache.get('key') is None
+    with pytest.raises(TypeError):
+        Cache('test', ttl=0)
+
+
+@pytest.mark.asyncio
+async def test_wallet_timestamps(post: Coroutine, rich_wallet: Wallet) -> None:  # noqa: D103
+    first, _ = await post('/wallet', json={'user_id': str(uuid4())})
+    second, _ = await post('/wallet', json={'user_id': str(uuid4())})
+    assert first['date_created'] < second['date_created']
+
+    await post(f'/wallet/{rich_wallet.id}/send', json={'target_wallet_id': first['id'], 'amount': 10})
+    wallet = await Wallet.get(first['id'])
+    assert wallet.date_updated > wallet.date_created
+    transaction = await Transaction.query.where(Transaction.account_id == wallet.account_id).gino.one()
+    assert abs(transaction.date_created - datetime.datetime.utcnow()) < datetime.timedelta(seconds=5)
+    assert transaction.date_created == wallet.date_updated
+
+
 @pytest.mark.asyncio
 async def test_wallet_details_incorrect_data(get: Coroutine) -> None:  # noqa: D103
     resp, status = await get('/wallet/abcd')
@@ -78,3 +134,116 @@ async def test_transactions_list(get: Coroutine, wallet: Wallet) -> None:  # noq
     assert status == 200
     assert len(resp) == tx_num
     assert resp[0]['amount'] == 1
+
+
+@pytest.mark.asyncio
+async def test_transactions_list_pagination(client: AsyncClient, wallet: Wallet) -> None:  # noqa: D103
+    for amount in range(1, 4):
+        await Transaction.create(
+            account_id=wallet.account.id,
+            amount=amount,
+            kind=TransactionType.DEPOSIT,
+        )
+    first = await client.get(f'/wallet/{wallet.id}/history', params={'limit': 2})
+    cursor = first.headers['X-Next-Cursor']
+    second = await client.get(f'/wallet/{wallet.id}/history', params={'limit': 2, 'after': cursor})
+
+    assert first.status_code == second.status_code == 200
+    assert len(first.json()) == 2
+    assert len(second.json()) == 1
+    assert 'X-Next-Cursor' not in second.headers
+    assert {tx['id'] for tx in first.json() + second.json()} == {
+        str(tx.id) for tx in await Transaction.query.gino.all()
+    }
+
+
+@pytest.mark.asyncio
+async def test_transactions_list_order(client: AsyncClient, wallet: Wallet) -> None:  # noqa: D103
+    date_created = datetime.datetime.utcnow()
+    await Transaction.bulk_create(*(
+        {'account_id': wallet.account_id, 'amount': amount, 'kind': TransactionType.DEPOSIT,
+         'date_created': date_created}
+        for amount in range(1, 6)
+    ))
+    first = await client.get(f'/wallet/{wallet.id}/history', params={'limit': 3})
+    second = await client.get(f'/wallet/{wallet.id}/history',
+                              params={'limit': 3, 'after': first.headers['X-Next-Cursor']})
+    assert [tx['amount'] for tx in first.json() + second.json()] == [5, 4, 3, 2, 1]
+
+
+def test_uuid7() -> None:  # noqa: D103
+    ids = [uuid7() for _ in range(1000)]
+    assert ids == sorted(ids, key=lambda id_: id_.bytes)
+    assert len(set(ids)) == len(ids)
+    assert {(id_.version, id_.variant) for id_ in ids} == {(7, uuid.RFC_4122)}
+    assert abs(int.from_bytes(ids[0].bytes[:6], 'big') - time.time() * 1000) < 1000
+
+
+@pytest.mark.asyncio
+async def test_transactions_list_filters(get: Coroutine, wallet: Wallet) -> None:  # noqa: D103
+    for kind in (TransactionType.DEPOSIT, TransactionType.SEND, TransactionType.SEND):
+        await Transaction.create(
+            account_id=wallet.account.id,
+            amount=1,
+            kind=kind,
+        )
+    resp, status = await get(f'/wallet/{wallet.id}/history?kind={TransactionType.SEND.value}')
+    assert status == 200
+    assert len(resp) == 2
+
+    resp, status = await get(f'/wallet/{wallet.id}/history?status={TransactionStatus.COMMITTED.value}')
+    assert status == 200
+    assert resp == []
+
+
+@pytest.mark.asyncio
+async def test_transactions_list_aware_dates(client: AsyncClient, wallet: Wallet) -> None:  # noqa: D103
+    date_created = datetime.datetime.utcnow().replace(microsecond=0)
+    await Transaction.create(
+        account_id=wallet.account.id,
+        amount=1,
+        kind=TransactionType.DEPOSIT,
+        date_created=date_created,
+    )
+    offset = datetime.timezone(datetime.timedelta(hours=2))
+    aware = date_created.replace(tzinfo=datetime.timezone.utc).astimezone(offset)
+    for params, count in (
+        ({'date_from': '2020-01-01T00:00:00Z'}, 1),
+        ({'date_from': aware.isoformat()}, 1),
+        ({'date_to': aware.isoformat()}, 0),
+        ({'date_to': (aware + datetime.timedelta(seconds=1)).isoformat()}, 1),
+    ):
+        resp = await client.get(f'/wallet/{wallet.id}/history', params=params)
+        assert resp.status_code == 200
+        assert len(resp.json()) == count
+    resp = await client.get(f'/wallet/{wallet.id}/history/export',
+                            params={'format': 'ndjson', 'date_from': '2020-01-01T00:00:00Z'})
+    assert resp.status_code == 200
+    assert len(resp.text.splitlines()) == 1
+
+
+@pytest.mark.asyncio
+async def test_transactions_list_wrong_cursor(get: Coroutine, wallet: Wallet) -> None:  # noqa: D103
+    resp, status = await get(f'/wallet/{wallet.id}/history?after=abcd')
+    assert status == 422
+
+
+@pytest.mark.parametrize(
+    'export_format,lines',
+    (
+        ('ndjson', 3),
+        ('csv', 4),
+    ),
+)
+@pytest.mark.asyncio
+async def test_transactions_export(client: AsyncClient, wallet: Wallet,
+                                   export_format: str, lines: int) -> None:  # noqa: D103
+    for _ in range(3):
+        await Transaction.create(
+            account_id=wallet.account.id,
+            amount=1,
+            kind=TransactionType.DEPOSIT,
+        )
+    resp = await client.get(f'/wallet/{wallet.id}/history/export', params={'format': export_format})
+    assert resp.status_code == 200
+    assert len(resp.text.splitlines()) == lines
@@ -0,0 +1,254 @@
+"""
+Cold ledger archive.
+
+Detached ledger partitions are exported to zstd compressed Parquet files
+sorted by account, so reading one account history touches a few row groups
+of the memory mapped file only.
+"""
+
+import asyncio
+import datetime
+import os
+import re
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+from uuid import UUID
+
+from .conf import settings
+from .enum import (
+    TransactionStatus,
+    TransactionType,
+)
+from .models import (
+    Transaction,
+    db,
+    from_units,
+    month_start,
+)
+from .schema.input import HistoryFilterType
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = pc = pq = None
+
+_COLUMNS = ('id', 'account_id', 'entry_id', 'amount', 'kind', 'status', 'date_created', 'seq')
+
+_ARCHIVE_NAME = re.compile(rf'^{Transaction.__tablename__}_y(\d{{4}})m(\d{{2}})\.parquet$')
+
+
+def _schema() -> 'pa.Schema':
+    if pa is None:
+        raise RuntimeError('pyarrow package is required for the ledger archive')
+    return pa.schema([
+        ('id', pa.string()),
+        ('account_id', pa.string()),
+        ('entry_id', pa.string()),
+        ('amount', pa.decimal128(settings.ASSET_AMOUNT_MAX_DIGITS, settings.ASSET_AMOUNT_PRECISION)),
+        ('kind', pa.string()),
+        ('status', pa.string()),
+        ('date_created', pa.timestamp('us')),
+        ('seq', pa.int64()),
+    ])
+
+
+def archive_path(name: str) -> Path:
+    """
+    Archive file of the ledger partition.
+
+    :param name: partition name
+    :return: file path
+    """
+    return Path(settings.LEDGER_ARCHIVE_PATH) / f'{name}.parquet'
+
+
+def archives(newer_than: Optional[datetime.datetime] = None,
+             older_than: Optional[datetime.datetime] = None) -> List[Path]:
+    """
+    List archive files.
+
+    :param newer_than: skip the archives of the months ended before the date
+    :param older_than: skip the archives of the months started after the date
+    :return: file paths
+    """
+    if not settings.LEDGER_ARCHIVE_PATH or not os.path.isdir(settings.LEDGER_ARCHIVE_PATH):
+        return []
+    paths = []
+    for entry in os.scandir(settings.LEDGER_ARCHIVE_PATH):
+        match = _ARCHIVE_NAME.match(entry.name)
+        if match is None:
+            continue
+        date_from = datetime.date(int(match[1]), int(match[2]), 1)
+        date_to = month_start(1, date_from)
+        if newer_than is not None and datetime.datetime.combine(date_to, datetime.time()) <= newer_than:
+            continue
+        if older_than is not None and datetime.datetime.combine(date_from, datetime.time()) > older_than:
+            continue
+        paths.append(Path(entry.path))
+    return sorted(paths)
+
+
+async def archive_partition(name: str, chunk_size: int) -> Path:
+    """
+    Export the detached ledger partition to the archive file and drop it.
+
+    File is written under a temporary name first, so the partition is
+    exported again from scratch if the process is interrupted.
+
+    :param name: partition name
+    :param chunk_size: rows fetched and written as one row group
+    :return: archive file path
+    """
+    schema = _schema()
+    path = archive_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix('.tmp')
+    loop = asyncio.get_event_loop()
+
+    writer = pq.ParquetWriter(str(temporary), schema, compression='zstd')
+    try:
+        async with db.transaction():
+            cursor = await db.iterate(db.text(
+                f'SELECT {", ".join(_COLUMNS)} FROM {name} ORDER BY account_id, date_created, id',
+            ))
+            while True:
+                rows = await cursor.many(chunk_size)
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                batch = pa.record_batch([
+                    pa.array([str(value) for value in columns[0]], pa.string()),
+                    pa.array([str(value) for value in columns[1]], pa.string()),
+                    pa.array([None if value is None else str(value) for value in columns[2]], pa.string()),
+                    pa.array([from_units(value) for value in columns[3]], schema.field('amount').type),
+                    pa.array(columns[4], pa.string()),
+                    pa.array(columns[5], pa.string()),
+                    pa.array(columns[6], pa.timestamp('us')),
+                    pa.array(columns[7], pa.int64()),
+                ], schema=schema)
+                await loop.run_in_executor(None, writer.write_batch, batch)
+    finally:
+        await loop.run_in_executor(None, writer.close)
+    os.replace(temporary, path)
+    await db.status(db.text(f'DROP TABLE {name}'))
+    return path
+
+
+def _read_table(path: Path, conditions: List[Tuple[str, str, Any]]) -> 'pa.Table':
+    columns = list(_COLUMNS[:-1])
+    schema = pa.schema([_schema().field(name) for name in columns])
+    names = pq.read_schema(path).names
+    # files written before the journal have no entry ids
+    missing = [name for name in columns if name not in names]
+    if any(name in missing for name, _, _ in conditions):
+        return schema.empty_table()
+    table = pq.read_table(path, columns=[name for name in columns if name in names], filters=conditions,
+                          memory_map=True)
+    for name in missing:
+        table = table.append_column(name, pa.nulls(len(table), pa.string()))
+    # files written before the amount precision change have the narrower decimals
+    return table.select(columns).cast(schema)
+
+
+def _rows(table: 'pa.Table') -> List[dict]:
+    return [
+        {
+            **row,
+            'id': UUID(row['id']),
+            'account_id': UUID(row['account_id']),
+            'entry_id': None if row['entry_id'] is None else UUID(row['entry_id']),
+            'kind': TransactionType[row['kind']],
+            'status': TransactionStatus[row['status']],
+        }
+        for row in table.to_pylist()
+    ]
+
+
+def _read(path: Path, account_id: UUID, filters: HistoryFilterType,
+          before: Optional[Tuple[datetime.datetime, UUID]]) -> 'pa.Table':
+    conditions: List[Tuple[str, str, Any]] = [('account_id', '=', str(account_id))]
+    if filters.kind is not None:
+        conditions.append(('kind', '=', filters.kind.name))
+    if filters.status is not None:
+        conditions.append(('status', '=', filters.status.name))
+    if filters.date_from is not None:
+        conditions.append(('date_created', '>=', filters.date_from))
+    if filters.date_to is not None:
+        conditions.append(('date_created', '<', filters.date_to))
+    if before is not None:
+        conditions.append(('date_created', '<=', before[0]))
+    table = _read_table(path, conditions)
+    if before is not None:
+        date_created, transaction_id = before
+        table = table.filter(pc.or_(
+            pc.less(table['date_created'], pa.scalar(date_created, pa.timestamp('us'))),
+            pc.and_(
+                pc.equal(table['date_created'], pa.scalar(date_created, pa.timestamp('us'))),
+                pc.less(table['id'], str(transaction_id)),
+            ),
+        ))
+    return table
+
+
+def read_history(paths: List[Path], account_id: UUID, filters: HistoryFilterType,
+                 before: Optional[Tuple[datetime.datetime, UUID]], limit: int) -> List[dict]:
+    """
+    Read the newest archived account transactions.
+
+    Counterparty legs are looked up in the archives of the months of the
+    transactions read, both legs of the entry share the creation date.
+
+    :param paths: archive files
+    :param account_id: account id
+    :param filters: history filters
+    :param before: (date_created, id) to read the transactions before
+    :param limit: maximum number of transactions
+    :return: transactions ordered from the newest
+    """
+    _schema()
+    table = pa.concat_tables([_read(path, account_id, filters, before) for path in paths])
+    table = table.sort_by([('date_created', 'descending'), ('id', 'descending')]).slice(0, limit)
+    rows = _rows(table)
+    months = {archive_path(Transaction.partition_name(row['date_created'])) for row in rows}
+    counterparties = _counterparties(
+        [path for path in paths if path in months],
+        account_id,
+        [str(row['entry_id']) for row in rows if row['entry_id'] is not None],
+    )
+    return [{**row, 'counterparty_account_id': counterparties.get(row['entry_id'])} for row in rows]
+
+
+def _counterparties(paths: List[Path], account_id: UUID, entry_ids: List[str]) -> Dict[UUID, UUID]:
+    if not paths or not entry_ids:
+        return {}
+    table = pa.concat_tables([_read_table(path, [('entry_id', 'in', entry_ids)]) for path in paths])
+    return {
+        UUID(entry_id): UUID(leg_account_id)
+        for entry_id, leg_account_id in zip(table['entry_id'].to_pylist(), table['account_id'].to_pylist())
+        if leg_account_id != str(account_id)
+    }
+
+
+def read_entry(entry_id: UUID, date_created: datetime.datetime) -> List[dict]:
+    """
+    Read the archived legs of the journal entry, the debited one goes first.
+
+    Legs share the entry creation date, so only the archive of its month is read.
+
+    :param entry_id: journal entry id
+    :param date_created: journal entry creation date
+    :return: transactions
+    """
+    path = archive_path(Transaction.partition_name(date_created))
+    if pa is None or not path.exists():
+        return []
+    table = _read_table(path, [('entry_id', '=', str(entry_id)), ('date_created', '=', date_created)])
+    return _rows(table.sort_by([('amount', 'ascending'), ('id', 'ascending')]))
@@ -0,0 +1,202 @@
+"""Caches."""
+
+import logging
+import time
+from abc import (
+    ABC,
+    abstractmethod,
+)
+from collections import OrderedDict
+from typing import (
+    Any,
+    Hashable,
+    Optional,
+)
+
+from .conf import settings
+from .metrics import Counter
+
+try:
+    from redis import asyncio as redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups.')
+
+
+class LRUCache:
+    """Bounded least recently used cache with entries expiration."""
+
+    def __init__(self, max_size: int, ttl: float) -> None:  # noqa: D107
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: 'OrderedDict[Hashable, Any]' = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get the cached value.
+
+        :param key: cache key
+        :return: value or None if it is missing or expired
+        """
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            return None
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:  # noqa: A003
+        """
+        Cache the value evicting the least recently used one if cache is full.
+
+        :param key: cache key
+        :param value: value
+        :param ttl: value time to live, cache ttl is used by default
+        :return: None
+        """
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        """
+        Drop the cached value.
+
+        :param key: cache key
+        :return: None
+        """
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Drop all the cached values.
+
+        :return: None
+        """
+        self._data.clear()
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._data)
+
+
+class Cache(ABC):
+    """
+    Asynchronous cache backend.
+
+    Values are strings, lookups are counted by the ``cache_requests_total`` metric.
+    """
+
+    def __init__(self, name: str, ttl: float) -> None:  # noqa: D107
+        self.name = name
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[str]:
+        """
+        Get the cached value.
+
+        :param key: cache key
+        :return: value or None on cache miss
+        """
+        value = await self._get(key)
+        CACHE_REQUESTS.inc(cache=self.name, result='miss' if value is None else 'hit')
+        return value
+
+    @abstractmethod
+    async def set(self, key: str, value: str) -> None:  # noqa: A003
+        """
+        Cache the value.
+
+        :param key: cache key
+        :param value: value
+        :return: None
+        """
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> None:
+        """
+        Drop the cached values.
+
+        :param keys: cache keys
+        :return: None
+        """
+
+    @abstractmethod
+    async def _get(self, key: str) -> Optional[str]:
+        pass
+
+
+class MemoryCache(Cache):
+    """Process local cache."""
+
+    def __init__(self, name: str, ttl: float, max_size: int) -> None:  # noqa: D107
+        super().__init__(name, ttl)
+        self._lru = LRUCache(max_size=max_size, ttl=ttl)
+
+    async def _get(self, key: str) -> Optional[str]:
+        return self._lru.get(key)
+
+    async def set(self, key: str, value: str) -> None:  # noqa: A003, D102
+        self._lru.set(key, value)
+
+    async def delete(self, *keys: str) -> None:  # noqa: D102
+        for key in keys:
+            self._lru.delete(key)
+
+
+class RedisCache(Cache):
+    """
+    Redis compatible server cache shared between the processes.
+
+    Cache errors are logged and handled as misses, so the service keeps
+    working on top of the database if the cache server is down.
+    """
+
+    def __init__(self, name: str, ttl: float, url: str) -> None:  # noqa: D107
+        if redis is None:
+            raise RuntimeError('redis package is required for the redis cache backend')
+        super().__init__(name, ttl)
+        self._client = redis.from_url(url)
+
+    async def _get(self, key: str) -> Optional[str]:
+        try:
+            value = await self._client.get(f'{self.name}:{key}')
+        except redis.RedisError:
+            logger.warning('Cache %s is unavailable', self.name, exc_info=True)
+            return None
+        return None if value is None else value.decode()
+
+    async def set(self, key: str, value: str) -> None:  # noqa: A003, D102
+        try:
+            await self._client.set(f'{self.name}:{key}', value, px=int(self.ttl * 1000))
+        except redis.RedisError:
+            logger.warning('Cache %s is unavailable', self.name, exc_info=True)
+
+    async def delete(self, *keys: str) -> None:  # noqa: D102
+        if not keys:
+            return
+        try:
+            await self._client.delete(*(f'{self.name}:{key}' for key in keys))
+        except redis.RedisError:
+            logger.warning('Cache %s is unavailable', self.name, exc_info=True)
+
+
+def create_cache(name: str) -> Cache:
+    """
+    Create cache configured by the ``CACHE_BACKEND`` setting.
+
+    :param name: cache name used as the key prefix and metrics label
+    :return: cache
+    """
+    if settings.CACHE_BACKEND == 'redis':
+        return RedisCache(name, ttl=settings.CACHE_TTL, url=settings.CACHE_URL)
+    return MemoryCache(name, ttl=settings.CACHE_TTL, max_size=settings.CACHE_SIZE)
+
+
+wallet_cache = create_cache('wallet')
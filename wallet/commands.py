@@ -0,0 +1,238 @@
+"""
+Management commands.
+
+Usage: ``python -m wallet.commands <command>``.
+"""
+
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import logging.config
+import sys
+from collections import Counter
+from decimal import Decimal
+from pathlib import Path
+from typing import (
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+from uuid import UUID
+
+from pydantic import ValidationError
+
+from .conf import settings
+from .exceptions import DepositExists
+from .helpers import create_deposit_batch
+from .models import (
+    Asset,
+    BalanceCheckpoint,
+    Wallet,
+    db,
+)
+from .schema.input import DepositImportType
+from .tasks import (
+    checkpoint_balances,
+    maintain_partitions,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def reconcile(args: argparse.Namespace) -> int:
+    """
+    Check balance checkpoints against the full ledger.
+
+    :param args: command line arguments
+    :return: exit code
+    """
+    mismatches = await BalanceCheckpoint.verify()
+    for account_id, seq, amount, ledger in mismatches:
+        logger.error('Checkpoint mismatch: account %s seq %s checkpoint %s ledger %s',
+                     account_id, seq, amount, ledger)
+    logger.info('%s checkpoint mismatches found', len(mismatches))
+    return 1 if mismatches else 0
+
+
+async def checkpoint(args: argparse.Namespace) -> int:
+    """
+    Create balance checkpoints right now.
+
+    :param args: command line arguments
+    :return: exit code
+    """
+    await checkpoint_balances()
+    return 0
+
+
+async def partitions(args: argparse.Namespace) -> int:
+    """
+    Create the upcoming ledger partitions and detach the expired ones right now.
+
+    :param args: command line arguments
+    :return: exit code
+    """
+    await maintain_partitions()
+    return 0
+
+
+def _read_statement(path: Path, file_format: str) -> Iterator[Tuple[int, dict]]:
+    with path.open(newline='') as statement:
+        if file_format == 'csv':
+            # header is the first line
+            yield from enumerate(csv.DictReader(statement), 2)
+        else:
+            yield from ((line, json.loads(row)) for line, row in enumerate(statement, 1) if row.strip())
+
+
+async def ingest(args: argparse.Namespace) -> int:
+    """
+    Load deposits from a bank statement file.
+
+    File is read in chunks, every chunk is deposited in a single database
+    transaction. Rows which are already deposited are skipped, so the file
+    can be loaded again after a failure.
+
+    :param args: command line arguments
+    :return: exit code
+    """
+    file_format = args.format or ('csv' if args.file.suffix.lower() == '.csv' else 'ndjson')
+    rows = _read_statement(args.file, file_format)
+    totals = Counter()
+    while True:
+        chunk = list(itertools.islice(rows, args.chunk_size))
+        if not chunk:
+            break
+        deposits = []
+        for line, row in chunk:
+            try:
+                deposits.append((line, DepositImportType(**row)))
+            except (ValidationError, TypeError) as e:
+                logger.warning('Line %s rejected: %s', line, str(e).replace('\n', ' '))
+                totals['rejected'] += 1
+
+        results = await create_deposit_batch([
+            (deposit.reference, deposit.wallet_id, deposit.bank_account_id, deposit.amount)
+            for _, deposit in deposits
+        ]) if deposits else []
+        for (line, _), error in zip(deposits, results):
+            if error is None:
+                totals['deposited'] += 1
+            elif isinstance(error, DepositExists):
+                totals['skipped'] += 1
+            else:
+                logger.warning('Line %s rejected: %s', line, error.detail)
+                totals['rejected'] += 1
+        totals['processed'] += len(chunk)
+        logger.info('%(processed)s rows processed: %(deposited)s deposited, '
+                    '%(skipped)s skipped, %(rejected)s rejected', totals)
+    return 1 if totals['rejected'] else 0
+
+
+async def shard(args: argparse.Namespace) -> int:
+    """
+    Spread the credits of a hot wallet across the shards.
+
+    :param args: command line arguments
+    :return: exit code
+    """
+    wallet = await Wallet.get(args.wallet_id)
+    if wallet is None:
+        logger.error('Wallet %s does not exist', args.wallet_id)
+        return 1
+    if args.count < wallet.shards:
+        logger.error('Wallet %s has %s shards already', wallet.id, wallet.shards)
+        return 1
+    await wallet.set_shards(args.count)
+    logger.info('Wallet %s credits are spread across %s shards', wallet.id, args.count)
+    return 0
+
+
+async def asset(args: argparse.Namespace) -> int:
+    """
+    Register a new asset.
+
+    Precision of the registered assets cannot be changed, their amounts are
+    already in the ledger. Transaction limits are TRANSACTION_MIN_AMOUNT and
+    TRANSACTION_MAX_AMOUNT by default.
+
+    :param args: command line arguments
+    :return: exit code
+    """
+    if not 0 <= args.precision <= settings.ASSET_AMOUNT_PRECISION:
+        logger.error('Asset precision must be between 0 and %s', settings.ASSET_AMOUNT_PRECISION)
+        return 1
+    if not 0 < args.min_amount <= args.max_amount:
+        logger.error('Asset limits must be positive and ordered')
+        return 1
+    if await Asset.get(args.code) is not None:
+        logger.error('Asset %s exists already', args.code)
+        return 1
+    await Asset.create(code=args.code, precision=args.precision,
+                       min_amount=args.min_amount, max_amount=args.max_amount)
+    logger.info('Asset %s is registered with %s decimal places', args.code, args.precision)
+    return 0
+
+
+COMMANDS = {
+    'reconcile': reconcile,
+    'checkpoint': checkpoint,
+    'partitions': partitions,
+    'ingest': ingest,
+    'shard': shard,
+    'asset': asset,
+}
+
+
+async def run(args: argparse.Namespace) -> int:
+    """
+    Run the command with database bound.
+
+    :param args: command line arguments
+    :return: exit code
+    """
+    async with db.with_bind(settings.DB_DSN,
+                            echo=settings.DB_ECHO,
+                            min_size=settings.DB_POOL_MIN_SIZE,
+                            max_size=settings.DB_POOL_MAX_SIZE,
+                            ssl=settings.DB_SSL):
+        return await COMMANDS[args.command](args)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command line entry point.
+
+    :param argv: command line arguments
+    :return: exit code
+    """
+    logging.config.dictConfig(settings.logging_params)
+    parser = argparse.ArgumentParser(prog='python -m wallet.commands')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    parsers = {
+        name: subparsers.add_parser(name, help=command.__doc__.strip().splitlines()[0])
+        for name, command in COMMANDS.items()
+    }
+    parsers['ingest'].add_argument('file', type=Path, help='bank statement file')
+    parsers['ingest'].add_argument('--format', choices=('csv', 'ndjson'),
+                                   help='file format, guessed by the file extension if omitted')
+    parsers['ingest'].add_argument('--chunk-size', type=int, default=settings.DEPOSIT_IMPORT_CHUNK_SIZE,
+                                   help='rows deposited within one database transaction')
+    parsers['shard'].add_argument('wallet_id', type=UUID, help='wallet id')
+    parsers['shard'].add_argument('count', type=int, help='number of shards, it can only grow')
+    parsers['asset'].add_argument('code', help='currency code or ticker')
+    parsers['asset'].add_argument('precision', type=int, help='decimal places of the amounts')
+    parsers['asset'].add_argument('--min-amount', type=Decimal, default=Decimal(str(settings.TRANSACTION_MIN_AMOUNT)),
+                                  help='smallest amount of the transaction')
+    parsers['asset'].add_argument('--max-amount', type=Decimal, default=Decimal(str(settings.TRANSACTION_MAX_AMOUNT)),
+                                  help='largest amount of the transaction')
+    args = parser.parse_args(argv)
+    return asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
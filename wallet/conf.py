@@ -24,6 +24,17 @@ dynaconf.settings.DB_DSN = DB_DSN = URL(
     **DB_DSN_KW,
 )
 
+# replica shares the primary credentials
+dynaconf.settings.DB_REPLICA_DSN = DB_REPLICA_DSN = URL(
+    drivername='asyncpg',
+    **{
+        **DB_DSN_KW,
+        'host': dynaconf.settings.DB_REPLICA_HOST,
+        'port': dynaconf.settings.DB_REPLICA_PORT,
+        'database': dynaconf.settings.DB_REPLICA_DATABASE,
+    },
+) if dynaconf.settings.DB_REPLICA_HOST else None
+
 dynaconf.settings.logging_params = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -39,8 +50,10 @@ dynaconf.settings.logging_params = {
 
 # these settings should not be moved to env variables
 # cuz it affects database migrations and only can be
-# changed followed by the database migrations
-dynaconf.settings.ASSET_AMOUNT_MAX_DIGITS = 12
-dynaconf.settings.ASSET_AMOUNT_PRECISION = 2
+# changed followed by the database migrations,
+# amounts are stored as bigint numbers of the smallest
+# units, precision is the largest one of the assets
+dynaconf.settings.ASSET_AMOUNT_MAX_DIGITS = 18
+dynaconf.settings.ASSET_AMOUNT_PRECISION = 8
 
 settings = dynaconf.settings
@@ -7,8 +7,10 @@ class TransactionStatus(Enum):
     """Transaction statuses."""
 
     NEW = 'New'
+    HOLD = 'Hold'
     COMMITTED = 'Committed'
     REJECTED = 'Rejected'
+    CANCELLED = 'Cancelled'
     ERROR = 'Failed'
 
 
@@ -18,3 +20,11 @@ class TransactionType(Enum):
     DEPOSIT = 'Deposit'
     SEND = 'Send'
     TRANSFER = 'Transfer'
+
+
+class OperationStatus(Enum):
+    """Queued transfer statuses."""
+
+    QUEUED = 'Queued'
+    COMMITTED = 'Committed'
+    REJECTED = 'Rejected'
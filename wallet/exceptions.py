@@ -39,5 +39,61 @@ class BankAccountDoesNotExists(JATIException):
     status_code = 404
 
 
+class DepositExists(JATIException):
+    """Deposit is already processed."""
+
+
 class WalletWrongException(JATIException):
     """Cannot send money to yourself."""
+
+
+class IdempotencyKeyReused(JATIException):
+    """Idempotency key is already used for another request."""
+
+    status_code = 422
+
+
+class CursorWrongException(JATIException):
+    """History cursor is malformed."""
+
+    status_code = 422
+
+
+class HoldDoesNotExists(JATIException):
+    """Hold cannot be found or is already released."""
+
+    status_code = 404
+
+
+class OperationDoesNotExists(JATIException):
+    """Queued operation cannot be found."""
+
+    status_code = 404
+
+
+class EntryDoesNotExists(JATIException):
+    """Journal entry cannot be found."""
+
+    status_code = 404
+
+
+class AssetDoesNotExists(JATIException):
+    """Asset cannot be found."""
+
+    status_code = 404
+
+
+class AssetWrongException(JATIException):
+    """Wallets hold different assets."""
+
+
+class AmountPrecisionException(JATIException):
+    """Amount has more decimal places than the asset allows."""
+
+    status_code = 422
+
+
+class AmountLimitException(JATIException):
+    """Amount is out of the asset limits."""
+
+    status_code = 422
@@ -1,41 +1,178 @@
 """Database operation helpers."""
 
-from datetime import datetime
+import asyncio
+import base64
+import contextlib
+import csv
+import functools
+import io
+import itertools
+import logging
+import operator
+import random
+from contextvars import ContextVar
+from datetime import (
+    datetime,
+    timedelta,
+)
 from decimal import Decimal
-from typing import Union
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 from uuid import (
     UUID,
-    uuid4,
+    uuid5,
 )
 
+from asyncpg.exceptions import TransactionRollbackError
 from gino import NoResultFound
+from sqlalchemy import (
+    Column,
+    any_,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.sql import (
+    ColumnElement,
+    Select,
+)
 
+from .archive import (
+    archives,
+    read_history,
+)
+from .cache import wallet_cache
+from .conf import settings
 from .enum import (
     TransactionStatus,
     TransactionType,
 )
 from .exceptions import (
+    AmountLimitException,
+    AmountPrecisionException,
+    AssetDoesNotExists,
+    AssetWrongException,
     BankAccountDoesNotExists,
+    CursorWrongException,
+    DepositExists,
+    HoldDoesNotExists,
+    JATIException,
     NotEnoughFundsException,
     WalletDoesNotExists,
     WalletExists,
+    WalletWrongException,
 )
 from .models import (
+    ASSET_STEP,
+    SHARD_BALANCE,
+    UTC_NOW,
     Account,
+    Asset,
+    JournalEntry,
     Transaction,
+    TransferOperation,
     UserBankAccount,
     Wallet,
     db,
+    hold_target_id,
+    statements,
+    to_units,
+    uuid7,
+)
+from .schema.input import (
+    ExportFormat,
+    HistoryFilterType,
 )
+from .schema.output import TransactionSchema
+
+logger = logging.getLogger(__name__)
+
+
+def retry_on_conflict(func: Callable) -> Callable:
+    """
+    Retry the coroutine on deadlock and serialization failures.
+
+    Retries are made with an exponential backoff and full jitter.
+
+    :param func: coroutine function running a database transaction
+    :return: wrapped coroutine function
+    """
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        for attempt in range(settings.TRANSFER_RETRIES):
+            try:
+                return await func(*args, **kwargs)
+            except TransactionRollbackError as e:
+                logger.warning('%s attempt %s failed: %s', func.__name__, attempt + 1, e)
+                await asyncio.sleep(random.uniform(0, settings.TRANSFER_RETRY_DELAY * 2 ** attempt))
+        return await func(*args, **kwargs)
+    return wrapper
+
+
+# Wallets invalidated within the deferred invalidation block
+_deferred: ContextVar[Optional[Set[str]]] = ContextVar('deferred_invalidation', default=None)
+
+
+async def invalidate_wallets(*wallets: Union[Wallet, UserBankAccount, UUID]) -> None:
+    """
+    Drop the cached wallet details after the balance change.
+
+    Within the deferred invalidation block wallets are dropped at its end.
+
+    :param wallets: wallets or wallet ids, bank accounts are skipped
+    :return: None
+    """
+    keys = {
+        str(wallet if isinstance(wallet, UUID) else wallet.id)
+        for wallet in wallets if not isinstance(wallet, UserBankAccount)
+    }
+    deferred = _deferred.get()
+    if deferred is not None:
+        deferred.update(keys)
+        return
+    await wallet_cache.delete(*keys)
 
 
-async def create_wallet(user_id: UUID) -> Wallet:
+@contextlib.asynccontextmanager
+async def deferred_invalidation() -> AsyncIterator[None]:
+    """
+    Drop the cached wallet details changed within the block after it exits.
+
+    Balances changed within the outer database transaction are visible to the
+    readers only after the commit, a wallet cached in between would keep the
+    stale balance. Nothing is dropped if the block fails.
+
+    :return: None
+    """
+    keys: Set[str] = set()
+    token = _deferred.set(keys)
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+    await wallet_cache.delete(*keys)
+
+
+async def create_wallet(user_id: UUID, asset: str) -> Wallet:
     """
     Create wallet helper.
 
+    User has one wallet per asset, every wallet gets its own ledger account.
+
     :param user_id: user id
+    :param asset: asset code
     :return: Wallet
     """
+    if await Asset.get(asset) is None:
+        raise AssetDoesNotExists()
     join = Account.join(
         Wallet,
         Wallet.account_id == Account.id,
@@ -43,15 +180,16 @@ async def create_wallet(user_id: UUID) -> Wallet:
     wallet_exists = await db.scalar(db.exists(
         Account.query.select_from(join).where(
             Account.user_id == user_id,
+        ).where(
+            Wallet.asset == asset,
         ),
     ).select())
     if wallet_exists:
         raise WalletExists()
 
-    connection = await db.acquire()
-    async with connection.transaction():
+    async with db.transaction():
         account = await Account.create(user_id=user_id)
-        wallet = await Wallet.create(account_id=account.id)
+        wallet = await Wallet.create(account_id=account.id, asset=asset)
         return wallet
 
 
@@ -63,8 +201,7 @@ async def create_bank_account(user_id: UUID, bank_account_id: UUID = None) -> Us
     :param bank_account_id: bank account id to create with
     :return: UserBankAccount
     """
-    connection = await db.acquire()
-    async with connection.transaction():
+    async with db.transaction():
         abstract_account = await Account.create(user_id=user_id)
         bank_account = await UserBankAccount.create(
             id=bank_account_id,
@@ -74,46 +211,184 @@ async def create_bank_account(user_id: UUID, bank_account_id: UUID = None) -> Us
     return bank_account
 
 
-async def _transfer_money(source: Union[Wallet, UserBankAccount],
-                          target: Union[Wallet, UserBankAccount],
+# Source and target of the transfer are given either by account id or wallet id
+_ACCOUNT = 'SELECT CAST(:{name} AS uuid) AS account_id'
+_WALLET_ACCOUNT = 'SELECT account_id FROM user_wallet WHERE id = :{name}'
+
+# Single statement transfer: both wallets are locked in the id order first to avoid
+# deadlocks, source wallet is debited only if it has enough funds apart from the held
+# ones, target is credited only after a successful debit and both legs are recorded as
+# committed or rejected accordingly under one journal entry. Sources without a wallet
+# are not guarded. Hot target wallets are neither locked nor credited, one of their
+# shards is credited instead. Transfers between the wallets of different assets and
+# amounts finer than the asset precision or out of its limits are not recorded at all.
+# Amounts are units.
+_TRANSFER = """
+    WITH source AS ({source}), target AS ({target}),
+    assets AS (
+        SELECT count(DISTINCT w.asset) > 1 AS mixed, coalesce(bool_and(:amount % {step} = 0), true) AS precise,
+            coalesce(bool_and(:amount BETWEEN a.min_amount AND a.max_amount), true) AS bounded
+        FROM user_wallet w
+        JOIN asset a ON a.code = w.asset
+        WHERE w.account_id IN (SELECT account_id FROM source UNION ALL SELECT account_id FROM target)
+    ),
+    valid AS (
+        SELECT NOT mixed AND precise AND bounded AS value FROM assets
+    ),
+    locked AS (
+        SELECT id FROM user_wallet
+        WHERE account_id = (SELECT account_id FROM source)
+            OR (account_id = (SELECT account_id FROM target) AND shards = 0)
+        ORDER BY id
+        FOR UPDATE
+    ),
+    debit AS (
+        UPDATE user_wallet SET balance = balance - :amount, date_updated = {now}
+        WHERE account_id = (SELECT account_id FROM source) AND balance - held + {shard_balance} >= :amount
+            AND EXISTS (SELECT 1 FROM target) AND (SELECT value FROM valid) AND (SELECT count(*) FROM locked) > 0
+        RETURNING account_id
+    ),
+    allowed AS (
+        SELECT (EXISTS (SELECT 1 FROM debit) OR NOT :guarded) AND (SELECT value FROM valid) AS value
+    ),
+    credit AS (
+        UPDATE user_wallet SET balance = balance + :amount, date_updated = {now}
+        WHERE account_id = (SELECT account_id FROM target) AND shards = 0 AND (SELECT value FROM allowed)
+            AND (SELECT count(*) FROM locked) > 0
+        RETURNING account_id
+    ),
+    credit_shard AS (
+        UPDATE wallet_shard SET balance = wallet_shard.balance + :amount
+        FROM user_wallet w
+        WHERE w.account_id = (SELECT account_id FROM target) AND w.shards > 0
+            AND wallet_shard.wallet_id = w.id AND wallet_shard.shard = :slot % w.shards
+            AND (SELECT value FROM allowed)
+        RETURNING wallet_shard.wallet_id
+    ),
+    entry AS (
+        INSERT INTO journal_entry (id, kind, status, date_created)
+        SELECT :entry_id, CAST(:target_kind AS transactiontype),
+            CAST(CASE WHEN allowed.value THEN :committed ELSE :rejected END AS transactionstatus),
+            {now}
+        FROM allowed
+        WHERE EXISTS (SELECT 1 FROM source) AND EXISTS (SELECT 1 FROM target) AND (SELECT value FROM valid)
+        RETURNING id
+    ),
+    legs AS (
+        INSERT INTO transaction (id, account_id, entry_id, amount, kind, status, date_created)
+        SELECT leg.id, leg.account_id, entry.id, leg.amount, CAST(leg.kind AS transactiontype),
+            CAST(CASE WHEN allowed.value THEN :committed ELSE :rejected END AS transactionstatus),
+            {now}
+        FROM allowed, entry, (VALUES
+            (CAST(:source_tx AS uuid), (SELECT account_id FROM source), -CAST(:amount AS bigint), :source_kind),
+            (CAST(:target_tx AS uuid), (SELECT account_id FROM target), CAST(:amount AS bigint), :target_kind)
+        ) AS leg (id, account_id, amount, kind)
+        WHERE EXISTS (SELECT 1 FROM source) AND EXISTS (SELECT 1 FROM target)
+        RETURNING status
+    )
+    SELECT CASE
+        WHEN (SELECT mixed FROM assets) THEN '{mismatch}'
+        WHEN NOT (SELECT precise FROM assets) THEN '{imprecise}'
+        WHEN NOT (SELECT bounded FROM assets) THEN '{unbounded}'
+        ELSE (SELECT CAST(status AS text) FROM legs LIMIT 1)
+    END
+"""
+
+# Outcomes of the transfers rejected before the legs are recorded
+_MISMATCH = 'MISMATCH'
+_IMPRECISE = 'IMPRECISE'
+_UNBOUNDED = 'UNBOUNDED'
+_ASSET_ERRORS = {
+    _MISMATCH: AssetWrongException,
+    _IMPRECISE: AmountPrecisionException,
+    _UNBOUNDED: AmountLimitException,
+}
+
+
+def _amount_error(amount: Decimal, precision: int, min_amount: Decimal,
+                  max_amount: Decimal) -> Optional[JATIException]:
+    if round(amount, precision) != amount:
+        return AmountPrecisionException()
+    if not min_amount <= amount <= max_amount:
+        return AmountLimitException()
+    return None
+
+
+# Prepared variants by (source given by wallet id, target given by wallet id)
+_TRANSFERS = {
+    (source_wallet, target_wallet): statements.register(
+        f'transfer_{"wallet" if source_wallet else "account"}_{"wallet" if target_wallet else "account"}',
+        _TRANSFER.format(
+            source=(_WALLET_ACCOUNT if source_wallet else _ACCOUNT).format(name='source'),
+            target=(_WALLET_ACCOUNT if target_wallet else _ACCOUNT).format(name='target'),
+            shard_balance=SHARD_BALANCE.format(wallet='user_wallet'),
+            step=ASSET_STEP.format(asset='a'),
+            mismatch=_MISMATCH,
+            imprecise=_IMPRECISE,
+            unbounded=_UNBOUNDED,
+            now=UTC_NOW,
+        ),
+    )
+    for source_wallet, target_wallet in itertools.product((True, False), repeat=2)
+}
+
+
+def _transfer_party(party: Union[Wallet, UserBankAccount, UUID]) -> Tuple[bool, UUID]:
+    if isinstance(party, UUID):
+        return True, party
+    return False, party.account_id
+
+
+@retry_on_conflict
+async def _transfer_money(source: Union[Wallet, UserBankAccount, UUID],
+                          target: Union[Wallet, UserBankAccount, UUID],
                           amount: Decimal,
                           income_type: TransactionType = TransactionType.TRANSFER,
                           outcome_type: TransactionType = TransactionType.SEND) -> None:
-    connection = await db.acquire()
-    async with connection.transaction():
-        # Use raw query to avoid Gino insert enum issue
-        tx1, tx2 = uuid4(), uuid4()
-        values = "('{id}', '{account_id}', {amount}, '{kind}', '{status}', '{date_created}')"
-        rows = ', '.join((
-            values.format(id=tx1,
-                          account_id=source.account_id,
-                          kind=income_type.name,
-                          amount=-amount,
-                          status=TransactionStatus.NEW.name,
-                          date_created=datetime.now()),
-            values.format(id=tx2,
-                          account_id=target.account_id,
-                          kind=outcome_type.name,
-                          amount=amount,
-                          status=TransactionStatus.NEW.name,
-                          date_created=datetime.now()),
-        ))
-        await connection.status('INSERT INTO transaction (id, account_id, amount, kind, status, date_created) '
-                                f'VALUES {rows}')
+    """
+    Transfer money between accounts within a single statement.
 
-    try:
-        async with connection.transaction():
-            await Transaction.bulk_commit(tx1, tx2)
-            await source.commit()
-            await target.commit()
+    Wallets can be passed by id to resolve them within the same statement.
+    Rejected transfer legs are stored before the exception is raised.
 
-    except NotEnoughFundsException as e:
-        await Transaction.bulk_reject(tx1, tx2)
-        raise e
+    :param source: source wallet, wallet id or bank account
+    :param target: target wallet, wallet id or bank account
+    :param amount: money amount
+    :param income_type: source leg type
+    :param outcome_type: target leg type
+    :return: None
+    """
+    source_wallet, source_id = _transfer_party(source)
+    target_wallet, target_id = _transfer_party(target)
+    source_tx, target_tx = uuid7(), uuid7()
+    async with db.transaction():
+        status = await _TRANSFERS[source_wallet, target_wallet].scalar(
+            source=source_id,
+            target=target_id,
+            guarded=not isinstance(source, UserBankAccount),
+            amount=to_units(amount),
+            entry_id=uuid7(),
+            source_tx=source_tx,
+            target_tx=target_tx,
+            slot=target_tx.int % 2 ** 31,
+            source_kind=income_type.name,
+            target_kind=outcome_type.name,
+            committed=TransactionStatus.COMMITTED.name,
+            rejected=TransactionStatus.REJECTED.name,
+        )
+        if settings.BALANCE_RECALCULATE and status == TransactionStatus.COMMITTED.name:
+            for party in (source, target):
+                wallet = await Wallet.get(party) if isinstance(party, UUID) else party
+                await wallet.commit()
 
-    except Exception as e:
-        await Transaction.bulk_error(tx1, tx2)
-        raise e
+    if status == TransactionStatus.COMMITTED.name:
+        await invalidate_wallets(source, target)
+    if status is None:
+        raise WalletDoesNotExists()
+    if status in _ASSET_ERRORS:
+        raise _ASSET_ERRORS[status]()
+    if status != TransactionStatus.COMMITTED.name:
+        raise NotEnoughFundsException()
 
 
 async def create_deposit(wallet_id: UUID, bank_account_id: UUID, amount: Decimal) -> None:
@@ -154,11 +429,616 @@ async def create_send(wallet_id: UUID, target_wallet_id: UUID, amount: Decimal)
     :param amount: money amount
     :return: None
     """
-    wallets = await Wallet.query.where(Wallet.id.in_((wallet_id, target_wallet_id))).gino.all()
+    await _transfer_money(source=wallet_id,
+                          target=target_wallet_id,
+                          amount=amount)
+
+
+# Hold reserves the source wallet funds and records both legs as pending under the
+# journal entry with the hold id, only the source wallet row is locked. Rejected
+# holds are not recorded, neither are the amounts out of the asset limits. Amount is units.
+_HOLD = statements.register('hold', f"""
+    WITH target AS (
+        SELECT account_id FROM user_wallet WHERE id = :target
+    ),
+    assets AS (
+        SELECT count(DISTINCT w.asset) > 1 AS mixed,
+            coalesce(bool_and(:amount % {ASSET_STEP.format(asset='a')} = 0), true) AS precise,
+            coalesce(bool_and(:amount BETWEEN a.min_amount AND a.max_amount), true) AS bounded
+        FROM user_wallet w
+        JOIN asset a ON a.code = w.asset
+        WHERE w.id IN (:source, :target)
+    ),
+    reserve AS (
+        UPDATE user_wallet SET held = held + :amount, date_updated = {UTC_NOW}
+        WHERE id = :source AND balance - held + {SHARD_BALANCE.format(wallet='user_wallet')} >= :amount
+            AND EXISTS (SELECT 1 FROM target) AND (SELECT NOT mixed AND precise AND bounded FROM assets)
+        RETURNING account_id
+    ),
+    entry AS (
+        INSERT INTO journal_entry (id, kind, status, date_created)
+        SELECT :source_tx, CAST(:target_kind AS transactiontype), CAST(:status AS transactionstatus), {UTC_NOW}
+        WHERE EXISTS (SELECT 1 FROM reserve)
+        RETURNING id
+    ),
+    legs AS (
+        INSERT INTO transaction (id, account_id, entry_id, amount, kind, status, date_created)
+        SELECT leg.id, leg.account_id, entry.id, leg.amount, CAST(leg.kind AS transactiontype),
+            CAST(:status AS transactionstatus), {UTC_NOW}
+        FROM entry, (VALUES
+            (CAST(:source_tx AS uuid), (SELECT account_id FROM reserve), -CAST(:amount AS bigint), :source_kind),
+            (CAST(:target_tx AS uuid), (SELECT account_id FROM target), CAST(:amount AS bigint), :target_kind)
+        ) AS leg (id, account_id, amount, kind)
+        WHERE EXISTS (SELECT 1 FROM reserve)
+        RETURNING id
+    )
+    SELECT (SELECT count(*) FROM user_wallet WHERE id IN (:source, :target)), (SELECT mixed FROM assets),
+        (SELECT precise FROM assets), (SELECT bounded FROM assets), (SELECT count(*) FROM legs)
+""")
+
+
+def id_for_key(idempotency_key: Optional[str], namespace: UUID) -> UUID:
+    """
+    Id of the hold or operation created by the request.
+
+    Requests repeated with the same idempotency key get the same id.
+
+    :param idempotency_key: request idempotency key
+    :param namespace: namespace of the ids
+    :return: id
+    """
+    if idempotency_key is None:
+        return uuid7()
+    return uuid5(namespace, f'key:{idempotency_key}')
+
+
+async def create_hold(wallet_id: UUID, target_wallet_id: UUID, amount: Decimal, hold_id: UUID) -> None:
+    """
+    Reserve wallet funds for the transfer captured or voided later.
+
+    :param wallet_id: source wallet id
+    :param target_wallet_id: target wallet id
+    :param amount: money amount
+    :param hold_id: hold id
+    :return: None
+    """
+    wallets, mixed, precise, bounded, legs = (await _HOLD.all(
+        source=wallet_id,
+        target=target_wallet_id,
+        amount=to_units(amount),
+        source_tx=hold_id,
+        target_tx=hold_target_id(hold_id),
+        source_kind=TransactionType.TRANSFER.name,
+        target_kind=TransactionType.SEND.name,
+        status=TransactionStatus.HOLD.name,
+    ))[0]
+    if wallets < 2:
+        raise WalletDoesNotExists()
+    if mixed:
+        raise AssetWrongException()
+    if not precise:
+        raise AmountPrecisionException()
+    if not bounded:
+        raise AmountLimitException()
+    if not legs:
+        raise NotEnoughFundsException()
+    await invalidate_wallets(wallet_id)
+
+
+@retry_on_conflict
+async def _release_hold(wallet_id: UUID, hold_id: UUID, status: TransactionStatus) -> None:
+    wallet_ids = await Transaction.release_holds(
+        [hold_id],
+        status,
+        date_from=datetime.utcnow() - timedelta(seconds=settings.HOLD_TTL),
+        wallet_id=wallet_id,
+    )
+    if not wallet_ids:
+        raise HoldDoesNotExists()
+    await invalidate_wallets(*wallet_ids)
+
+
+async def capture_hold(wallet_id: UUID, hold_id: UUID) -> None:
+    """
+    Transfer the held funds to the target wallet.
+
+    :param wallet_id: source wallet id
+    :param hold_id: hold id
+    :return: None
+    """
+    await _release_hold(wallet_id, hold_id, TransactionStatus.COMMITTED)
+
+
+async def void_hold(wallet_id: UUID, hold_id: UUID) -> None:
+    """
+    Return the held funds to the source wallet.
+
+    :param wallet_id: source wallet id
+    :param hold_id: hold id
+    :return: None
+    """
+    await _release_hold(wallet_id, hold_id, TransactionStatus.CANCELLED)
+
+
+async def expire_holds(ttl: float, batch_size: int) -> int:
+    """
+    Void the holds older than the time to live in batches.
+
+    Holds locked by the concurrent capture or void are skipped.
+
+    :param ttl: hold time to live in seconds
+    :param batch_size: holds released within one statement
+    :return: number of expired holds
+    """
+    expired = datetime.utcnow() - timedelta(seconds=ttl)
+    count = 0
+    while True:
+        async with db.transaction():
+            holds = await db.all(
+                db.select(
+                    [Transaction.id, Transaction.date_created],
+                ).where(
+                    Transaction.status == TransactionStatus.HOLD,
+                ).where(
+                    Transaction.amount < 0,
+                ).where(
+                    Transaction.date_created < expired,
+                ).order_by(Transaction.seq).limit(batch_size).with_for_update(skip_locked=True),
+            )
+            wallet_ids = []
+            if holds:
+                wallet_ids = await Transaction.release_holds(
+                    [hold_id for hold_id, _ in holds],
+                    TransactionStatus.CANCELLED,
+                    date_from=min(date_created for _, date_created in holds),
+                )
+        await invalidate_wallets(*wallet_ids)
+        count += len(holds)
+        if len(holds) < batch_size:
+            return count
+
+
+# Journal and ledger columns filled by the bulk loads, seq and creation dates are assigned by the database
+_JOURNAL_COLUMNS = ('id', 'kind', 'status')
+_LEDGER_COLUMNS = ('id', 'account_id', 'entry_id', 'amount', 'kind', 'status')
+
+_APPLY_DELTAS = f"""
+    UPDATE user_wallet SET balance = user_wallet.balance + delta.amount, date_updated = {UTC_NOW}
+    FROM unnest(CAST(:ids AS uuid[]), CAST(:amounts AS bigint[])) AS delta (id, amount)
+    WHERE user_wallet.id = delta.id
+"""
+
+
+def _one_of(column: Column, values: Sequence[Any]) -> ColumnElement:
+    # one array parameter, asyncpg takes at most 32767 query arguments
+    return column == any_(db.cast(list(values), ARRAY(column.type)))
+
+
+@retry_on_conflict
+async def create_send_batch(transfers: Sequence[Tuple[UUID, UUID, Decimal]]) -> List[Optional[JATIException]]:
+    """
+    Send money between multiple wallets at once.
+
+    All the involved wallets are locked once in the id order, transfers are
+    applied in the given order against the available funds, journal entries
+    and ledger legs are loaded with a COPY each and the net balance deltas are
+    applied with a single update. Wallets of the transfer must hold the same
+    asset, amounts must fit its precision and limits.
+
+    :param transfers: (source wallet id, target wallet id, amount) tuples
+    :return: per transfer error, None if transfer is committed
+    """
+    wallet_ids = sorted({wallet_id for transfer in transfers for wallet_id in transfer[:2]})
+    results: List[Optional[JATIException]] = []
+    entries, legs = [], []
+
+    async with db.transaction() as tx:
+        wallets = await db.all(
+            db.select(
+                [Wallet.id, Wallet.account_id, Wallet.available_funds(), Wallet.asset,
+                 Asset.precision, Asset.min_amount, Asset.max_amount],
+            ).select_from(
+                Wallet.join(Asset, Wallet.asset == Asset.code),
+            ).where(
+                _one_of(Wallet.id, wallet_ids),
+            ).order_by(Wallet.id).with_for_update(of=Wallet),
+        )
+        accounts = {wallet_id: account_id for wallet_id, account_id, *_ in wallets}
+        balances: Dict[UUID, Decimal] = {wallet_id: balance for wallet_id, _, balance, *_ in wallets}
+        assets = {wallet_id: asset for wallet_id, _, _, *asset in wallets}
+        deltas: Dict[UUID, Decimal] = {}
+
+        for source, target, amount in transfers:
+            if source == target:
+                results.append(WalletWrongException())
+                continue
+            if source not in accounts or target not in accounts:
+                results.append(WalletDoesNotExists())
+                continue
+            if assets[source][0] != assets[target][0]:
+                results.append(AssetWrongException())
+                continue
+            error = _amount_error(amount, *assets[source][1:])
+            if error is not None:
+                results.append(error)
+                continue
+
+            status = TransactionStatus.REJECTED
+            if balances[source] >= amount:
+                status = TransactionStatus.COMMITTED
+                for wallet_id, delta in ((source, -amount), (target, amount)):
+                    balances[wallet_id] += delta
+                    deltas[wallet_id] = deltas.get(wallet_id, 0) + delta
+            results.append(None if status == TransactionStatus.COMMITTED else NotEnoughFundsException())
+            entries.append((uuid7(), TransactionType.SEND.name, status.name))
+            entry_id = entries[-1][0]
+            units = to_units(amount)
+            legs.append((uuid7(), accounts[source], entry_id, -units, TransactionType.TRANSFER.name, status.name))
+            legs.append((uuid7(), accounts[target], entry_id, units, TransactionType.SEND.name, status.name))
+
+        if legs:
+            connection = tx.connection.raw_connection
+            await connection.copy_records_to_table(
+                JournalEntry.__tablename__,
+                records=entries,
+                columns=_JOURNAL_COLUMNS,
+            )
+            await connection.copy_records_to_table(
+                Transaction.__tablename__,
+                records=legs,
+                columns=_LEDGER_COLUMNS,
+            )
+        if deltas:
+            await db.status(db.text(_APPLY_DELTAS),
+                            ids=list(deltas),
+                            amounts=[to_units(delta) for delta in deltas.values()])
+    await invalidate_wallets(*deltas)
+    return results
+
+
+# Namespace of the ledger leg ids derived from the bank statement references
+DEPOSIT_NAMESPACE = UUID('6c0e3b9e-5a5c-4d0c-9a43-1f7c1b0d8a52')
+
+
+@retry_on_conflict
+async def create_deposit_batch(deposits: Sequence[Tuple[str, UUID, UUID, Decimal]],
+                               ) -> List[Optional[JATIException]]:
+    """
+    Make multiple wire transfer deposits at once.
+
+    Ledger leg ids are derived from the bank statement references, so the
+    deposits which are already in the ledger are skipped. Wallets and bank
+    accounts are resolved with one query each, missing bank accounts are
+    created, journal entries and legs are loaded with a COPY each and the
+    wallet balances are updated with a single statement.
+
+    :param deposits: (reference, wallet id, bank account id, amount) tuples
+    :return: per deposit error, None if deposit is committed
+    """
+    legs = {
+        reference: (uuid5(DEPOSIT_NAMESPACE, f'{reference}:source'), uuid5(DEPOSIT_NAMESPACE, f'{reference}:target'))
+        for reference, *_ in deposits
+    }
+    wallet_ids = sorted({wallet_id for _, wallet_id, _, _ in deposits})
+    bank_account_ids = list({bank_account_id for _, _, bank_account_id, _ in deposits})
+    results: List[Optional[JATIException]] = []
+    accounts, bank_accounts, entries, records = [], [], [], []
+
+    async with db.transaction() as tx:
+        wallets = {
+            wallet_id: (account_id, user_id, limits)
+            for wallet_id, account_id, user_id, *limits in await db.all(
+                db.select(
+                    [Wallet.id, Wallet.account_id, Account.user_id,
+                     Asset.precision, Asset.min_amount, Asset.max_amount],
+                ).select_from(
+                    Wallet.join(Account, Wallet.account_id == Account.id).join(Asset, Wallet.asset == Asset.code),
+                ).where(
+                    _one_of(Wallet.id, wallet_ids),
+                ).order_by(Wallet.id).with_for_update(of=Wallet),
+            )
+        }
+        # ledger ids are unique per partition only, wallet locks serialize the imports of the same deposit
+        processed = {
+            transaction_id for transaction_id, in await db.all(
+                db.select([Transaction.id]).where(
+                    _one_of(Transaction.id, [source_tx for source_tx, _ in legs.values()]),
+                ),
+            )
+        }
+        owners = {
+            bank_account_id: (account_id, user_id)
+            for bank_account_id, account_id, user_id in await db.all(
+                db.select(
+                    [UserBankAccount.id, UserBankAccount.account_id, Account.user_id],
+                ).select_from(
+                    UserBankAccount.join(Account, UserBankAccount.account_id == Account.id),
+                ).where(
+                    _one_of(UserBankAccount.id, bank_account_ids),
+                ),
+            )
+        }
+        deltas: Dict[UUID, Decimal] = {}
+
+        for reference, wallet_id, bank_account_id, amount in deposits:
+            source_tx, target_tx = legs[reference]
+            if source_tx in processed:
+                results.append(DepositExists())
+                continue
+            if wallet_id not in wallets:
+                results.append(WalletDoesNotExists())
+                continue
+            account_id, user_id, limits = wallets[wallet_id]
+            error = _amount_error(amount, *limits)
+            if error is not None:
+                results.append(error)
+                continue
+            if bank_account_id not in owners:
+                # create new account automatically if not exist like create_deposit does
+                owners[bank_account_id] = (uuid7(), user_id)
+                accounts.append((owners[bank_account_id][0], user_id))
+                bank_accounts.append((bank_account_id, owners[bank_account_id][0]))
+            bank_account_account_id, owner_id = owners[bank_account_id]
+            if owner_id != user_id:
+                results.append(BankAccountDoesNotExists())
+                continue
+
+            processed.add(source_tx)
+            deltas[wallet_id] = deltas.get(wallet_id, 0) + amount
+            kind, status = TransactionType.DEPOSIT.name, TransactionStatus.COMMITTED.name
+            entries.append((uuid7(), kind, status))
+            entry_id = entries[-1][0]
+            records.append((source_tx, bank_account_account_id, entry_id, -to_units(amount), kind, status))
+            records.append((target_tx, account_id, entry_id, to_units(amount), kind, status))
+            results.append(None)
+
+        connection = tx.connection.raw_connection
+        if accounts:
+            await connection.copy_records_to_table(
+                Account.__tablename__,
+                records=accounts,
+                columns=('id', 'user_id'),
+            )
+            await connection.copy_records_to_table(
+                UserBankAccount.__tablename__,
+                records=bank_accounts,
+                columns=('id', 'account_id'),
+            )
+        if records:
+            await connection.copy_records_to_table(
+                JournalEntry.__tablename__,
+                records=entries,
+                columns=_JOURNAL_COLUMNS,
+            )
+            await connection.copy_records_to_table(
+                Transaction.__tablename__,
+                records=records,
+                columns=_LEDGER_COLUMNS,
+            )
+        if deltas:
+            await db.status(db.text(_APPLY_DELTAS),
+                            ids=list(deltas),
+                            amounts=[to_units(delta) for delta in deltas.values()])
+    await invalidate_wallets(*deltas)
+    return results
+
+
+# Namespace of the queued operation ids derived from the idempotency keys
+OPERATION_NAMESPACE = UUID('9a1d5f37-3e2c-4b8e-8f60-c4b7e2a9d015')
+
+
+async def enqueue_transfer(operation_id: UUID, kind: TransactionType, wallet_id: UUID, amount: Decimal,
+                           target_wallet_id: Optional[UUID] = None, bank_account_id: Optional[UUID] = None) -> None:
+    """
+    Queue the send or deposit to be applied by the transfer workers.
+
+    :param operation_id: operation id
+    :param kind: send or deposit
+    :param wallet_id: source wallet of the send, target wallet of the deposit
+    :param amount: money amount
+    :param target_wallet_id: target wallet of the send
+    :param bank_account_id: source bank account of the deposit
+    :return: None
+    """
+    await TransferOperation.create(
+        id=operation_id,
+        kind=kind,
+        wallet_id=wallet_id,
+        target_wallet_id=target_wallet_id,
+        bank_account_id=bank_account_id,
+        amount=amount,
+    )
+
+
+async def process_transfers(batch_size: int) -> int:
+    """
+    Apply a batch of the queued transfers.
+
+    Operations are taken in the queue order and skipped if locked by another
+    worker. Every wallet of the batch is locked once in the id order, then
+    the deposits of the batch are applied before the sends, each group by
+    the batch helper applying the net deltas. Outcomes are stored within the
+    same database transaction.
+
+    :param batch_size: maximal number of operations
+    :return: number of processed operations
+    """
+    async with db.transaction():
+        operations = await TransferOperation.dequeue(batch_size)
+        wallet_ids = {
+            wallet_id
+            for operation in operations
+            for wallet_id in (operation.wallet_id, operation.target_wallet_id) if wallet_id is not None
+        }
+        # deposits and sends lock their wallets again, the locks are held already
+        if wallet_ids:
+            await db.all(
+                db.select([Wallet.id]).where(
+                    _one_of(Wallet.id, sorted(wallet_ids)),
+                ).order_by(Wallet.id).with_for_update(),
+            )
+        deposits = [operation for operation in operations if operation.kind == TransactionType.DEPOSIT]
+        sends = [operation for operation in operations if operation.kind != TransactionType.DEPOSIT]
+        errors: List[Optional[JATIException]] = []
+        if deposits:
+            errors += await create_deposit_batch([
+                (str(operation.id), operation.wallet_id, operation.bank_account_id, operation.amount)
+                for operation in deposits
+            ])
+        if sends:
+            errors += await create_send_batch([
+                (operation.wallet_id, operation.target_wallet_id, operation.amount) for operation in sends
+            ])
+        if operations:
+            await TransferOperation.complete([
+                (operation.id, 201, None) if error is None else (operation.id, error.status_code, error.detail)
+                for operation, error in zip(deposits + sends, errors)
+            ])
+    # balances are visible to the readers only after the commit
+    await invalidate_wallets(*wallet_ids)
+    return len(operations)
+
+
+def encode_cursor(date_created: datetime, transaction_id: UUID) -> str:
+    """
+    Build history cursor pointing right after the given transaction.
+
+    :param date_created: creation date of the last transaction of the page
+    :param transaction_id: id of the last transaction of the page
+    :return: opaque cursor
+    """
+    key = f'{date_created.isoformat()},{transaction_id}'
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """
+    Parse history cursor.
+
+    :param cursor: opaque cursor
+    :return: (date_created, id) of the last seen transaction
+    """
     try:
-        source_wallet, target_wallet = sorted(wallets, key=lambda wallet: wallet.id != wallet_id)
-        await _transfer_money(source=source_wallet,
-                              target=target_wallet,
-                              amount=amount)
+        date_created, transaction_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(',')
+        return datetime.fromisoformat(date_created), UUID(transaction_id)
     except ValueError:
-        raise WalletDoesNotExists()
+        raise CursorWrongException()
+
+
+def history_query(wallet_id: UUID, filters: HistoryFilterType, after: Optional[str] = None) -> Select:
+    """
+    Build wallet transactions query ordered from the newest.
+
+    Keyset pagination over (date_created, id) follows the transaction account index,
+    cursor date is repeated as a plain bound so ledger partitions are pruned.
+    Transaction ids are time ordered, so the transactions of the same date
+    come in the creation order. Counterparty is the account of the other leg
+    of the journal entry, it is looked up in the partition of the transaction.
+
+    :param wallet_id: wallet id
+    :param filters: history filters
+    :param after: cursor of the previous page
+    :return: query
+    """
+    account_id = db.select([Wallet.account_id]).where(Wallet.id == wallet_id).as_scalar()
+    other = Transaction.__table__.alias('other')
+    counterparty = db.select([other.c.account_id]).where(
+        other.c.entry_id == Transaction.entry_id,
+    ).where(
+        other.c.date_created == Transaction.date_created,
+    ).where(
+        other.c.account_id != Transaction.account_id,
+    ).limit(1).as_scalar()
+    query = db.select([
+        *Transaction.__table__.columns,
+        counterparty.label('counterparty_account_id'),
+    ]).where(Transaction.account_id == account_id)
+    if filters.kind is not None:
+        query = query.where(Transaction.kind == filters.kind)
+    if filters.status is not None:
+        query = query.where(Transaction.status == filters.status)
+    if filters.date_from is not None:
+        query = query.where(Transaction.date_created >= filters.date_from)
+    if filters.date_to is not None:
+        query = query.where(Transaction.date_created < filters.date_to)
+    if after is not None:
+        date_created, transaction_id = decode_cursor(after)
+        query = query.where(Transaction.date_created <= date_created).where(operator.lt(
+            db.tuple_(Transaction.date_created, Transaction.id),
+            db.tuple_(date_created, transaction_id),
+        ))
+    return query.order_by(Transaction.date_created.desc(), Transaction.id.desc())
+
+
+async def history_page(bind: Any, wallet_id: UUID, filters: HistoryFilterType, limit: int,
+                       after: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """
+    Read one page of wallet transactions from the ledger and its archive.
+
+    Archive files are read only if the page goes past the oldest
+    transaction still kept in the database, and only those of the months
+    between the wallet creation and the cursor.
+
+    :param bind: database to read the ledger from
+    :param wallet_id: wallet id
+    :param filters: history filters
+    :param limit: page size
+    :param after: cursor of the previous page
+    :return: transactions ordered from the newest and the next page cursor
+    """
+    transactions = [
+        dict(transaction)
+        for transaction in await bind.all(history_query(wallet_id, filters, after).limit(limit + 1))
+    ]
+    before = decode_cursor(after) if after is not None else None
+    newer_than = transactions[-1]['date_created'] if len(transactions) > limit else None
+    older_than = before[0] if before is not None else None
+    wallet = None
+    if archives(newer_than=newer_than, older_than=older_than):
+        wallet = await bind.first(db.select([Wallet.account_id, Wallet.date_created]).where(Wallet.id == wallet_id))
+    if wallet is not None:
+        # ledger dates may precede the wallet creation date by the insert skew
+        date_created = wallet.date_created - timedelta(seconds=settings.LEDGER_DATE_SKEW)
+        paths = archives(newer_than=max(newer_than or date_created, date_created), older_than=older_than)
+        archived = await asyncio.get_event_loop().run_in_executor(None, functools.partial(
+            read_history, paths, wallet.account_id, filters, before, limit + 1,
+        )) if paths else []
+        transactions = sorted(
+            transactions + archived,
+            key=lambda transaction: (transaction['date_created'], transaction['id']),
+            reverse=True,
+        )[:limit + 1]
+    if len(transactions) <= limit:
+        return transactions, None
+    transactions = transactions[:limit]
+    return transactions, encode_cursor(transactions[-1]['date_created'], transactions[-1]['id'])
+
+
+async def export_history(query: Select, export_format: ExportFormat) -> AsyncIterator[str]:
+    """
+    Stream query results read from a server side cursor.
+
+    :param query: history query
+    :param export_format: output format
+    :return: chunks of serialized transactions
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == ExportFormat.CSV:
+        writer.writerow(TransactionSchema.__fields__)
+
+    async with db.transaction():
+        count = 0
+        async for transaction in query.gino.iterate():
+            row = TransactionSchema(**transaction)
+            if export_format == ExportFormat.CSV:
+                writer.writerow(getattr(value, 'value', value) for value in row.dict().values())
+            else:
+                buffer.write(row.json())
+                buffer.write('\n')
+            count += 1
+            if count % settings.HISTORY_EXPORT_CHUNK_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,111 @@
+"""Idempotent requests handling."""
+
+import hashlib
+from datetime import datetime
+from typing import (
+    Awaitable,
+    Callable,
+    Optional,
+    Tuple,
+)
+
+from fastapi import HTTPException
+from sqlalchemy.dialects.postgresql import insert
+
+from .cache import LRUCache
+from .conf import settings
+from .exceptions import (
+    IdempotencyKeyReused,
+    JATIException,
+)
+from .helpers import deferred_invalidation
+from .models import (
+    IdempotencyKey,
+    db,
+)
+
+# key -> (fingerprint, status code, detail), hot retries are answered without database
+_outcomes = LRUCache(max_size=settings.IDEMPOTENCY_CACHE_SIZE, ttl=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def fingerprint(*parts: str) -> str:
+    """
+    Hash the request to detect the idempotency key reuse.
+
+    :param parts: request method, path, payload, etc
+    :return: request hash
+    """
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+
+def _replay(request_hash: str, outcome: Tuple[str, int, Optional[str]]) -> None:
+    stored_hash, status_code, detail = outcome
+    if stored_hash != request_hash:
+        raise IdempotencyKeyReused()
+    if status_code >= 400:
+        raise HTTPException(status_code=status_code, detail=detail)
+
+
+async def _load(key: str) -> Optional[Tuple[str, int, Optional[str]]]:
+    stored = await IdempotencyKey.get(key)
+    if stored is None:
+        return None
+    outcome = stored.fingerprint, stored.status_code, stored.detail
+    age = (datetime.utcnow() - stored.date_created).total_seconds()
+    _outcomes.set(key, outcome, ttl=max(settings.IDEMPOTENCY_KEY_TTL - age, 0))
+    return outcome
+
+
+async def idempotent(key: Optional[str], request_hash: str, operation: Callable[[], Awaitable[None]],
+                     status_code: int = 201) -> None:
+    """
+    Perform the operation once per idempotency key.
+
+    The outcome is stored within the operation database transaction, so it is
+    stored only if operation changes are committed. Repeated requests get the
+    stored outcome: nothing for success or the same error. Cached wallets are
+    dropped after the commit.
+
+    :param key: idempotency key, operation is just performed if it is missing
+    :param request_hash: request fingerprint
+    :param operation: operation coroutine function
+    :param status_code: success status code
+    :return: None
+    """
+    if key is None:
+        await operation()
+        return
+
+    outcome = _outcomes.get(key) or await _load(key)
+    if outcome is not None:
+        _replay(request_hash, outcome)
+        return
+
+    error: Optional[JATIException] = None
+    async with deferred_invalidation(), db.transaction() as tx:
+        try:
+            await operation()
+        except JATIException as e:
+            error = e
+        if error is None:
+            outcome = (request_hash, status_code, None)
+        else:
+            outcome = (request_hash, error.status_code, error.detail)
+        stored = await db.scalar(
+            insert(IdempotencyKey).values(
+                key=key,
+                fingerprint=outcome[0],
+                status_code=outcome[1],
+                detail=outcome[2],
+            ).on_conflict_do_nothing().returning(IdempotencyKey.key),
+        )
+        if stored is None:
+            # concurrent request with the same key won
+            tx.raise_rollback()
+
+    if stored is None:
+        _replay(request_hash, await _load(key))
+        return
+    _outcomes.set(key, outcome)
+    if error is not None:
+        raise error
@@ -0,0 +1,139 @@
+"""
+In-process metrics.
+
+Metrics are rendered in the Prometheus text exposition format.
+"""
+
+import bisect
+from collections import defaultdict
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+REGISTRY: List['_Metric'] = []
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], **extra: str) -> str:
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        REGISTRY.append(self)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return '\n'.join((
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+            *self.samples(),
+        ))
+
+
+class Counter(_Metric):
+    """Monotonically increasing value."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str) -> None:  # noqa: D107
+        super().__init__(name, documentation)
+        self.values: Dict[Tuple[Tuple[str, str], ...], float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Increase the counter.
+
+        :param amount: increment
+        :param labels: series labels
+        :return: None
+        """
+        self.values[tuple(sorted(labels.items()))] += amount
+
+    def samples(self) -> List[str]:  # noqa: D102
+        return [f'{self.name}{_format_labels(labels)} {value}' for labels, value in self.values.items()]
+
+
+class Gauge(Counter):
+    """Value which can go up and down or is read from the callback."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, func: Optional[Callable[[], float]] = None) -> None:  # noqa: D107
+        super().__init__(name, documentation)
+        self.func = func
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        """
+        Decrease the gauge.
+
+        :param amount: decrement
+        :param labels: series labels
+        :return: None
+        """
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[str]:  # noqa: D102
+        if self.func is None:
+            return super().samples()
+        value = self.func()
+        return [] if value is None else [f'{self.name} {value}']
+
+
+class Histogram(_Metric):
+    """Distribution of the observed values."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:  # noqa: D107
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+        self.series: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Record the observed value.
+
+        :param value: observed value
+        :param labels: series labels
+        :return: None
+        """
+        key = tuple(sorted(labels.items()))
+        series = self.series.setdefault(key, [0] * (len(self.buckets) + 2))
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> List[str]:  # noqa: D102
+        samples = []
+        for labels, series in self.series.items():
+            total = 0
+            for bucket, count in zip((*self.buckets, '+Inf'), series):
+                total += count
+                samples.append(f'{self.name}_bucket{_format_labels(labels, le=str(bucket))} {total}')
+            samples.append(f'{self.name}_count{_format_labels(labels)} {total}')
+            samples.append(f'{self.name}_sum{_format_labels(labels)} {series[-1]}')
+        return samples
+
+
+def render() -> str:
+    """
+    Render all the registered metrics.
+
+    :return: Prometheus text format
+    """
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
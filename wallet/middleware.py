@@ -0,0 +1,89 @@
+"""ASGI middlewares."""
+
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import (
+    ASGIApp,
+    Message,
+    Receive,
+    Scope,
+    Send,
+)
+
+from .conf import settings
+from .metrics import Histogram
+from .models import db
+from .pool import (
+    QueryStats,
+    query_stats,
+)
+
+REQUEST_DURATION = Histogram('http_request_seconds', 'Request processing time by endpoint.')
+REQUEST_DB_DURATION = Histogram('http_request_db_seconds', 'Database time of the request by endpoint.')
+REQUEST_STATEMENTS = Histogram('http_request_db_statements', 'Statements sent to the database by endpoint.',
+                               buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32, 64))
+
+
+class ConnectionMiddleware:
+    """
+    Share one lazily acquired database connection within the request.
+
+    Gino reuses the connection for every query and transaction made in the
+    request context, the connection is released when the response is sent.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:  # noqa: D107
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:  # noqa: D102
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        async with db.acquire(lazy=True, timeout=settings.DB_POOL_ACQUIRE_TIMEOUT):
+            await self.app(scope, receive, send)
+
+
+class TimingMiddleware:
+    """
+    Measure the request and its database usage.
+
+    Statements count, database time and pool wait are reported in the
+    ``Server-Timing`` response header and in the endpoint histograms.
+    Must wrap the connection middleware to see the pool wait.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:  # noqa: D107
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:  # noqa: D102
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        start = time.monotonic()
+        status_code = 500
+
+        async def send_timing(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                if settings.SERVER_TIMING:
+                    MutableHeaders(scope=message).append('Server-Timing', ', '.join((
+                        f'db;dur={stats.db_time * 1000:.2f};desc="{stats.statements} statements"',
+                        f'pool;dur={stats.pool_wait * 1000:.2f}',
+                        f'app;dur={(time.monotonic() - start) * 1000:.2f}',
+                    )))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timing)
+        finally:
+            query_stats.reset(token)
+            # endpoint is set by the router once the route is matched
+            endpoint = getattr(scope.get('endpoint'), '__name__', 'unmatched')
+            labels = {'endpoint': endpoint, 'method': scope['method'], 'status': str(status_code)}
+            REQUEST_DURATION.observe(time.monotonic() - start, **labels)
+            REQUEST_DB_DURATION.observe(stats.db_time, **labels)
+            REQUEST_STATEMENTS.observe(stats.statements, **labels)
@@ -1,23 +1,174 @@
 """Database models."""
 
+import asyncio
 import datetime
-import operator
+import functools
+import os
+import time
 import uuid
 from decimal import Decimal
-from typing import Tuple
+from typing import (
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
+from asyncpg import InvalidObjectDefinitionError
 from gino import Gino
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import (
+    UUID,
+    insert,
+)
+from sqlalchemy.sql import ColumnElement
 
 from wallet.conf import settings
 from wallet.enum import (
+    OperationStatus,
     TransactionStatus,
     TransactionType,
 )
 from wallet.exceptions import NotEnoughFundsException
+from wallet.statements import StatementRegistry
 
 db = Gino()
 
+# Hot path statements prepared on every pooled connection
+statements = StatementRegistry(db)
+
+# Current time set by the database, timestamps are stored in UTC without the
+# time zone like the ledger partition bounds
+UTC_NOW = "(now() at time zone 'utc')"
+
+# Amounts are stored as integer numbers of the smallest units of the most precise asset
+AMOUNT_SCALE = settings.ASSET_AMOUNT_PRECISION
+
+# the latest uuid7 timestamp and random bits generated by the process
+_uuid7_last = 0
+
+
+def uuid7() -> uuid.UUID:
+    """
+    Time ordered UUID version 7.
+
+    Ids start with the millisecond timestamp, so new rows are appended to
+    the right edge of the primary key index instead of random pages. Ids of
+    the same millisecond are ordered by incrementing the random bits, so ids
+    generated by the process are strictly increasing.
+
+    :return: id
+    """
+    global _uuid7_last
+    value = time.time_ns() // 1000000 << 74 | int.from_bytes(os.urandom(10), 'big') >> 6
+    if value <= _uuid7_last:
+        value = _uuid7_last + 1 + int.from_bytes(os.urandom(4), 'big')
+    _uuid7_last = value
+    return uuid.UUID(int=(
+        value >> 74 << 80 | 0x7 << 76 | (value >> 62 & 0xfff) << 64 | 0b10 << 62 | value & (1 << 62) - 1
+    ))
+
+
+def month_start(offset: int, date: Optional[datetime.date] = None) -> datetime.date:
+    """
+    First day of the month shifted from the given or current one.
+
+    :param offset: number of months to shift
+    :param date: any date of the base month, today if omitted
+    :return: date
+    """
+    date = date or datetime.datetime.utcnow().date()
+    year, month = divmod(date.year * 12 + date.month - 1 + offset, 12)
+    return datetime.date(year, month + 1, 1)
+
+
+def to_units(amount: Union[Decimal, int]) -> int:
+    """
+    Amount as the integer number of the smallest units.
+
+    :param amount: amount
+    :return: units
+    """
+    return int(Decimal(amount).scaleb(AMOUNT_SCALE).to_integral_value())
+
+
+def from_units(units: Optional[Union[Decimal, int]]) -> Optional[Decimal]:
+    """
+    Amount of the integer number of the smallest units.
+
+    Sums of the raw statements come as numeric, so both are accepted.
+
+    :param units: units
+    :return: amount
+    """
+    if units is None:
+        return None
+    return Decimal(units).scaleb(-AMOUNT_SCALE)
+
+
+class Amount(db.TypeDecorator):
+    """
+    Money amount stored as bigint number of the smallest units.
+
+    Integer arithmetic and sums are much cheaper than the numeric ones, model
+    attributes and bound values are still decimals. Arithmetic expressions of
+    the amount columns lose the type, so they are coerced back before being
+    compared with decimals. Raw statements take and return units.
+    """
+
+    impl = db.BigInteger
+
+    def process_bind_param(self, value: Optional[Union[Decimal, int]], dialect: object) -> Optional[int]:  # noqa: D102
+        return None if value is None else to_units(value)
+
+    def process_result_value(self, value: Optional[int], dialect: object) -> Optional[Decimal]:  # noqa: D102
+        return from_units(value)
+
+
+class Asset(db.Model):
+    """Currency or another asset held by the wallets."""
+
+    __tablename__ = 'asset'
+
+    code = db.Column(
+        db.String(16),
+        primary_key=True,
+        nullable=False,
+        doc='Currency code or ticker',
+    )
+    precision = db.Column(
+        db.SmallInteger,
+        nullable=False,
+        doc='Decimal places of the amounts, up to ASSET_AMOUNT_PRECISION',
+    )
+    min_amount = db.Column(
+        Amount,
+        nullable=False,
+        doc='Smallest amount of the transaction',
+    )
+    max_amount = db.Column(
+        Amount,
+        nullable=False,
+        doc='Largest amount of the transaction',
+    )
+    date_created = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.text(UTC_NOW),
+        doc='Creation date',
+    )
+
+
+# Assets seeded by the migrations
+ASSETS = (
+    {'code': 'USD', 'precision': 2, 'min_amount': Decimal('0.05'), 'max_amount': Decimal(10000)},
+    {'code': 'EUR', 'precision': 2, 'min_amount': Decimal('0.05'), 'max_amount': Decimal(10000)},
+    {'code': 'GBP', 'precision': 2, 'min_amount': Decimal('0.05'), 'max_amount': Decimal(10000)},
+    {'code': 'BTC', 'precision': 8, 'min_amount': Decimal('0.00001'), 'max_amount': Decimal(100)},
+)
+
+# Smallest amount of the asset row in units for the raw statements
+ASSET_STEP = f'CAST(10 ^ ({AMOUNT_SCALE} - {{asset}}.precision) AS bigint)'
+
 
 class Account(db.Model):
     """Abstract user account."""
@@ -27,7 +178,7 @@ class Account(db.Model):
     id = db.Column(  # noqa: A003
         UUID,
         primary_key=True,
-        default=uuid.uuid4,
+        default=uuid7,
         nullable=False,
         unique=True,
     )
@@ -40,34 +191,33 @@ class Account(db.Model):
     date_created = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.datetime.utcnow(),
+        server_default=db.text(UTC_NOW),
         doc='Creation date',
     )
     date_updated = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.datetime.utcnow(),
-        onupdate=datetime.datetime.utcnow,
+        server_default=db.text(UTC_NOW),
+        onupdate=db.text(UTC_NOW),
         doc='Update date',
     )
 
 
 class _WalletMixin:
-    async def get_transaction_amount(self) -> Decimal:
+    async def get_transaction_amount(self, full: bool = False) -> Decimal:
         """
         Transactions sum.
 
+        Only transactions after the latest balance checkpoint are summed up
+        unless the full ledger is requested. Checkpoint creation date bound
+        lets the database skip the older ledger partitions.
+
+        :param full: ignore balance checkpoints
         :return:
         """
-        cursor = db.select(
-            [db.func.sum(Transaction.amount).label('total')],
-        ).where(
-            operator.and_(
-                Transaction.account_id == self.account_id,
-                Transaction.status.in_(Transaction.SUCCESS_STATUSES),
-            ),
-        )
-        return await cursor.gino.scalar()
+        if full:
+            return from_units(await _TRANSACTION_AMOUNT_FULL.scalar(account_id=self.account_id))
+        return from_units(await _TRANSACTION_AMOUNT.scalar(account_id=self.account_id))
 
     @property
     def is_valid(self) -> bool:
@@ -94,7 +244,7 @@ class Wallet(_WalletMixin, db.Model):
     id = db.Column(  # noqa: A003
         UUID,
         primary_key=True,
-        default=uuid.uuid4,
+        default=uuid7,
         nullable=False,
         unique=True,
     )
@@ -103,23 +253,46 @@ class Wallet(_WalletMixin, db.Model):
         db.ForeignKey(f'{Account.__tablename__}.id'),
         nullable=False,
         doc='',
+        index=True,
+        unique=True,
+    )
+    asset = db.Column(
+        db.String(16),
+        db.ForeignKey(f'{Asset.__tablename__}.code'),
+        default=settings.ASSET_DEFAULT,
+        nullable=False,
+        doc='Asset of the balance, every wallet has its own ledger account',
     )
     balance = db.Column(
-        db.Numeric(settings.ASSET_AMOUNT_MAX_DIGITS, settings.ASSET_AMOUNT_PRECISION),
+        Amount,
+        default=0,
+        nullable=False,
+    )
+    held = db.Column(
+        Amount,
         default=0,
+        server_default=db.text('0'),
         nullable=False,
+        doc='Funds reserved by the pending holds',
+    )
+    shards = db.Column(
+        db.Integer,
+        default=0,
+        server_default=db.text('0'),
+        nullable=False,
+        doc='Number of the credit shards of the hot wallet',
     )
     date_created = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.datetime.utcnow(),
+        server_default=db.text(UTC_NOW),
         doc='Creation date',
     )
     date_updated = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.datetime.utcnow(),
-        onupdate=datetime.datetime.utcnow,
+        server_default=db.text(UTC_NOW),
+        onupdate=db.text(UTC_NOW),
         doc='Update date',
     )
 
@@ -132,18 +305,122 @@ class Wallet(_WalletMixin, db.Model):
         """
         return self.balance >= 0
 
+    @classmethod
+    def available_funds(cls) -> ColumnElement:
+        """
+        Funds of the wallet which can be spent, the credit shards included.
+
+        :return: expression
+        """
+        return db.type_coerce(cls.balance - cls.held + cls.shard_balance(), Amount)
+
+    @classmethod
+    def shard_balance(cls) -> ColumnElement:
+        """
+        Sum of the credit shards of the wallet, zero for the regular wallets.
+
+        :return: SQL expression
+        """
+        return db.case([(
+            cls.shards > 0,
+            db.select([db.func.coalesce(db.func.sum(WalletShard.balance), 0)]).where(
+                WalletShard.wallet_id == cls.id,
+            ).as_scalar(),
+        )], else_=0)
+
+    async def get_balance(self, bind: Gino = db) -> Decimal:
+        """
+        Wallet balance including the credit shards.
+
+        :param bind: database to read the shards from
+        :return: balance
+        """
+        if not self.shards:
+            return self.balance
+        return self.balance + await bind.scalar(
+            db.select([db.func.coalesce(db.func.sum(WalletShard.balance), 0)]).where(WalletShard.wallet_id == self.id),
+        )
+
+    async def set_shards(self, count: int) -> None:
+        """
+        Spread the wallet credits across the given number of shards.
+
+        Shards keep their funds forever, so the number of shards can only
+        grow, a regular wallet has no shards.
+
+        :param count: number of shards
+        :return: None
+        """
+        if count < self.shards:
+            raise ValueError(f'Wallet {self.id} has {self.shards} shards already')
+        async with db.transaction():
+            await db.status(insert(WalletShard).values([
+                {'wallet_id': self.id, 'shard': shard, 'balance': 0} for shard in range(count)
+            ]).on_conflict_do_nothing())
+            await self.update(shards=count).apply()
+
     async def commit(self) -> None:
         """
         Update account balance.
 
+        Transfers move the balance by delta in their own statement, this full
+        ledger recalculation is only used if ``BALANCE_RECALCULATE`` is enabled.
+
+        :return: None
+        """
+        await self.reconcile()
+
+    async def reconcile(self) -> None:
+        """
+        Recalculate account balance from the whole ledger.
+
+        Credit shards are left as is, the wallet row gets the rest.
+
         :return: None
         """
-        self.balance = await self.get_transaction_amount()
+        total = await self.get_transaction_amount() or 0
+        self.balance = total - (await self.get_balance() - self.balance)
         await self.update(balance=self.balance).apply()
-        if not self.is_valid:
+        if total < 0:
             raise NotEnoughFundsException()
 
 
+class WalletShard(db.Model):
+    """
+    Credit shard of the hot wallet.
+
+    Credits of the hot wallet are spread across its shards, so they do not
+    wait for the wallet row lock. Debits are taken from the wallet row which
+    may go below zero while the shards cover it.
+    """
+
+    __tablename__ = 'wallet_shard'
+
+    wallet_id = db.Column(
+        UUID,
+        db.ForeignKey(f'{Wallet.__tablename__}.id'),
+        primary_key=True,
+        nullable=False,
+    )
+    shard = db.Column(
+        db.Integer,
+        primary_key=True,
+        nullable=False,
+    )
+    balance = db.Column(
+        Amount,
+        default=0,
+        nullable=False,
+    )
+
+
+# Sum of the credit shards of the wallet row for the raw statements, the
+# subquery runs for the hot wallets only
+SHARD_BALANCE = """CASE WHEN {wallet}.shards > 0 THEN (
+    SELECT coalesce(sum(wallet_shard.balance), 0) FROM wallet_shard WHERE wallet_shard.wallet_id = {wallet}.id
+) ELSE 0 END"""
+
+
 class UserBankAccount(_WalletMixin, db.Model):
     """
     User bank account to withdraw.
@@ -157,7 +434,7 @@ class UserBankAccount(_WalletMixin, db.Model):
     id = db.Column(  # noqa: A003
         UUID,
         primary_key=True,
-        default=uuid.uuid4,
+        default=uuid7,
         nullable=False,
         unique=True,
     )
@@ -166,37 +443,141 @@ class UserBankAccount(_WalletMixin, db.Model):
         db.ForeignKey(f'{Account.__tablename__}.id'),
         nullable=False,
         doc='',
+        index=True,
     )
     date_created = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.datetime.utcnow(),
+        server_default=db.text(UTC_NOW),
         doc='Creation date',
     )
     date_updated = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.datetime.utcnow(),
-        onupdate=datetime.datetime.utcnow,
+        server_default=db.text(UTC_NOW),
+        onupdate=db.text(UTC_NOW),
         doc='Update date',
     )
 
 
+class JournalEntry(db.Model):
+    """
+    Journal entry of the transfer.
+
+    Entry links the legs of the transfer, both legs are created within the
+    entry database transaction, so they share its creation date.
+    """
+
+    __tablename__ = 'journal_entry'
+
+    id = db.Column(  # noqa: A003
+        UUID,
+        primary_key=True,
+        default=uuid7,
+        nullable=False,
+    )
+    kind = db.Column(
+        db.Enum(TransactionType, name='transactiontype'),
+        nullable=False,
+        doc='type',
+    )
+    status = db.Column(
+        db.Enum(TransactionStatus, name='transactionstatus'),
+        default=TransactionStatus.NEW,
+        nullable=False,
+        doc='status',
+    )
+    date_created = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.text(UTC_NOW),
+        doc='Creation date',
+    )
+
+    async def get_legs(self, bind: Gino = db) -> List['Transaction']:
+        """
+        Legs of the entry, the debited one goes first.
+
+        Creation date bound lets the database read a single ledger partition.
+        Legs of the archived partitions are read from the archive file.
+
+        :param bind: database to read the ledger from
+        :return: transactions
+        """
+        legs = await bind.all(
+            Transaction.query.where(
+                Transaction.entry_id == self.id,
+            ).where(
+                Transaction.date_created == self.date_created,
+            ).order_by(Transaction.amount, Transaction.id),
+        )
+        if legs or not settings.LEDGER_ARCHIVE_PATH:
+            return legs
+        # archive module reads the ledger models
+        from .archive import read_entry
+        archived = await asyncio.get_event_loop().run_in_executor(
+            None, functools.partial(read_entry, self.id, self.date_created),
+        )
+        return [Transaction(**leg) for leg in archived]
+
+
 class Transaction(db.Model):
     """Money transaction."""
 
     __tablename__ = 'transaction'
+    __table_args__ = (
+        # index only sums of the ledger tail
+        db.Index(
+            'ix_transaction_account_id_committed',
+            'account_id',
+            'seq',
+            'amount',
+            postgresql_where=db.text(f"status = '{TransactionStatus.COMMITTED.name}'"),
+        ),
+        db.Index(
+            'ix_transaction_account_id_date_created',
+            'account_id',
+            'date_created',
+            'id',
+        ),
+        # legs of the journal entry
+        db.Index(
+            'ix_transaction_entry_id',
+            'entry_id',
+        ),
+        # checkpoint horizon lookup
+        db.Index(
+            'ix_transaction_pending',
+            'seq',
+            postgresql_where=db.text(f"status IN ('{TransactionStatus.NEW.name}', '{TransactionStatus.HOLD.name}')"),
+        ),
+        # monthly partitions are maintained by create_partitions, the default
+        # one created by the migration catches rows out of the partitions range
+        {'postgresql_partition_by': 'RANGE (date_created)'},
+    )
 
     SUCCESS_STATUSES = (
         TransactionStatus.COMMITTED,
     )
+    PENDING_STATUSES = (
+        TransactionStatus.NEW,
+        TransactionStatus.HOLD,
+    )
 
+    # unique keys of the partitioned table must include the partition key
     id = db.Column(  # noqa: A003
         UUID,
         primary_key=True,
-        default=uuid.uuid4,
+        default=uuid7,
         nullable=False,
-        unique=True,
+    )
+    seq = db.Column(
+        db.BigInteger,
+        db.Sequence('transaction_seq'),
+        server_default=db.text("nextval('transaction_seq')"),
+        nullable=False,
+        doc='Ledger sequence number',
+        index=True,
     )
     account_id = db.Column(
         UUID,
@@ -204,61 +585,760 @@ class Transaction(db.Model):
         nullable=False,
         doc='',
     )
+    entry_id = db.Column(
+        UUID,
+        db.ForeignKey(f'{JournalEntry.__tablename__}.id'),
+        nullable=True,
+        doc='Journal entry of the transfer, legs recorded before the journal have none',
+    )
     amount = db.Column(
-        db.Numeric(settings.ASSET_AMOUNT_MAX_DIGITS, settings.ASSET_AMOUNT_PRECISION),
+        Amount,
         default=0,
         nullable=False,
     )
+    # database enum types are created by the migrations with the member names as labels
     kind = db.Column(
-        db.Enum(TransactionType),
+        db.Enum(TransactionType, name='transactiontype'),
         nullable=False,
         doc='type',
     )
     status = db.Column(
-        db.Enum(TransactionStatus),
+        db.Enum(TransactionStatus, name='transactionstatus'),
         default=TransactionStatus.NEW,
         nullable=False,
         doc='status',
     )
     date_created = db.Column(
         db.DateTime,
+        primary_key=True,
         nullable=False,
-        default=datetime.datetime.utcnow(),
+        server_default=db.text(UTC_NOW),
         doc='Creation date',
     )
 
     @classmethod
-    async def _bulk_update(cls, ids: Tuple[UUID], status: TransactionStatus) -> None:
-        await Transaction.update.values(status=status).where(
-            Transaction.id.in_(ids),
-        ).gino.status()
+    async def bulk_create(cls, *legs: dict) -> None:
+        """
+        Insert multiple transactions with a single batched statement.
+
+        Omitted id, status and creation date get the column defaults.
+
+        :param legs: transaction column values, account_id, amount and kind are required
+        :return: None
+        """
+        await _TRANSACTION_INSERT.executemany([
+            {
+                'id': leg.get('id') or uuid7(),
+                'account_id': leg['account_id'],
+                'entry_id': leg.get('entry_id'),
+                'amount': to_units(leg['amount']),
+                'kind': leg['kind'].name,
+                'status': leg.get('status', TransactionStatus.NEW).name,
+                'date_created': leg.get('date_created'),
+            }
+            for leg in legs
+        ])
 
     @classmethod
-    async def bulk_commit(cls, *ids: UUID) -> None:
+    async def release_holds(cls, hold_ids: List[uuid.UUID], status: TransactionStatus,
+                            date_from: datetime.datetime, wallet_id: Optional[uuid.UUID] = None) -> List[uuid.UUID]:
         """
-        Commit multiple transactions.
+        Capture or void pending holds.
 
-        :param ids: transaction ids
-        :return: None
+        Both legs of every hold get the given status, the held funds are
+        released and the captured amounts are moved between the wallets, all
+        within a single statement.
+
+        :param hold_ids: hold ids
+        :param status: committed to capture the holds, cancelled to void them
+        :param date_from: holds created earlier are skipped, it bounds the ledger partitions scanned
+        :param wallet_id: skip the holds of other source wallets
+        :return: ids of the changed wallets
         """
-        await cls._bulk_update(ids, TransactionStatus.COMMITTED)
+        rows = await _HOLD_RELEASE.all(
+            source_ids=list(hold_ids),
+            target_ids=[hold_target_id(hold_id) for hold_id in hold_ids],
+            status=status.name,
+            capture=status == TransactionStatus.COMMITTED,
+            date_from=date_from,
+            wallet_id=wallet_id,
+        )
+        return [row[0] for row in rows]
 
     @classmethod
-    async def bulk_reject(cls, *ids: UUID) -> None:
+    def partition_name(cls, month: datetime.date) -> str:
         """
-        Reject multiple transactions.
+        Name of the monthly ledger partition.
 
-        :param ids: transaction ids
-        :return: None
+        :param month: any date of the month
+        :return: partition table name
+        """
+        return f'{cls.__tablename__}_y{month.year:04d}m{month.month:02d}'
+
+    @classmethod
+    async def create_partitions(cls, months_ahead: int) -> List[str]:
         """
-        await cls._bulk_update(ids, TransactionStatus.REJECTED)
+        Create monthly partitions from the current month on.
+
+        Rows caught by the default partition in the month range are moved
+        to the new partition.
+
+        :param months_ahead: number of future months to create partitions for
+        :return: created partition names
+        """
+        created = []
+        for offset in range(months_ahead + 1):
+            date_from, date_to = month_start(offset), month_start(offset + 1)
+            name = cls.partition_name(date_from)
+            if await db.scalar(db.text('SELECT to_regclass(:name)'), name=name):
+                continue
+            try:
+                await cls._create_partition(name, date_from, date_to)
+            except InvalidObjectDefinitionError:
+                # month is covered by another partition attached by hand
+                continue
+            created.append(name)
+        return created
+
+    @classmethod
+    async def _create_partition(cls, name: str, date_from: datetime.date, date_to: datetime.date) -> None:
+        async with db.transaction():
+            await db.status(db.text(
+                f'CREATE TABLE {name} (LIKE {cls.__tablename__} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+            ))
+            await db.status(db.text(f"""
+                WITH moved AS (
+                    DELETE FROM {cls.__tablename__}_default
+                    WHERE date_created >= :date_from AND date_created < :date_to
+                    RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+            """), date_from=date_from, date_to=date_to)
+            await db.status(db.text(
+                f'ALTER TABLE {cls.__tablename__} ATTACH PARTITION {name} '
+                f"FOR VALUES FROM ('{date_from.isoformat()}') TO ('{date_to.isoformat()}')",
+            ))
 
     @classmethod
-    async def bulk_error(cls, *ids: UUID) -> None:
+    async def detach_partitions(cls, retention: int, skew: float) -> List[str]:
         """
-        Mark multiple transactions as error.
+        Detach monthly partitions older than the retention period.
 
-        :param ids: transaction ids
+        Committed transactions of the partition are folded into the balance
+        checkpoints first. Partition is detached only if it has no pending
+        transactions and every committed one is folded, so the balances never
+        need it again. Detached partitions are kept as standalone tables and
+        registered in ``ledger_partition``.
+
+        :param retention: number of past months to keep attached
+        :param skew: seconds between transaction creation date and insert
+        :return: detached partition names
+        """
+        partitions = await db.all(db.text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = CAST(:parent AS regclass) AND c.relname ~ :pattern
+            ORDER BY c.relname
+        """), parent=cls.__tablename__, pattern=f'^{cls.__tablename__}_y[0-9]{{4}}m[0-9]{{2}}$')
+        horizon = month_start(-retention)
+        detached = []
+        for name, in partitions:
+            date_from = datetime.date(int(name[-7:-3]), int(name[-2:]), 1)
+            date_to = month_start(1, date_from)
+            if date_to > horizon:
+                break
+            async with db.transaction():
+                await db.status(db.text(f"""
+                    WITH horizon AS (
+                        SELECT min(seq) AS seq FROM transaction WHERE status = ANY(:pending)
+                    ), partition AS (
+                        SELECT account_id, max(seq) AS seq
+                        FROM {name}
+                        WHERE status = ANY(:success)
+                        GROUP BY account_id
+                    )
+                    INSERT INTO balance_checkpoint (account_id, seq, amount, date_from, date_created)
+                    SELECT p.account_id, p.seq, coalesce(l.amount, 0) + t.amount,
+                        t.date_created - make_interval(secs => :skew), now() at time zone 'utc'
+                    FROM partition p
+                    CROSS JOIN horizon h
+                    LEFT JOIN LATERAL (
+                        SELECT seq, amount FROM balance_checkpoint
+                        WHERE account_id = p.account_id
+                        ORDER BY seq DESC
+                        LIMIT 1
+                    ) l ON true
+                    CROSS JOIN LATERAL (
+                        SELECT sum(amount) AS amount, max(date_created) AS date_created
+                        FROM transaction
+                        WHERE account_id = p.account_id AND status = ANY(:success)
+                            AND seq > coalesce(l.seq, 0) AND seq <= p.seq
+                    ) t
+                    WHERE p.seq > coalesce(l.seq, 0) AND p.seq < coalesce(h.seq, p.seq + 1)
+                """), pending=[status.name for status in cls.PENDING_STATUSES],
+                    success=[status.name for status in cls.SUCCESS_STATUSES],
+                    skew=float(skew))
+                covered = await db.scalar(db.text(f"""
+                    SELECT NOT EXISTS (SELECT 1 FROM {name} WHERE status = ANY(:pending))
+                        AND NOT EXISTS (
+                            SELECT 1
+                            FROM (
+                                SELECT account_id, max(seq) AS seq
+                                FROM {name}
+                                WHERE status = ANY(:success)
+                                GROUP BY account_id
+                            ) t
+                            WHERE NOT EXISTS (
+                                SELECT 1 FROM balance_checkpoint c
+                                WHERE c.account_id = t.account_id AND c.seq >= t.seq
+                            )
+                        )
+                """), pending=[status.name for status in cls.PENDING_STATUSES],
+                    success=[status.name for status in cls.SUCCESS_STATUSES])
+                if not covered:
+                    continue
+                await db.status(db.text(f'ALTER TABLE {cls.__tablename__} DETACH PARTITION {name}'))
+                await LedgerPartition.create(
+                    name=name,
+                    date_from=date_from,
+                    date_to=date_to,
+                    seq_max=await db.scalar(db.text(f'SELECT coalesce(max(seq), 0) FROM {name}')),
+                )
+            detached.append(name)
+        return detached
+
+
+class CheckpointWatermark(db.Model):
+    """Ledger sequence numbers the balance checkpoints are taken up to, a single row."""
+
+    __tablename__ = 'checkpoint_watermark'
+
+    id = db.Column(  # noqa: A003
+        db.SmallInteger,
+        primary_key=True,
+        nullable=False,
+    )
+    seq = db.Column(
+        db.BigInteger,
+        nullable=False,
+        doc='Accounts with the later transactions only are checked',
+    )
+    horizon = db.Column(
+        db.BigInteger,
+        nullable=False,
+        server_default='0',
+        doc='Sequence numbers up to it are taken by the finished transactions only',
+    )
+    next_seq = db.Column(
+        db.BigInteger,
+        doc='Next horizon, the last sequence number taken before next_xid',
+    )
+    next_xid = db.Column(
+        db.BigInteger,
+        doc='Snapshot xmax taken after next_seq, every earlier transaction has to finish first',
+    )
+
+
+class BalanceCheckpoint(db.Model):
+    """
+    Cumulative sum of the account ledger.
+
+    Checkpoint covers all the account transactions up to the sequence number,
+    so balance can be recalculated from the ledger tail only.
+    """
+
+    __tablename__ = 'balance_checkpoint'
+
+    account_id = db.Column(
+        UUID,
+        db.ForeignKey(f'{Account.__tablename__}.id'),
+        primary_key=True,
+        nullable=False,
+    )
+    seq = db.Column(
+        db.BigInteger,
+        primary_key=True,
+        nullable=False,
+        doc='Last transaction sequence number included',
+    )
+    amount = db.Column(
+        Amount,
+        nullable=False,
+        doc='Cumulative transactions sum',
+    )
+    date_from = db.Column(
+        db.DateTime,
+        nullable=False,
+        doc='Lower bound of the creation date of the later transactions',
+    )
+    date_created = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.text(UTC_NOW),
+        doc='Creation date',
+    )
+
+    @classmethod
+    async def take(cls, min_rows: int, skew: float) -> int:
+        """
+        Create checkpoints for accounts with enough new committed transactions.
+
+        Sequence numbers are taken before the commit, so a running transaction
+        can still own the numbers below the visible ones. Only the rows up to
+        the horizon, the last sequence number read before every transaction
+        running at that moment has finished, are folded. The horizon moves to
+        the sequence read by the previous run once the snapshot xmin passes
+        the xmax taken right after that read, or to the current sequence on a
+        quiet database. Ledger writers of the service write a row before
+        their first ledger leg, so their xid is assigned before they take the
+        sequence numbers.
+
+        Everything after the first pending transaction of the account is left
+        to the tail too, so the rows which can still change their status are
+        never folded. Long lived holds block the checkpoints of their own
+        accounts only.
+
+        Transaction creation date is set right before its sequence number is
+        taken, so later transactions are not older than the folded ones by
+        more than ``skew`` seconds.
+
+        Only the accounts with transactions after the watermark are checked,
+        so the quiet accounts are not rescanned on every run. Watermark is
+        moved up to the horizon but not past the oldest pending transaction,
+        which can still be committed without getting a new sequence number.
+
+        :param min_rows: minimal number of transactions since the last checkpoint
+        :param skew: seconds between transaction creation date and insert
+        :return: number of created checkpoints
+        """
+        async with db.transaction():
+            await db.status(db.text(f"""
+                INSERT INTO {CheckpointWatermark.__tablename__} (id, seq) VALUES (1, 0) ON CONFLICT (id) DO NOTHING
+            """))
+            state = await CheckpointWatermark.query.where(CheckpointWatermark.id == 1).with_for_update().gino.one()
+            # sequence is read before the snapshot, so its owners are either finished or running in the snapshot
+            last_seq = await db.scalar(db.text('SELECT last_value FROM transaction_seq'))
+            xmin, xmax = await db.first(db.text("""
+                SELECT coalesce((
+                    SELECT min(CAST(CAST(xid AS text) AS bigint)) FROM pg_snapshot_xip(s) xid
+                    WHERE xid IS DISTINCT FROM pg_current_xact_id_if_assigned()
+                ), CAST(CAST(pg_snapshot_xmax(s) AS text) AS bigint)), CAST(CAST(pg_snapshot_xmax(s) AS text) AS bigint)
+                FROM pg_current_snapshot() s
+            """))
+            horizon, next_seq, next_xid = state.horizon, state.next_seq, state.next_xid
+            if next_xid is None or xmin >= next_xid:
+                if next_xid is not None:
+                    horizon = max(horizon, next_seq)
+                next_seq, next_xid = last_seq, xmax
+            if xmin >= next_xid:
+                horizon = max(horizon, next_seq)
+            await state.update(horizon=horizon, next_seq=next_seq, next_xid=next_xid).apply()
+            return await cls._fold(horizon, min_rows, skew)
+
+    @classmethod
+    async def _fold(cls, horizon: int, min_rows: int, skew: float) -> int:
+        status = await db.status(db.text(f"""
+            WITH horizon AS (
+                SELECT CAST(:horizon AS bigint) AS seq
+            ), watermark AS (
+                SELECT seq FROM {CheckpointWatermark.__tablename__} WHERE id = 1
+            ), candidate AS (
+                SELECT DISTINCT t.account_id
+                FROM transaction t, horizon h, watermark w
+                WHERE t.seq > w.seq AND t.seq <= h.seq
+            ), pending AS (
+                SELECT account_id, min(seq) - 1 AS seq
+                FROM transaction
+                WHERE status = ANY(:pending)
+                GROUP BY account_id
+            ), advance AS (
+                UPDATE {CheckpointWatermark.__tablename__}
+                SET seq = greatest(seq, least((SELECT seq FROM horizon), (SELECT min(seq) FROM pending)))
+                WHERE id = 1
+            )
+            INSERT INTO balance_checkpoint (account_id, seq, amount, date_from, date_created)
+            SELECT c.account_id, t.seq, coalesce(l.amount, 0) + t.amount,
+                t.date_created - make_interval(secs => :skew), now() at time zone 'utc'
+            FROM candidate c
+            CROSS JOIN horizon h
+            LEFT JOIN pending p ON p.account_id = c.account_id
+            LEFT JOIN LATERAL (
+                SELECT seq, amount, date_from FROM balance_checkpoint
+                WHERE account_id = c.account_id
+                ORDER BY seq DESC
+                LIMIT 1
+            ) l ON true
+            CROSS JOIN LATERAL (
+                SELECT max(seq) AS seq, sum(amount) AS amount, max(date_created) AS date_created, count(*) AS count
+                FROM transaction
+                WHERE account_id = c.account_id AND status IN ({_SUCCESS})
+                    AND seq > coalesce(l.seq, 0) AND seq <= least(h.seq, p.seq)
+                    AND date_created >= coalesce(l.date_from, '-infinity')
+            ) t
+            WHERE t.count > 0 AND t.count >= :min_rows
+        """), pending=[status.name for status in Transaction.PENDING_STATUSES],
+            horizon=horizon,
+            skew=float(skew),
+            min_rows=min_rows)
+        return int(status[0].split()[-1])
+
+    @classmethod
+    async def verify(cls) -> List[Tuple[uuid.UUID, int, Decimal, Decimal]]:
+        """
+        Check every checkpoint against the previous one and the ledger between them.
+
+        Checkpoints preceded by the detached ledger partitions are skipped.
+
+        :return: mismatched checkpoints as (account_id, seq, amount, ledger amount)
+        """
+        rows = await db.all(db.text("""
+            WITH checkpoint AS (
+                SELECT account_id, seq, amount,
+                    coalesce(lag(seq) OVER w, 0) AS prev_seq, coalesce(lag(amount) OVER w, 0) AS prev_amount
+                FROM balance_checkpoint
+                WINDOW w AS (PARTITION BY account_id ORDER BY seq)
+            )
+            SELECT c.account_id, c.seq, c.amount, c.prev_amount + coalesce(sum(t.amount), 0) AS ledger
+            FROM checkpoint c
+            LEFT JOIN transaction t ON t.account_id = c.account_id AND t.status = ANY(:success)
+                AND t.seq > c.prev_seq AND t.seq <= c.seq
+            WHERE c.prev_seq >= (SELECT coalesce(max(seq_max), 0) FROM ledger_partition)
+            GROUP BY c.account_id, c.seq, c.amount, c.prev_amount
+            HAVING c.amount != c.prev_amount + coalesce(sum(t.amount), 0)
+        """), success=[status.name for status in Transaction.SUCCESS_STATUSES])
+        return [(account_id, seq, from_units(amount), from_units(ledger)) for account_id, seq, amount, ledger in rows]
+
+
+# Success statuses are inlined so the generic plans of the prepared statements
+# can still use the partial index of the committed transactions
+_SUCCESS = ', '.join(f"'{status.name}'" for status in Transaction.SUCCESS_STATUSES)
+
+_TRANSACTION_AMOUNT_FULL = statements.register('transaction_amount_full', f"""
+    SELECT sum(amount) FROM transaction WHERE account_id = :account_id AND status IN ({_SUCCESS})
+""")
+
+# bare subquery value of the checkpoint date is required for the run-time partition pruning
+_TRANSACTION_AMOUNT = statements.register('transaction_amount', f"""
+    WITH checkpoint AS (
+        SELECT seq, amount, date_from
+        FROM balance_checkpoint
+        WHERE account_id = :account_id
+        ORDER BY seq DESC
+        LIMIT 1
+    )
+    SELECT coalesce((SELECT amount FROM checkpoint), 0) + coalesce((
+        SELECT sum(amount)
+        FROM transaction
+        WHERE account_id = :account_id AND status IN ({_SUCCESS})
+            AND seq > coalesce((SELECT seq FROM checkpoint), 0)
+            AND date_created >= (SELECT coalesce(max(date_from), '-infinity') FROM checkpoint)
+    ), 0)
+""")
+
+_TRANSACTION_INSERT = statements.register('transaction_insert', f"""
+    INSERT INTO transaction (id, account_id, entry_id, amount, kind, status, date_created)
+    VALUES (:id, :account_id, :entry_id, :amount, CAST(:kind AS transactiontype), CAST(:status AS transactionstatus),
+        coalesce(CAST(:date_created AS timestamp), {UTC_NOW}))
+""")
+
+# Namespace of the hold target leg ids, hold id is the id of its source leg and journal entry
+HOLD_NAMESPACE = uuid.UUID('2f9d8a4e-7c1b-4e3a-b5d6-0a8c9e1f3b27')
+
+
+def hold_target_id(hold_id: uuid.UUID) -> uuid.UUID:
+    """
+    Id of the credited leg of the hold.
+
+    :param hold_id: hold id
+    :return: transaction id
+    """
+    return uuid.uuid5(HOLD_NAMESPACE, f'{hold_id}:target')
+
+
+_HOLD = f"'{TransactionStatus.HOLD.name}'"
+
+# Source legs are locked first, so concurrent capture, void and expiry of the
+# same hold are serialized and only the first one finds it pending. Wallets are
+# locked in the id order like the transfers do to avoid deadlocks.
+_HOLD_RELEASE = statements.register('hold_release', f"""
+    WITH hold AS (
+        SELECT h.source_id, h.target_id
+        FROM unnest(CAST(:source_ids AS uuid[]), CAST(:target_ids AS uuid[])) AS h (source_id, target_id)
+        JOIN transaction t ON t.id = h.source_id
+        WHERE t.status = {_HOLD} AND t.amount < 0 AND t.date_created >= :date_from
+            AND (CAST(:wallet_id AS uuid) IS NULL
+                OR t.account_id = (SELECT account_id FROM user_wallet WHERE id = CAST(:wallet_id AS uuid)))
+        FOR UPDATE OF t
+    ),
+    legs AS (
+        UPDATE transaction SET status = CAST(:status AS transactionstatus)
+        WHERE status = {_HOLD} AND date_created >= :date_from
+            AND id IN (SELECT source_id FROM hold UNION ALL SELECT target_id FROM hold)
+        RETURNING account_id, amount
+    ),
+    entry AS (
+        UPDATE journal_entry SET status = CAST(:status AS transactionstatus)
+        WHERE id IN (SELECT source_id FROM hold)
+    ),
+    delta AS (
+        SELECT account_id, sum(amount) AS amount, sum(greatest(-amount, 0)) AS released
+        FROM legs
+        GROUP BY account_id
+    ),
+    locked AS (
+        SELECT id FROM user_wallet
+        WHERE account_id IN (SELECT account_id FROM delta)
+        ORDER BY id
+        FOR UPDATE
+    )
+    UPDATE user_wallet w
+    SET balance = w.balance + CASE WHEN :capture THEN d.amount ELSE 0 END,
+        held = w.held - d.released,
+        date_updated = {UTC_NOW}
+    FROM delta d
+    WHERE w.account_id = d.account_id AND (SELECT count(*) FROM locked) > 0
+    RETURNING w.id
+""")
+
+
+class IdempotencyKey(db.Model):
+    """Outcome of the request made with the idempotency key."""
+
+    __tablename__ = 'idempotency_key'
+
+    key = db.Column(
+        db.String(255),
+        primary_key=True,
+        nullable=False,
+    )
+    fingerprint = db.Column(
+        db.String(64),
+        nullable=False,
+        doc='Request hash',
+    )
+    status_code = db.Column(
+        db.Integer,
+        nullable=False,
+        doc='Response status code',
+    )
+    detail = db.Column(
+        db.Text,
+        nullable=True,
+        doc='Error details',
+    )
+    date_created = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.text(UTC_NOW),
+        doc='Creation date',
+        index=True,
+    )
+
+    @classmethod
+    async def sweep(cls, ttl: float, batch_size: int) -> int:
+        """
+        Delete expired keys in batches.
+
+        :param ttl: key time to live in seconds
+        :param batch_size: keys deleted within one statement
+        :return: number of deleted keys
+        """
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
+        deleted = 0
+        while True:
+            batch = db.select([cls.key]).where(cls.date_created < expired).limit(batch_size)
+            status, _ = await cls.delete.where(cls.key.in_(batch)).gino.status()
+            count = int(status.split()[-1])
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+
+class TransferOperation(db.Model):
+    """Transfer queued to be applied by the background workers."""
+
+    __tablename__ = 'transfer_operation'
+    __table_args__ = (
+        # queue head lookup
+        db.Index(
+            'ix_transfer_operation_queued',
+            'seq',
+            postgresql_where=db.text(f"status = '{OperationStatus.QUEUED.name}'"),
+        ),
+    )
+
+    id = db.Column(  # noqa: A003
+        UUID,
+        primary_key=True,
+        default=uuid7,
+        nullable=False,
+    )
+    seq = db.Column(
+        db.BigInteger,
+        db.Sequence('transfer_operation_seq'),
+        server_default=db.text("nextval('transfer_operation_seq')"),
+        nullable=False,
+        doc='Queue order',
+    )
+    kind = db.Column(
+        db.Enum(TransactionType, name='transactiontype'),
+        nullable=False,
+        doc='Deposit or send',
+    )
+    wallet_id = db.Column(
+        UUID,
+        nullable=False,
+        doc='Source wallet of the send, target wallet of the deposit',
+    )
+    target_wallet_id = db.Column(
+        UUID,
+        nullable=True,
+        doc='Target wallet of the send',
+    )
+    bank_account_id = db.Column(
+        UUID,
+        nullable=True,
+        doc='Source bank account of the deposit',
+    )
+    amount = db.Column(
+        Amount,
+        nullable=False,
+    )
+    status = db.Column(
+        db.Enum(OperationStatus, name='operationstatus'),
+        default=OperationStatus.QUEUED,
+        nullable=False,
+    )
+    status_code = db.Column(
+        db.Integer,
+        nullable=True,
+        doc='Status code the synchronous request would get',
+    )
+    detail = db.Column(
+        db.Text,
+        nullable=True,
+        doc='Error details',
+    )
+    date_created = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.text(UTC_NOW),
+        doc='Creation date',
+    )
+    date_processed = db.Column(
+        db.DateTime,
+        nullable=True,
+        doc='Processing date',
+        index=True,
+    )
+
+    @classmethod
+    async def dequeue(cls, batch_size: int) -> List['TransferOperation']:
+        """
+        Lock the oldest queued operations within the current transaction.
+
+        Operations locked by the other workers are skipped.
+
+        :param batch_size: maximal number of operations
+        :return: operations in the queue order
+        """
+        return await cls.query.where(
+            cls.status == OperationStatus.QUEUED,
+        ).order_by(cls.seq).limit(batch_size).with_for_update(skip_locked=True).gino.all()
+
+    @classmethod
+    async def complete(cls, outcomes: List[Tuple[uuid.UUID, int, Optional[str]]]) -> None:
+        """
+        Store the outcomes of the processed operations.
+
+        :param outcomes: (operation id, status code, error details) tuples
         :return: None
         """
-        await cls._bulk_update(ids, TransactionStatus.ERROR)
+        await _OPERATION_COMPLETE.all(
+            ids=[operation_id for operation_id, _, _ in outcomes],
+            statuses=[
+                (OperationStatus.REJECTED if status_code >= 400 else OperationStatus.COMMITTED).name
+                for _, status_code, _ in outcomes
+            ],
+            status_codes=[status_code for _, status_code, _ in outcomes],
+            details=[detail for _, _, detail in outcomes],
+        )
+
+    @classmethod
+    async def sweep(cls, ttl: float, batch_size: int) -> int:
+        """
+        Delete processed operations in batches.
+
+        :param ttl: processed operation time to live in seconds
+        :param batch_size: operations deleted within one statement
+        :return: number of deleted operations
+        """
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
+        deleted = 0
+        while True:
+            batch = db.select([cls.id]).where(cls.date_processed < expired).limit(batch_size)
+            status, _ = await cls.delete.where(cls.id.in_(batch)).gino.status()
+            count = int(status.split()[-1])
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+
+_OPERATION_COMPLETE = statements.register('operation_complete', f"""
+    UPDATE transfer_operation
+    SET status = CAST(o.status AS operationstatus), status_code = o.status_code, detail = o.detail,
+        date_processed = {UTC_NOW}
+    FROM unnest(CAST(:ids AS uuid[]), CAST(:statuses AS text[]), CAST(:status_codes AS integer[]),
+        CAST(:details AS text[])) AS o (id, status, status_code, detail)
+    WHERE transfer_operation.id = o.id
+""")
+
+
+class LedgerPartition(db.Model):
+    """Monthly ledger partition detached from the transaction table."""
+
+    __tablename__ = 'ledger_partition'
+
+    name = db.Column(
+        db.String(63),
+        primary_key=True,
+        nullable=False,
+        doc='Partition table name',
+    )
+    date_from = db.Column(
+        db.Date,
+        nullable=False,
+        doc='First day of the month',
+    )
+    date_to = db.Column(
+        db.Date,
+        nullable=False,
+        doc='First day of the next month',
+    )
+    seq_max = db.Column(
+        db.BigInteger,
+        nullable=False,
+        doc='Last transaction sequence number',
+    )
+    date_created = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.text(UTC_NOW),
+        doc='Detach date',
+    )
+
+    @classmethod
+    async def unarchived(cls) -> List[str]:
+        """
+        Detached partitions still kept as database tables.
+
+        :return: partition names from the oldest
+        """
+        return [
+            name for name, in await db.all(
+                db.select([cls.name])
+                .where(db.func.to_regclass(cls.name).isnot(None))
+                .order_by(cls.date_from),
+            )
+        ]
@@ -0,0 +1,197 @@
+"""
+Instrumented database connection pool.
+
+Pooled connections measure the statements they send and keep the
+registered hot path statements prepared.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Optional,
+)
+
+from asyncpg import Connection
+from gino.dialects.asyncpg import Pool
+
+from .conf import settings
+from .metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+)
+from .models import statements
+
+logger = logging.getLogger(__name__)
+
+_SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|(?<![\w$])\d+(?:\.\d+)?\b")
+_SQL_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SQL_SPACE = re.compile(r'\s+')
+
+
+class QueryStats:
+    """Database usage within one request."""
+
+    def __init__(self) -> None:  # noqa: D107
+        self.statements = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+
+
+# Set by the timing middleware for the duration of the request
+query_stats: ContextVar[Optional[QueryStats]] = ContextVar('query_stats', default=None)
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Strip the literal values out of the statement, so the same statements look the same in the log.
+
+    :param query: SQL statement
+    :return: normalized statement
+    """
+    query = _SQL_LITERAL.sub('?', query)
+    query = _SQL_LIST.sub('(...)', query)
+    return _SQL_SPACE.sub(' ', query).strip()
+
+
+def _observe(query: str, elapsed: float) -> None:
+    STATEMENTS.inc()
+    STATEMENT_DURATION.observe(elapsed)
+    stats = query_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += elapsed
+    if settings.DB_SLOW_QUERY_SECONDS and elapsed >= settings.DB_SLOW_QUERY_SECONDS:
+        logger.warning('Slow query %.3fs: %s', elapsed, normalize_sql(query))
+
+
+class InstrumentedConnection(Connection):
+    """
+    Asyncpg connection measuring every statement sent to the server.
+
+    Rows fetched from the server side cursors are not counted.
+    """
+
+    async def execute(self, query: str, *args, **kwargs) -> str:  # noqa: ANN002, ANN003
+        """
+        Execute the statement.
+
+        :param query: SQL statement
+        :param args: query arguments
+        :param kwargs: execution options
+        :return: status
+        """
+        if args:
+            # extended protocol statements are measured in _do_execute
+            return await super().execute(query, *args, **kwargs)
+        start = time.monotonic()
+        try:
+            return await super().execute(query, **kwargs)
+        finally:
+            _observe(query, time.monotonic() - start)
+
+    async def _do_execute(self, query: str, *args, **kwargs) -> Any:  # noqa: ANN002, ANN003
+        start = time.monotonic()
+        try:
+            return await super()._do_execute(query, *args, **kwargs)
+        finally:
+            _observe(query, time.monotonic() - start)
+
+    async def prepare_cached(self, query: str) -> None:
+        """
+        Prepare the statement into the connection statement cache.
+
+        Cached statements outlive the pool acquisitions, later executions
+        of the same query text skip the parse and plan round trip.
+
+        :param query: SQL statement
+        :return: None
+        """
+        await self._prepare(query, use_cache=True)
+
+
+class InstrumentedPool(Pool):
+    """Asyncpg pool collecting usage metrics."""
+
+    current: Optional['InstrumentedPool'] = None
+
+    def __init__(self, url: Any, loop: asyncio.AbstractEventLoop, **kwargs) -> None:  # noqa: ANN003, D107
+        kwargs.setdefault('connection_class', InstrumentedConnection)
+        self._connection_init = kwargs.get('init')
+        kwargs['init'] = self._init_connection
+        super().__init__(url, loop, **kwargs)
+
+    async def _init_connection(self, connection: Connection) -> None:
+        if self._connection_init is not None:
+            await self._connection_init(connection)
+        # every new connection is warmed up before it is handed out
+        await statements.prepare(connection)
+
+    async def _init(self) -> 'InstrumentedPool':
+        await super()._init()
+        InstrumentedPool.current = self
+        return self
+
+    async def acquire(self, *, timeout: Optional[float] = None) -> Connection:
+        """
+        Acquire a connection measuring the time spent waiting for it.
+
+        :param timeout: acquire timeout
+        :return: raw connection
+        """
+        start = time.monotonic()
+        try:
+            connection = await super().acquire(timeout=timeout)
+        except asyncio.TimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            POOL_WAIT.observe(elapsed)
+            stats = query_stats.get()
+            if stats is not None:
+                stats.pool_wait += elapsed
+        POOL_IN_USE.inc()
+        return connection
+
+    async def release(self, conn: Connection) -> None:
+        """
+        Release the connection back to the pool.
+
+        :param conn: raw connection
+        :return: None
+        """
+        try:
+            await super().release(conn)
+        finally:
+            POOL_IN_USE.dec()
+
+    async def close(self) -> None:
+        """
+        Close the pool.
+
+        :return: None
+        """
+        await super().close()
+        if InstrumentedPool.current is self:
+            InstrumentedPool.current = None
+
+
+def _idle_connections() -> Optional[int]:
+    pool = InstrumentedPool.current
+    # pool size introspection is available since asyncpg 0.25
+    if pool is None or not hasattr(pool.raw_pool, 'get_idle_size'):
+        return None
+    return pool.raw_pool.get_idle_size()
+
+
+POOL_IN_USE = Gauge('db_pool_connections_in_use', 'Connections acquired from the pool.')
+POOL_IDLE = Gauge('db_pool_connections_idle', 'Idle connections in the pool.', func=_idle_connections)
+POOL_WAIT = Histogram('db_pool_acquire_seconds', 'Time spent waiting for a pool connection.')
+POOL_TIMEOUTS = Counter('db_pool_acquire_timeouts_total', 'Pool connection acquire timeouts.')
+STATEMENTS = Counter('db_statements_total', 'Statements sent to the database.')
+STATEMENT_DURATION = Histogram('db_statement_seconds', 'Statement execution time.')
@@ -0,0 +1,59 @@
+"""Read replica routing."""
+
+from typing import Optional
+
+from fastapi import Response
+from gino import Gino
+
+from .conf import settings
+from .metrics import Counter
+from .models import db
+
+# Response and request header carrying the primary WAL position after the write
+WRITE_TOKEN_HEADER = 'X-Write-Token'
+WRITE_TOKEN_REGEX = r'^[0-9A-Fa-f]{1,8}/[0-9A-Fa-f]{1,8}$'
+
+# Replica is bound in init_app if DB_REPLICA_HOST is configured, models stay bound to the primary
+replica = Gino()
+
+READ_ROUTES = Counter('db_read_routes_total', 'Read only requests by the serving database.')
+
+_WRITE_TOKEN = 'SELECT CAST(pg_current_wal_lsn() AS text)'
+
+# standalone stand-in replica is never behind the primary running on the same server
+_CAUGHT_UP = """
+    SELECT CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END
+        >= CAST(CAST(:lsn AS text) AS pg_lsn)
+"""
+
+
+async def set_write_token(response: Response) -> None:
+    """
+    Return the write token to the client if read-your-writes mode is on.
+
+    Must be called after the write transaction is committed.
+
+    :param response: response
+    :return: None
+    """
+    if settings.DB_REPLICA_READ_YOUR_WRITES and replica.is_bound():
+        response.headers[WRITE_TOKEN_HEADER] = await db.scalar(db.text(_WRITE_TOKEN))
+
+
+async def read_bind(write_token: Optional[str] = None) -> Gino:
+    """
+    Pick the database for the read only queries.
+
+    Replica serves the reads if it is configured, the primary serves them
+    if the replica is not caught up with the write token yet.
+
+    :param write_token: write token presented by the client
+    :return: replica or primary database
+    """
+    if not replica.is_bound():
+        return db
+    if write_token is not None and not await replica.scalar(db.text(_CAUGHT_UP), lsn=write_token):
+        READ_ROUTES.inc(database='primary')
+        return db
+    READ_ROUTES.inc(database='replica')
+    return replica
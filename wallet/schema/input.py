@@ -1,27 +1,40 @@
 """Output types."""
 
+from datetime import (
+    datetime,
+    timezone,
+)
+from enum import Enum
+from typing import Optional
 from uuid import UUID
 
 from pydantic import (
     BaseModel,
     condecimal,
+    conlist,
+    constr,
+    validator,
 )
 
 from wallet.conf import settings
+from wallet.enum import (
+    TransactionStatus,
+    TransactionType,
+)
 
 
 class InputWalletType(BaseModel):
     """Create wallet input."""
 
     user_id: UUID
+    asset: constr(min_length=1, max_length=16) = settings.ASSET_DEFAULT
 
 
 class _BaseTransactionType(BaseModel):
     amount: condecimal(
         max_digits=settings.ASSET_AMOUNT_MAX_DIGITS,
         decimal_places=settings.ASSET_AMOUNT_PRECISION,
-        le=settings.TRANSACTION_MAX_AMOUNT,
-        ge=settings.TRANSACTION_MIN_AMOUNT,
+        gt=0,
     )
 
 
@@ -31,7 +44,49 @@ class DepositType(_BaseTransactionType):
     bank_account_id: UUID
 
 
+class DepositImportType(DepositType):
+    """Bank statement deposit row."""
+
+    reference: constr(min_length=1)
+    wallet_id: UUID
+
+
 class TransferType(_BaseTransactionType):
     """Send money between wallets input."""
 
     target_wallet_id: UUID
+
+
+class BatchTransferItemType(TransferType):
+    """Batch transfer item input."""
+
+    wallet_id: UUID
+
+
+class BatchTransferType(BaseModel):
+    """Send money between multiple wallets input."""
+
+    transfers: conlist(BatchTransferItemType, min_items=1, max_items=settings.BATCH_MAX_SIZE)
+
+
+class HistoryFilterType(BaseModel):
+    """Operation history filters."""
+
+    kind: Optional[TransactionType] = None
+    status: Optional[TransactionStatus] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+
+    @validator('date_from', 'date_to')
+    def _naive_utc(cls, value: Optional[datetime]) -> Optional[datetime]:  # noqa: N805
+        # ledger dates are naive UTC
+        if value is None or value.tzinfo is None:
+            return value
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class ExportFormat(str, Enum):
+    """Operation history export formats."""
+
+    NDJSON = 'ndjson'
+    CSV = 'csv'
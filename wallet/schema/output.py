@@ -1,12 +1,20 @@
 """Output types."""
 
 from decimal import Decimal
+from typing import (
+    List,
+    Optional,
+)
 from uuid import UUID
 
-from pydantic import BaseModel
+from pydantic import (
+    BaseModel,
+    validator,
+)
 from pydantic.schema import datetime
 
 from wallet.enum import (
+    OperationStatus,
     TransactionStatus,
     TransactionType,
 )
@@ -21,10 +29,19 @@ class WalletSchema(BaseModel):
 
     id: UUID  # noqa: A003
     account_id: UUID
+    asset: str
     balance: Decimal
+    held: Decimal = Decimal(0)
+    available: Decimal = None
     date_updated: datetime
     date_created: datetime
 
+    @validator('available', always=True)
+    def _available(cls, value: Optional[Decimal], values: dict) -> Optional[Decimal]:  # noqa: N805
+        if 'balance' not in values or 'held' not in values:
+            return value
+        return values['balance'] - values['held']
+
 
 class TransactionSchema(BaseModel):
     """Transaction pydantic model."""
@@ -35,3 +52,43 @@ class TransactionSchema(BaseModel):
     kind: TransactionType
     status: TransactionStatus
     date_created: datetime
+    entry_id: Optional[UUID] = None
+    counterparty_account_id: Optional[UUID] = None
+
+
+class JournalEntrySchema(BaseModel):
+    """Journal entry pydantic model."""
+
+    id: UUID  # noqa: A003
+    kind: TransactionType
+    status: TransactionStatus
+    date_created: datetime
+    legs: List[TransactionSchema]
+
+
+class HoldSchema(BaseModel):
+    """Funds hold pydantic model."""
+
+    id: UUID  # noqa: A003
+    wallet_id: UUID
+    target_wallet_id: UUID
+    amount: Decimal
+
+
+class OperationSchema(BaseModel):
+    """Queued transfer pydantic model."""
+
+    id: UUID  # noqa: A003
+    kind: TransactionType
+    status: OperationStatus
+    status_code: Optional[int] = None
+    detail: Optional[str] = None
+    date_created: datetime
+    date_processed: Optional[datetime] = None
+
+
+class BatchTransferResultSchema(BaseModel):
+    """Batch transfer item result."""
+
+    status_code: int
+    detail: Optional[str] = None
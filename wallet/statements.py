@@ -0,0 +1,111 @@
+"""
+Prepared statements registry.
+
+Hot path statements are compiled once at import and prepared into the
+statement cache of every new pooled connection. They are executed with the
+positional arguments only, so neither SQLAlchemy nor Postgres parse them
+again on every call.
+"""
+
+from typing import (
+    Any,
+    Dict,
+    List,
+    Sequence,
+)
+
+from asyncpg import (
+    Connection,
+    Record,
+)
+from gino import Gino
+from gino.dialects.asyncpg import AsyncpgDialect
+from sqlalchemy import text
+
+_DIALECT = AsyncpgDialect(paramstyle='numeric')
+
+
+class Statement:
+    """SQL statement with named parameters executed as a prepared one."""
+
+    def __init__(self, bind: Gino, name: str, query: str) -> None:  # noqa: D107
+        compiled = text(query).compile(dialect=_DIALECT)
+        self.bind = bind
+        self.name = name
+        self.query = compiled.string
+        self.params = tuple(compiled.positiontup)
+
+    def arguments(self, **params: Any) -> List[Any]:
+        """
+        Positional arguments of the statement.
+
+        :param params: named parameters
+        :return: arguments
+        """
+        return [params[name] for name in self.params]
+
+    async def all(self, **params: Any) -> List[Record]:  # noqa: A003
+        """
+        Fetch all the rows using the current connection.
+
+        :param params: named parameters
+        :return: rows
+        """
+        async with self.bind.acquire(reuse=True) as connection:
+            raw_connection = await connection.get_raw_connection()
+            return await raw_connection.fetch(self.query, *self.arguments(**params))
+
+    async def executemany(self, rows: Sequence[Dict[str, Any]]) -> None:
+        """
+        Execute the statement for every row in a single round trip using the current connection.
+
+        :param rows: named parameters of every execution
+        :return: None
+        """
+        async with self.bind.acquire(reuse=True) as connection:
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.executemany(self.query, [self.arguments(**row) for row in rows])
+
+    async def scalar(self, **params: Any) -> Any:
+        """
+        Fetch the first column of the first row using the current connection.
+
+        :param params: named parameters
+        :return: value
+        """
+        rows = await self.all(**params)
+        return rows[0][0] if rows else None
+
+
+class StatementRegistry:
+    """Statements prepared on every new pooled connection."""
+
+    def __init__(self, bind: Gino) -> None:  # noqa: D107
+        self.bind = bind
+        self.statements: Dict[str, Statement] = {}
+
+    def register(self, name: str, query: str) -> Statement:
+        """
+        Add the statement to the registry.
+
+        :param name: unique statement name
+        :param query: SQL with named parameters
+        :return: statement
+        """
+        if name in self.statements:
+            raise ValueError(f'Statement {name} is already registered')
+        self.statements[name] = Statement(self.bind, name, query)
+        return self.statements[name]
+
+    def __getitem__(self, name: str) -> Statement:  # noqa: D105
+        return self.statements[name]
+
+    async def prepare(self, connection: Connection) -> None:
+        """
+        Prepare all the registered statements on the connection.
+
+        :param connection: instrumented pool connection
+        :return: None
+        """
+        for statement in self.statements.values():
+            await connection.prepare_cached(statement.query)
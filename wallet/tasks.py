@@ -0,0 +1,176 @@
+"""Background tasks."""
+
+import asyncio
+import logging
+from typing import (
+    Callable,
+    List,
+)
+
+from .archive import archive_partition
+from .conf import settings
+from .helpers import (
+    expire_holds,
+    process_transfers,
+)
+from .models import (
+    BalanceCheckpoint,
+    IdempotencyKey,
+    LedgerPartition,
+    Transaction,
+    TransferOperation,
+)
+
+logger = logging.getLogger(__name__)
+
+_tasks: List[asyncio.Task] = []
+
+
+async def _periodic(func: Callable, period: float) -> None:
+    while True:
+        await asyncio.sleep(period)
+        try:
+            await func()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Background task %s failed', func.__name__)
+
+
+async def checkpoint_balances() -> int:
+    """
+    Fold the ledger tails into the balance checkpoints.
+
+    :return: number of created checkpoints
+    """
+    created = await BalanceCheckpoint.take(
+        min_rows=settings.BALANCE_CHECKPOINT_ROWS,
+        skew=settings.LEDGER_DATE_SKEW,
+    )
+    if created:
+        logger.info('%s balance checkpoints created', created)
+    return created
+
+
+async def sweep_idempotency_keys() -> int:
+    """
+    Delete expired idempotency keys.
+
+    :return: number of deleted keys
+    """
+    deleted = await IdempotencyKey.sweep(
+        ttl=settings.IDEMPOTENCY_KEY_TTL,
+        batch_size=settings.IDEMPOTENCY_SWEEP_BATCH_SIZE,
+    )
+    if deleted:
+        logger.info('%s expired idempotency keys deleted', deleted)
+    return deleted
+
+
+async def drain_transfers() -> None:
+    """
+    Apply the queued transfers while there are any, then poll the queue.
+
+    :return: None
+    """
+    while True:
+        try:
+            processed = await process_transfers(settings.TRANSFER_QUEUE_BATCH_SIZE)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Transfer queue batch failed')
+            processed = 0
+        if processed < settings.TRANSFER_QUEUE_BATCH_SIZE:
+            await asyncio.sleep(settings.TRANSFER_QUEUE_POLL_PERIOD)
+
+
+async def sweep_transfer_operations() -> int:
+    """
+    Delete processed transfer operations.
+
+    :return: number of deleted operations
+    """
+    deleted = await TransferOperation.sweep(
+        ttl=settings.TRANSFER_QUEUE_TTL,
+        batch_size=settings.IDEMPOTENCY_SWEEP_BATCH_SIZE,
+    )
+    if deleted:
+        logger.info('%s processed transfer operations deleted', deleted)
+    return deleted
+
+
+async def sweep_holds() -> int:
+    """
+    Void the expired holds.
+
+    :return: number of expired holds
+    """
+    expired = await expire_holds(
+        ttl=settings.HOLD_TTL,
+        batch_size=settings.HOLD_SWEEP_BATCH_SIZE,
+    )
+    if expired:
+        logger.info('%s expired holds voided', expired)
+    return expired
+
+
+async def maintain_partitions() -> None:
+    """
+    Create the upcoming ledger partitions, detach and archive the expired ones.
+
+    Partitions are never detached if ``LEDGER_PARTITION_RETENTION`` is zero
+    and never archived if ``LEDGER_ARCHIVE_PATH`` is empty.
+
+    :return: None
+    """
+    for name in await Transaction.create_partitions(months_ahead=settings.LEDGER_PARTITION_PREMAKE):
+        logger.info('Ledger partition %s created', name)
+    if settings.LEDGER_PARTITION_RETENTION:
+        for name in await Transaction.detach_partitions(retention=settings.LEDGER_PARTITION_RETENTION,
+                                                        skew=settings.LEDGER_DATE_SKEW):
+            logger.info('Ledger partition %s detached', name)
+    if settings.LEDGER_ARCHIVE_PATH:
+        for name in await LedgerPartition.unarchived():
+            path = await archive_partition(name, chunk_size=settings.LEDGER_ARCHIVE_CHUNK_SIZE)
+            logger.info('Ledger partition %s archived to %s', name, path)
+
+
+def start_tasks() -> None:
+    """
+    Start periodic background tasks, task is disabled if its period is zero.
+
+    Transfer queue workers are started if ``TRANSFER_QUEUE`` is enabled.
+
+    :return: None
+    """
+    if _tasks:
+        return
+    schedule = (
+        (maintain_partitions, settings.LEDGER_PARTITION_PERIOD),
+        (checkpoint_balances, settings.BALANCE_CHECKPOINT_PERIOD),
+        (sweep_idempotency_keys, settings.IDEMPOTENCY_SWEEP_PERIOD),
+        (sweep_holds, settings.HOLD_SWEEP_PERIOD),
+        (sweep_transfer_operations, settings.TRANSFER_QUEUE_SWEEP_PERIOD),
+    )
+    for func, period in schedule:
+        if period:
+            _tasks.append(asyncio.ensure_future(_periodic(func, period)))
+    if settings.TRANSFER_QUEUE:
+        for _ in range(settings.TRANSFER_QUEUE_WORKERS):
+            _tasks.append(asyncio.ensure_future(drain_transfers()))
+
+
+async def stop_tasks() -> None:
+    """
+    Cancel running background tasks.
+
+    :return: None
+    """
+    while _tasks:
+        task = _tasks.pop()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
@@ -1,32 +1,81 @@
 """API endpoints."""
 
-from typing import List
+import functools
+from typing import (
+    Any,
+    List,
+    Optional,
+)
 from uuid import UUID
 
-from fastapi import APIRouter
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    Query,
+    Response,
+)
+from fastapi.responses import (
+    PlainTextResponse,
+    StreamingResponse,
+)
 from gino import NoResultFound
 
 from wallet.helpers import (
+    OPERATION_NAMESPACE,
+    capture_hold,
     create_deposit,
+    create_hold,
     create_send,
+    create_send_batch,
     create_wallet,
+    enqueue_transfer,
+    export_history,
+    history_page,
+    history_query,
+    id_for_key,
+    void_hold,
 )
 
+from . import metrics
+from .cache import wallet_cache
+from .conf import settings
+from .enum import TransactionType
 from .exceptions import (
+    EntryDoesNotExists,
+    OperationDoesNotExists,
     WalletDoesNotExists,
     WalletWrongException,
 )
+from .idempotency import (
+    fingerprint,
+    idempotent,
+)
 from .models import (
-    Account,
-    Transaction,
+    HOLD_NAMESPACE,
+    JournalEntry,
+    TransferOperation,
     Wallet,
 )
+from .replica import (
+    WRITE_TOKEN_HEADER,
+    WRITE_TOKEN_REGEX,
+    read_bind,
+    set_write_token,
+)
 from .schema.input import (
+    BatchTransferType,
     DepositType,
+    ExportFormat,
+    HistoryFilterType,
     InputWalletType,
     TransferType,
 )
 from .schema.output import (
+    BatchTransferResultSchema,
+    HoldSchema,
+    JournalEntrySchema,
+    OperationSchema,
     TransactionSchema,
     WalletSchema,
 )
@@ -37,75 +86,287 @@ router = APIRouter()
 @router.get('/wallet/{wallet_id}',
             name='Wallet details',
             response_model=WalletSchema)
-async def endpoint_wallet(wallet_id: UUID) -> dict:
+async def endpoint_wallet(wallet_id: UUID,
+                          write_token: Optional[str] = Header(None,
+                                                              alias=WRITE_TOKEN_HEADER,
+                                                              regex=WRITE_TOKEN_REGEX)) -> Response:
     """
     Your wallet details.
 
+    Serialized details are cached until the wallet balance is changed.
+    Cache is bypassed if the ``X-Write-Token`` header is presented.
+    Balance of the hot wallet includes its credit shards.
+
     :return: WalletType
     """
-    try:
-        user_wallet = await Wallet.query.where(Wallet.id == wallet_id).gino.one()
-        return user_wallet.to_dict()
-    except NoResultFound:
-        raise WalletDoesNotExists()
+    content = None if write_token else await wallet_cache.get(str(wallet_id))
+    if content is None:
+        bind = await read_bind(write_token)
+        try:
+            user_wallet = await bind.one(Wallet.query.where(Wallet.id == wallet_id))
+        except NoResultFound:
+            raise WalletDoesNotExists()
+        content = WalletSchema(**{**user_wallet.to_dict(), 'balance': await user_wallet.get_balance(bind)}).json()
+        await wallet_cache.set(str(wallet_id), content)
+    return Response(content, media_type='application/json')
 
 
 @router.get('/wallet/{wallet_id}/history',
             name='Operation history',
             response_model=List[TransactionSchema])
-async def endpoint_history(wallet_id: UUID) -> List[dict]:
+async def endpoint_history(wallet_id: UUID,
+                           response: Response,
+                           filters: HistoryFilterType = Depends(),
+                           limit: int = Query(settings.HISTORY_PAGE_SIZE, ge=1, le=settings.HISTORY_MAX_PAGE_SIZE),
+                           after: Optional[str] = None,
+                           write_token: Optional[str] = Header(None,
+                                                               alias=WRITE_TOKEN_HEADER,
+                                                               regex=WRITE_TOKEN_REGEX)) -> List[dict]:
     """
     Operation history.
 
-    :return: [WalletType]
+    Transactions are ordered from the newest, cursor of the next page is
+    returned in the ``X-Next-Cursor`` header.
+
+    :return: [TransactionSchema]
+    """
+    transactions, cursor = await history_page(await read_bind(write_token), wallet_id, filters, limit, after)
+    if cursor is not None:
+        response.headers['X-Next-Cursor'] = cursor
+    return transactions
+
+
+@router.get('/wallet/{wallet_id}/history/export',
+            name='Operation history export',
+            response_class=StreamingResponse)
+async def endpoint_history_export(wallet_id: UUID,
+                                  filters: HistoryFilterType = Depends(),
+                                  export_format: ExportFormat = Query(ExportFormat.NDJSON,
+                                                                      alias='format')) -> StreamingResponse:
+    """
+    Whole operation history export.
+
+    :return: NDJSON or CSV stream
     """
-    join = Transaction.join(Account).join(
-        Wallet,
-        Wallet.account_id == Account.id,
-    )
-    transactions = await Transaction.query.select_from(join).where(
-        Wallet.id == wallet_id,
-    ).distinct(Transaction.id).gino.all()
-    return [transaction.to_dict() for transaction in transactions]
+    media_type = 'text/csv' if export_format == ExportFormat.CSV else 'application/x-ndjson'
+    return StreamingResponse(export_history(history_query(wallet_id, filters), export_format),
+                             media_type=media_type)
+
+
+@router.get('/entry/{entry_id}',
+            name='Journal entry',
+            response_model=JournalEntrySchema)
+async def endpoint_entry(entry_id: UUID,
+                         write_token: Optional[str] = Header(None,
+                                                             alias=WRITE_TOKEN_HEADER,
+                                                             regex=WRITE_TOKEN_REGEX)) -> dict:
+    """
+    Journal entry of the transfer with both its legs.
+
+    :return: JournalEntrySchema
+    """
+    bind = await read_bind(write_token)
+    entry = await bind.first(JournalEntry.query.where(JournalEntry.id == entry_id))
+    if entry is None:
+        raise EntryDoesNotExists()
+    return {**entry.to_dict(), 'legs': [leg.to_dict() for leg in await entry.get_legs(bind)]}
 
 
 @router.post('/wallet',
              status_code=201,
              name='Create wallet',
              response_model=WalletSchema)
-async def endpoint_wallet_create(payload: InputWalletType) -> dict:
+async def endpoint_wallet_create(payload: InputWalletType, response: Response) -> dict:
     """
     Create wallet for the given user with uuid.
 
     :return: WalletType
     """
-    wallet = await create_wallet(payload.user_id)
+    wallet = await create_wallet(payload.user_id, payload.asset)
+    await set_write_token(response)
     return wallet.to_dict()
 
 
+@router.post('/wallet/batch/send',
+             name='Send money in batch',
+             response_model=List[BatchTransferResultSchema])
+async def endpoint_send_batch(payload: BatchTransferType, response: Response) -> List[dict]:
+    """
+    Transfer funds between multiple wallets at once.
+
+    Transfers are applied in the given order, result of every transfer is
+    returned at the same position.
+
+    :return: [BatchTransferResultSchema]
+    """
+    errors = await create_send_batch([
+        (transfer.wallet_id, transfer.target_wallet_id, transfer.amount) for transfer in payload.transfers
+    ])
+    await set_write_token(response)
+    return [
+        {'status_code': 201} if error is None else {'status_code': error.status_code, 'detail': error.detail}
+        for error in errors
+    ]
+
+
 @router.post('/wallet/{wallet_id}/deposit',
              status_code=201,
-             name='Make deposit')
+             name='Make deposit',
+             responses={202: {'model': OperationSchema}})
 async def endpoint_deposit(wallet_id: UUID,
-                           payload: DepositType) -> None:
+                           payload: DepositType,
+                           response: Response,
+                           idempotency_key: Optional[str] = Header(None, max_length=255)) -> Optional[dict]:
     """
     Deposit funds.
 
-    :return: None
+    Request repeated with the same ``Idempotency-Key`` header gets the
+    outcome of the first one without making another deposit. With
+    ``TRANSFER_QUEUE`` enabled the deposit is queued and the 202 response
+    carries the operation to poll.
+
+    :return: None or OperationSchema
     """
-    await create_deposit(wallet_id, **payload.dict())
+    request_hash = fingerprint('deposit', str(wallet_id), payload.json())
+    if settings.TRANSFER_QUEUE:
+        return await _enqueue(idempotency_key, request_hash, response,
+                              TransactionType.DEPOSIT, wallet_id, **payload.dict())
+    await idempotent(idempotency_key,
+                     request_hash,
+                     functools.partial(create_deposit, wallet_id, **payload.dict()))
+    await set_write_token(response)
 
 
 @router.post('/wallet/{wallet_id}/send',
              status_code=201,
-             name='Send money')
+             name='Send money',
+             responses={202: {'model': OperationSchema}})
 async def endpoint_send(wallet_id: UUID,
-                        payload: TransferType) -> None:
+                        payload: TransferType,
+                        response: Response,
+                        idempotency_key: Optional[str] = Header(None, max_length=255)) -> Optional[dict]:
     """
     Transfer funds from one wallet to another.
 
-    :return: None
+    Request repeated with the same ``Idempotency-Key`` header gets the
+    outcome of the first one without making another transfer. With
+    ``TRANSFER_QUEUE`` enabled the transfer is queued and the 202 response
+    carries the operation to poll.
+
+    :return: None or OperationSchema
     """
     if wallet_id == payload.target_wallet_id:
         raise WalletWrongException()
-    await create_send(wallet_id, **payload.dict())
+    request_hash = fingerprint('send', str(wallet_id), payload.json())
+    if settings.TRANSFER_QUEUE:
+        return await _enqueue(idempotency_key, request_hash, response,
+                              TransactionType.SEND, wallet_id, **payload.dict())
+    await idempotent(idempotency_key,
+                     request_hash,
+                     functools.partial(create_send, wallet_id, **payload.dict()))
+    await set_write_token(response)
+
+
+async def _enqueue(idempotency_key: Optional[str], request_hash: str, response: Response,
+                   kind: TransactionType, wallet_id: UUID, **transfer: Any) -> dict:
+    operation_id = id_for_key(idempotency_key, OPERATION_NAMESPACE)
+    await idempotent(idempotency_key,
+                     request_hash,
+                     functools.partial(enqueue_transfer, operation_id, kind, wallet_id, **transfer),
+                     status_code=202)
+    response.status_code = 202
+    return await endpoint_operation(operation_id)
+
+
+@router.get('/operation/{operation_id}',
+            name='Queued transfer status',
+            response_model=OperationSchema)
+async def endpoint_operation(operation_id: UUID) -> dict:
+    """
+    Status of the queued deposit or transfer.
+
+    Processed operation is committed or rejected with the status code and
+    details the synchronous request would get.
+
+    :return: OperationSchema
+    """
+    operation = await TransferOperation.get(operation_id)
+    if operation is None:
+        raise OperationDoesNotExists()
+    return operation.to_dict()
+
+
+@router.post('/wallet/{wallet_id}/hold',
+             status_code=201,
+             name='Hold money',
+             response_model=HoldSchema)
+async def endpoint_hold(wallet_id: UUID,
+                        payload: TransferType,
+                        response: Response,
+                        idempotency_key: Optional[str] = Header(None, max_length=255)) -> dict:
+    """
+    Reserve funds for the transfer captured or voided later.
+
+    Held funds cannot be spent until the hold is captured, voided or expired
+    after ``HOLD_TTL`` seconds. Request repeated with the same
+    ``Idempotency-Key`` header gets the same hold.
+
+    :return: HoldSchema
+    """
+    if wallet_id == payload.target_wallet_id:
+        raise WalletWrongException()
+    hold_id = id_for_key(idempotency_key, HOLD_NAMESPACE)
+    await idempotent(idempotency_key,
+                     fingerprint('hold', str(wallet_id), payload.json()),
+                     functools.partial(create_hold, wallet_id, hold_id=hold_id, **payload.dict()))
+    await set_write_token(response)
+    return {'id': hold_id, 'wallet_id': wallet_id, **payload.dict()}
+
+
+@router.post('/wallet/{wallet_id}/hold/{hold_id}/capture',
+             name='Capture hold')
+async def endpoint_hold_capture(wallet_id: UUID,
+                                hold_id: UUID,
+                                response: Response,
+                                idempotency_key: Optional[str] = Header(None, max_length=255)) -> None:
+    """
+    Transfer the held funds to the target wallet.
+
+    :return: None
+    """
+    await idempotent(idempotency_key,
+                     fingerprint('capture', str(wallet_id), str(hold_id)),
+                     functools.partial(capture_hold, wallet_id, hold_id),
+                     status_code=200)
+    await set_write_token(response)
+
+
+@router.post('/wallet/{wallet_id}/hold/{hold_id}/void',
+             name='Void hold')
+async def endpoint_hold_void(wallet_id: UUID,
+                             hold_id: UUID,
+                             response: Response,
+                             idempotency_key: Optional[str] = Header(None, max_length=255)) -> None:
+    """
+    Release the held funds back to the wallet.
+
+    :return: None
+    """
+    await idempotent(idempotency_key,
+                     fingerprint('void', str(wallet_id), str(hold_id)),
+                     functools.partial(void_hold, wallet_id, hold_id),
+                     status_code=200)
+    await set_write_token(response)
+
+
+@router.get('/metrics',
+            name='Metrics',
+            response_class=PlainTextResponse,
+            include_in_schema=False)
+async def endpoint_metrics() -> str:
+    """
+    Service metrics in Prometheus text format.
+
+    :return: metrics
+    """
+    return metrics.render()